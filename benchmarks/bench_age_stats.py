@@ -0,0 +1,79 @@
+"""
+Benchmark of the age statistics engines - average and above/below split of
+the same age column with the pure Python and the NumPy engine, to find the
+column size from which NumPy is faster (NUMPY_MIN_RECORDS)
+
+Usage: python benchmarks/bench_age_stats.py [--max-users 1000000] [--json out.json]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from array import array
+
+# Add the `src` directory to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+from age_stats import HAS_NUMPY, age_column_stats, partition_age_column
+
+
+# Age column with about 5% missing ages
+def generate_column(count, seed=0):
+    rng = random.Random(seed)
+    ages = array("q", (rng.randint(18, 90) for _ in range(count)))
+    valid = bytearray(rng.random() >= 0.05 for _ in range(count))
+    return ages, valid
+
+
+# Best time of a few runs of the average plus the split
+def bench_engine(engine, ages, valid, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        total, count = age_column_stats(ages, valid, engine)
+        partition_age_column(ages, valid, total / count, engine)
+        seconds = time.perf_counter() - start_time
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--max-users", type=int, default=1_000_000)
+    parser.add_argument("--json", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    if not HAS_NUMPY:
+        print("numpy is not installed, only the python engine can run.")
+        return
+
+    results = []
+    crossover = None
+    size = 16
+    print(f"{'users':>10} {'python ms':>10} {'numpy ms':>10} {'speedup':>8}")
+    while size <= args.max_users:
+        ages, valid = generate_column(size)
+        python_seconds = bench_engine("python", ages, valid)
+        numpy_seconds = bench_engine("numpy", ages, valid)
+        if crossover is None and numpy_seconds < python_seconds:
+            crossover = size
+        results.append(
+            {"users": size, "python": python_seconds, "numpy": numpy_seconds}
+        )
+        print(
+            f"{size:>10} {python_seconds * 1e3:>10.3f} {numpy_seconds * 1e3:>10.3f} "
+            f"{python_seconds / numpy_seconds:>7.1f}x"
+        )
+        size *= 4
+
+    print(f"NumPy is faster from about {crossover} users (NUMPY_MIN_RECORDS).")
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({"crossover": crossover, "results": results}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
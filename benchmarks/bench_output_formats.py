@@ -0,0 +1,81 @@
+"""
+Benchmark of the output formats - size and write time of the same users
+written as plain, gzip and zstd JSON lines and as Parquet
+
+Usage: python benchmarks/bench_output_formats.py [--users 1000000] [--json out.json]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+# Add the `src` directory to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+from json_lines_writer import encode_user_line, write_json_lines
+from output_formats import OUTPUT_FORMATS, FormattedOutput, output_file_name
+
+
+# Users shaped like the transform output, with some invalid event times
+def generate_users(count, seed=0):
+    rng = random.Random(seed)
+    names = ["Alice", "Bob", "Charlie", "David", "Eve", "Frank", "Grace", "Heidi"]
+    for index in range(count):
+        yield {
+            "UserID": str(index),
+            "UserName": rng.choice(names),
+            "UserAge": rng.randint(18, 90),
+            "EventTime": (
+                "0000-00-00T00:00:00.000Z"
+                if rng.random() < 0.01
+                else f"2024-07-{rng.randint(1, 31):02d}T{rng.randint(0, 23):02d}"
+                f":{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}.000Z"
+            ),
+        }
+
+
+def bench_format(output_format, users, directory):
+    path = os.path.join(directory, output_file_name("users.json", output_format))
+    start_time = time.perf_counter()
+    with FormattedOutput(open(path, "wb"), output_format) as writer:
+        write_json_lines(writer, users)
+    seconds = time.perf_counter() - start_time
+    return {"format": output_format, "bytes": os.path.getsize(path), "seconds": seconds}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=200_000)
+    parser.add_argument("--json", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    users = list(generate_users(args.users))
+    plain_size = sum(len(encode_user_line(user)) for user in users)
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for output_format in OUTPUT_FORMATS:
+            try:
+                results.append(bench_format(output_format, users, directory))
+            except ValueError as e:  # optional package not installed
+                print(f"{output_format:<10} skipped: {e}")
+
+    print(f"{'format':<10} {'MB':>8} {'ratio':>7} {'seconds':>8} {'users/s':>10}")
+    for result in results:
+        print(
+            f"{result['format']:<10} {result['bytes'] / 1e6:>8.2f} "
+            f"{plain_size / result['bytes']:>6.1f}x {result['seconds']:>8.2f} "
+            f"{args.users / result['seconds']:>10.0f}"
+        )
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({"users": args.users, "results": results}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""
+End-to-end benchmark of the three steps against local stand-ins - synthetic
+XML files are served by an in-process SFTP server, downloaded, transformed
+and uploaded to an in-process S3 (needs the optional `moto` package)
+
+Reports the latency, records/s, MB/s and peak RSS of every stage. The results
+can be saved as JSON and compared with an earlier run to catch regressions.
+
+Usage: python benchmarks/bench_pipeline.py [--files 4] [--users 100000]
+       [--missing-rate 0.01] [--json out.json] [--compare baseline.json]
+       [--tolerance 0.2]
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+# Add the `src` directory to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+from local_servers import LocalSFTPServer, local_s3
+from synthetic_xml import generate_files
+
+BENCH_BUCKET = "bench-bucket"
+
+
+# Peak resident set size in MB of this process and of its finished children
+def peak_rss_mb():
+    peak_kb = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    return peak_kb / 1024
+
+
+# Run one stage and collect its latency, throughput and peak memory
+def run_stage(name, function, records=None, size=None):
+    start_time = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - start_time
+    stage = {"stage": name, "seconds": seconds, "peak_rss_mb": peak_rss_mb()}
+    if records is not None:
+        stage["records_per_second"] = records / seconds
+    if size is not None:
+        stage["mb_per_second"] = size / 1e6 / seconds
+    return stage, result
+
+
+# Total size of the files of a directory tree
+def directory_size(directory):
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(directory)
+        for name in names
+    )
+
+
+def run_benchmark(files, users, missing_rate, work_dir):
+    remote_root = os.path.join(work_dir, "remote")
+    download_path = os.path.join(work_dir, "downloads")
+    input_size = sum(
+        os.path.getsize(path)
+        for path in generate_files(
+            os.path.join(remote_root, "drop"), files, users, missing_rate
+        )
+    )
+    records = files * users
+
+    with LocalSFTPServer(remote_root) as sftp_server, local_s3(BENCH_BUCKET):
+        os.environ.update(
+            {
+                "SFTP_HOST": "127.0.0.1",
+                "SFTP_PORT": str(sftp_server.port),
+                "SFTP_USER": "bench",
+                "SFTP_PASSWORD": "bench",
+                "SFTP_PATH": "/drop",
+                "DOWNLOAD_PATH": download_path,
+                "S3_BUCKET": BENCH_BUCKET,
+                "S3_PATH": "bench",
+                "AWS_ACCESS_KEY": "testing",
+                "AWS_SECRET_ACCESS_KEY": "testing",
+                "MANIFEST_PATH": "",
+                "TRANSFORM_CACHE_DIR": "",
+            }
+        )
+        # The configuration is read when the step modules are first imported
+        from day_partitions import due_partitions, map_partitions
+        from download_files_from_sftp import download_due_files
+        from transform_xml_to_json import get_xml_files, transform_partitions
+        from upload_files_to_s3 import upload_json_files_to_s3
+
+        stages = []
+        stage, downloaded = run_stage(
+            "download", download_due_files, records=records, size=input_size
+        )
+        stages.append(stage)
+        if len(downloaded) != files:
+            raise RuntimeError(f"Downloaded {len(downloaded)} of {files} files.")
+
+        partitions = due_partitions(get_xml_files(download_path))
+        stage, _ = run_stage(
+            "transform",
+            lambda: transform_partitions(partitions),
+            records=records,
+            size=input_size,
+        )
+        stages.append(stage)
+
+        output_size = directory_size("json")
+        stage, uploaded = run_stage(
+            "upload",
+            lambda: map_partitions(
+                lambda partition, _: upload_json_files_to_s3(partition), partitions
+            ),
+            size=output_size,
+        )
+        stages.append(stage)
+        uploaded_count = sum(len(stats) for stats in uploaded.values())
+        if uploaded_count != 2 * len(partitions):
+            raise RuntimeError(
+                f"Uploaded {uploaded_count} of {2 * len(partitions)} output files."
+            )
+
+    total_seconds = sum(stage["seconds"] for stage in stages)
+    return {
+        "python": platform.python_version(),
+        "files": files,
+        "users": users,
+        "missing_rate": missing_rate,
+        "input_bytes": input_size,
+        "output_bytes": output_size,
+        "stages": stages,
+        "total": {
+            "seconds": total_seconds,
+            "records_per_second": records / total_seconds,
+            "mb_per_second": input_size / 1e6 / total_seconds,
+            "peak_rss_mb": peak_rss_mb(),
+        },
+    }
+
+
+# Stages that got slower than the baseline by more than the tolerance
+def find_regressions(results, baseline, tolerance):
+    baseline_stages = {stage["stage"]: stage for stage in baseline["stages"]}
+    regressions = []
+    for stage in results["stages"]:
+        old = baseline_stages.get(stage["stage"])
+        if old and stage["seconds"] > old["seconds"] * (1 + tolerance):
+            regressions.append((stage["stage"], old["seconds"], stage["seconds"]))
+    return regressions
+
+
+# Right-aligned number, "-" when the stage has no such figure
+def format_figure(value, width, precision):
+    if value is None:
+        return f"{'-':>{width}}"
+    return f"{value:>{width}.{precision}f}"
+
+
+def print_results(results):
+    print(f"{'stage':<10} {'seconds':>8} {'records/s':>11} {'MB/s':>8} {'RSS MB':>8}")
+    for stage in results["stages"] + [dict(results["total"], stage="total")]:
+        print(
+            f"{stage['stage']:<10} {stage['seconds']:>8.3f} "
+            f"{format_figure(stage.get('records_per_second'), 11, 0)} "
+            f"{format_figure(stage.get('mb_per_second'), 8, 2)} "
+            f"{stage['peak_rss_mb']:>8.1f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--missing-rate", type=float, default=0.01)
+    parser.add_argument("--json", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file of an earlier run")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="allowed slowdown of a stage against the baseline (0.2 = 20%%)",
+    )
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)  # the outputs are written to json/<date>/
+        try:
+            results = run_benchmark(args.files, args.users, args.missing_rate, work_dir)
+        finally:
+            os.chdir(cwd)
+
+    print_results(results)
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = find_regressions(results, json.load(file), args.tolerance)
+        for stage, old_seconds, new_seconds in regressions:
+            print(f"Regression in {stage}: {old_seconds:.3f}s -> {new_seconds:.3f}s")
+        if regressions:
+            sys.exit(1)
+        print("No regression against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Benchmark of the start-up time - every command runs in a fresh interpreter,
+the bare interpreter start-up is measured too so the cost of the workflow's
+own imports can be told apart from the Python installation's
+- import of every step module and of main.py
+- a transform-only invocation: import the transform step, set up logging and
+  transform one small XML file
+The heavy SDKs loaded by each command are listed, the transform step should
+load none of them.
+
+Usage: python benchmarks/bench_startup.py [--repeat 10] [--json out.json]
+       [--budget-ms 100]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../src"))
+
+# Modules only a stage that uses them should load
+HEAVY_MODULES = ("paramiko", "boto3", "botocore", "asyncio", "http.server", "numpy")
+
+REPORT_LOADED = (
+    "import sys; "
+    "print('loaded:' + ','.join(m for m in {heavy!r} if m in sys.modules))"
+)
+
+COMMANDS = {
+    "interpreter": "pass",
+    "import transform": "import transform_xml_to_json",
+    "import download": "import download_files_from_sftp",
+    "import upload": "import upload_files_to_s3",
+    "import main": "import main",
+    "transform only": (
+        "import transform_xml_to_json as t; t.setup_logging(); "
+        "t.transform_xml_files([{xml_file!r}], max_workers=1)"
+    ),
+}
+
+SAMPLE_XML = """<Users>
+\t<User>
+\t\t<UserID>1</UserID>
+\t\t<UserName>Alice</UserName>
+\t\t<UserAge>30</UserAge>
+\t\t<EventTime>2024-07-01T10:00:00</EventTime>
+\t</User>
+</Users>
+"""
+
+
+# Best wall time of a command over a few fresh interpreters, with the heavy
+# modules it loaded
+def time_command(code, repeat, work_dir):
+    env = dict(os.environ, PYTHONPATH=SRC_DIR, DOWNLOAD_PATH=work_dir)
+    code = f"{code}; {REPORT_LOADED.format(heavy=HEAVY_MODULES)}"
+    best = None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=work_dir,
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        seconds = time.perf_counter() - start_time
+        best = seconds if best is None else min(best, seconds)
+    loaded = result.stdout.rpartition("loaded:")[2].strip()
+    return best, [name for name in loaded.split(",") if name]
+
+
+def run_benchmark(repeat):
+    with tempfile.TemporaryDirectory() as work_dir:
+        xml_file = os.path.join(work_dir, "sample.xml")
+        with open(xml_file, "w") as file:
+            file.write(SAMPLE_XML)
+
+        results = []
+        for name, code in COMMANDS.items():
+            seconds, loaded = time_command(
+                code.format(xml_file=xml_file), repeat, work_dir
+            )
+            results.append({"command": name, "ms": seconds * 1000, "loaded": loaded})
+
+    baseline = results[0]["ms"]
+    for result in results:
+        result["over_interpreter_ms"] = result["ms"] - baseline
+    return results
+
+
+def print_results(results):
+    print(f"{'command':<18} {'ms':>8} {'+ms':>8}  heavy modules loaded")
+    for result in results:
+        print(
+            f"{result['command']:<18} {result['ms']:>8.1f} "
+            f"{result['over_interpreter_ms']:>8.1f}  "
+            f"{', '.join(result['loaded']) or '-'}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--json", help="write the results to this JSON file")
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        help="exit with an error when the transform-only invocation takes "
+        "longer than this, on top of the bare interpreter",
+    )
+    args = parser.parse_args()
+
+    results = run_benchmark(args.repeat)
+    print_results(results)
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if args.budget_ms is not None:
+        transform = next(r for r in results if r["command"] == "transform only")
+        if transform["over_interpreter_ms"] > args.budget_ms or transform["loaded"]:
+            print(f"Transform-only start-up is over the {args.budget_ms} ms budget.")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Local stand-ins of the remote services for the benchmarks
+- LocalSFTPServer: an in-process paramiko SFTP server on 127.0.0.1 that serves
+  a local directory, accepting any user name and password
+- local_s3: an in-process S3 from the optional `moto` package with the bucket
+  already created
+"""
+
+import contextlib
+import os
+import socket
+import threading
+
+import paramiko
+
+
+# Accept every password login and the sftp subsystem
+class StubServer(paramiko.ServerInterface):
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+
+class StubSFTPHandle(paramiko.SFTPHandle):
+    def stat(self):
+        return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+
+# SFTP operations on the files below a local root directory
+class DirectorySFTPServer(paramiko.SFTPServerInterface):
+    def __init__(self, server, root):
+        super().__init__(server)
+        self.root = root
+
+    def _local_path(self, path):
+        return os.path.join(self.root, path.lstrip("/"))
+
+    def list_folder(self, path):
+        local_path = self._local_path(path)
+        try:
+            return [
+                paramiko.SFTPAttributes.from_stat(
+                    os.stat(os.path.join(local_path, name)), name
+                )
+                for name in os.listdir(local_path)
+            ]
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(self._local_path(path)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def open(self, path, flags, attr):
+        try:
+            handle = StubSFTPHandle(flags)
+            handle.readfile = handle.writefile = open(self._local_path(path), "rb")
+            return handle
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def remove(self, path):
+        try:
+            os.remove(self._local_path(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+
+# Serve a local directory over SFTP on a free local port
+class LocalSFTPServer:
+    def __init__(self, root):
+        self.root = root
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.transports = []
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(("127.0.0.1", 0))
+        self.port = self._socket.getsockname()[1]
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+
+    def _serve(self):
+        while True:
+            try:
+                connection, _ = self._socket.accept()
+            except OSError:
+                return  # the listening socket was closed
+            transport = paramiko.Transport(connection)
+            transport.add_server_key(self.host_key)
+            transport.set_subsystem_handler(
+                "sftp", paramiko.SFTPServer, DirectorySFTPServer, root=self.root
+            )
+            transport.start_server(server=StubServer())
+            self.transports.append(transport)
+
+    def __enter__(self):
+        self._socket.listen(16)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._socket.close()
+        for transport in self.transports:
+            transport.close()
+
+
+# In-process S3 with one empty bucket
+@contextlib.contextmanager
+def local_s3(bucket):
+    import boto3
+    from moto import mock_aws
+
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    with mock_aws():
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket=bucket)
+        yield
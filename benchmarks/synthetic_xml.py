@@ -0,0 +1,76 @@
+"""
+Synthetic XML input files shaped like the SFTP drops, with a configurable
+number of files, users per file and rate of missing fields
+
+Usage: python benchmarks/synthetic_xml.py DIRECTORY [--files 4] [--users 100000]
+       [--missing-rate 0.01] [--seed 0]
+"""
+
+import argparse
+import os
+import random
+from xml.sax.saxutils import escape
+
+USER_FIELDS = ("UserID", "UserName", "UserAge", "EventTime")
+NAMES = ["Alice", "Bob", "Charlie", "David", "Eve", "Frank", "Grace", "Heidi"]
+
+
+# Lines of one <User> element, each field is left out with missing_rate
+def user_lines(rng, user_id, missing_rate):
+    values = {
+        "UserID": str(user_id),
+        "UserName": rng.choice(NAMES),
+        "UserAge": str(rng.randint(18, 90)),
+        "EventTime": f"2024-07-{rng.randint(1, 31):02d}T{rng.randint(0, 23):02d}"
+        f":{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}",
+    }
+    lines = ["\t<User>\n"]
+    for field in USER_FIELDS:
+        if rng.random() >= missing_rate:
+            lines.append(f"\t\t<{field}>{escape(values[field])}</{field}>\n")
+    lines.append("\t</User>\n")
+    return lines
+
+
+# Write one XML file of users, returning its size in bytes
+def write_synthetic_xml(path, users, missing_rate=0.01, seed=0, first_id=1):
+    rng = random.Random(seed)
+    with open(path, "w") as file:
+        file.write('<?xml version="1.0" encoding="UTF-8"?>\n<Users>\n')
+        for user_id in range(first_id, first_id + users):
+            file.writelines(user_lines(rng, user_id, missing_rate))
+        file.write("</Users>\n")
+    return os.path.getsize(path)
+
+
+# Write file_count XML files into a directory, returning their paths
+def generate_files(directory, file_count, users, missing_rate=0.01, seed=0):
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for index in range(file_count):
+        path = os.path.join(directory, f"users_{index:04d}.xml")
+        write_synthetic_xml(
+            path, users, missing_rate, seed=seed + index, first_id=index * users + 1
+        )
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("directory")
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--missing-rate", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    paths = generate_files(
+        args.directory, args.files, args.users, args.missing_rate, args.seed
+    )
+    size = sum(os.path.getsize(path) for path in paths)
+    print(f"Wrote {len(paths)} files, {size / 1e6:.1f} MB to {args.directory}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Age statistics and above/below partitioning over an age column
+- the column is a typed int64 array of ages with a validity mask (bytearray),
+  records without a valid age are left out exactly like the None ages
+- with the optional `numpy` package large columns are summed and partitioned
+  in vectorized passes, small columns and columns with ages too large for
+  exact float comparison stay on the pure Python path
+AGE_STATS_ENGINE selects the engine: auto (default), numpy or python.
+"""
+
+import importlib.util
+from array import array
+from itertools import compress
+
+from config import get_config
+
+CONFIG = get_config()
+
+AGE_STATS_ENGINE = CONFIG.age_stats_engine
+
+# Below this many records the pure Python path is faster, see
+# benchmarks/bench_age_stats.py for the crossover on a given machine
+NUMPY_MIN_RECORDS = CONFIG.numpy_min_records
+
+# Largest age compared exactly as a float64
+MAX_EXACT_AGE = 2**53
+
+HAS_NUMPY = importlib.util.find_spec("numpy") is not None
+
+
+# Pick the engine for a column of the given size
+def use_numpy(size, engine=None):
+    engine = engine or AGE_STATS_ENGINE
+    if engine == "numpy" and not HAS_NUMPY:
+        raise ValueError("The numpy age stats engine needs the numpy package.")
+    if engine == "python" or not HAS_NUMPY:
+        return False
+    return engine == "numpy" or size >= NUMPY_MIN_RECORDS
+
+
+# Sum and count of the valid ages
+def python_age_stats(ages, valid):
+    return sum(compress(ages, valid)), valid.count(1)
+
+
+# Indexes of the valid ages above the average and at or below it
+def python_partition(ages, valid, avg_age):
+    above = array("Q")
+    below = array("Q")
+    for index, age in compress(enumerate(ages), valid):
+        (above if age > avg_age else below).append(index)
+    return above, below
+
+
+# View the column as NumPy arrays without copying
+def numpy_columns(ages, valid):
+    import numpy
+
+    return numpy.frombuffer(ages, dtype=numpy.int64), numpy.frombuffer(
+        valid, dtype=numpy.bool_
+    )
+
+
+# Vectorized sums are only exact while the ages and their sum fit the int64
+# and float64 ranges, the rare column outside them stays on the Python path
+def fits_numpy(ages, valid):
+    numpy_ages, numpy_valid = numpy_columns(ages, valid)
+    if not len(numpy_ages):
+        return True
+    largest = max(abs(int(numpy_ages.min())), abs(int(numpy_ages.max())))
+    return largest <= MAX_EXACT_AGE and largest * len(numpy_ages) < 2**63
+
+
+def numpy_age_stats(ages, valid):
+    numpy_ages, numpy_valid = numpy_columns(ages, valid)
+    valid_ages = numpy_ages[numpy_valid]
+    return int(valid_ages.sum()), len(valid_ages)
+
+
+def numpy_partition(ages, valid, avg_age):
+    import numpy
+
+    numpy_ages, numpy_valid = numpy_columns(ages, valid)
+    is_above = numpy_ages > avg_age
+    above = numpy.flatnonzero(numpy_valid & is_above)
+    below = numpy.flatnonzero(numpy_valid & ~is_above)
+    return (
+        array("Q", above.astype(numpy.uint64).tobytes()),
+        array("Q", below.astype(numpy.uint64).tobytes()),
+    )
+
+
+# Sum and count of the valid ages of a column
+def age_column_stats(ages, valid, engine=None):
+    if use_numpy(len(ages), engine) and fits_numpy(ages, valid):
+        return numpy_age_stats(ages, valid)
+    return python_age_stats(ages, valid)
+
+
+# Above/below average index arrays of a column
+def partition_age_column(ages, valid, avg_age, engine=None):
+    if use_numpy(len(ages), engine) and fits_numpy(ages, valid):
+        return numpy_partition(ages, valid, avg_age)
+    return python_partition(ages, valid, avg_age)
@@ -0,0 +1,159 @@
+"""
+Configuration of the workflow
+- the .env file is loaded and the environment variables are read once, into
+  one Config object shared by every module
+- each module keeps its settings as module constants taken from that object,
+  see the README for what every variable does
+"""
+
+import os
+from collections import namedtuple
+from functools import lru_cache
+
+
+def env_str(name, default=None):
+    return os.getenv(name, default)
+
+
+def env_int(name, default):
+    return int(os.getenv(name, str(default)))
+
+
+def env_float(name, default):
+    return float(os.getenv(name, str(default)))
+
+
+def env_bool(name, default):
+    return os.getenv(name, "true" if default else "false").lower() == "true"
+
+
+CONFIG_FIELDS = (
+    # Step 1 - SFTP
+    "sftp_host",
+    "sftp_port",
+    "sftp_user",
+    "sftp_password",
+    "sftp_path",
+    "download_path",
+    "sftp_pool_size",
+    "sftp_download_mode",
+    "sftp_chunk_size",
+    "sftp_prefetch_depth",
+    "sftp_window_size",  # None keeps the paramiko default
+    "sftp_max_packet_size",  # None keeps the paramiko default
+    "sftp_range_threshold",
+    "sftp_range_size",
+    "sftp_list_mode",
+    "sftp_file_pattern",
+    "manifest_path",
+    "partition_timezone",
+    "partition_catchup_days",
+    "partition_workers",
+    # Step 2 - transform
+    "spill_dir",
+    "event_time_cache_size",
+    "transform_workers",
+    "transform_cache_dir",
+    "transform_cache_max_bytes",
+    "day_state_dir",
+    "age_stats_engine",
+    "numpy_min_records",
+    "output_format",
+    "output_compression_level",
+    "write_local_json",
+    "stream_to_s3",
+    # Step 3 - S3
+    "s3_bucket",
+    "s3_path",
+    "aws_access_key",
+    "aws_secret_access_key",
+    "s3_endpoint_url",
+    "s3_max_pool_connections",
+    "s3_multipart_chunk_size",
+    "s3_max_concurrency",
+    "s3_upload_workers",
+    # Workflow
+    "pipeline_mode",
+    "pipeline_queue_size",
+    "watch_interval",
+    "watch_max_interval",
+    "watch_batch_size",
+    "metrics_file",
+    "metrics_port",
+    "log_format",
+    "log_level",
+)
+
+
+# Read-only settings, one attribute per field. A namedtuple rather than a
+# dataclass: importing dataclasses costs more than the rest of this module.
+class Config(namedtuple("Config", CONFIG_FIELDS)):
+    __slots__ = ()
+
+    @classmethod
+    def from_env(cls):
+        window_size = env_str("SFTP_WINDOW_SIZE")
+        max_packet_size = env_str("SFTP_MAX_PACKET_SIZE")
+        return cls(
+            sftp_host=env_str("SFTP_HOST"),
+            sftp_port=env_int("SFTP_PORT", 22),  # Port 22 is default for SFTP
+            sftp_user=env_str("SFTP_USER"),
+            sftp_password=env_str("SFTP_PASSWORD"),
+            sftp_path=env_str("SFTP_PATH"),
+            download_path=env_str("DOWNLOAD_PATH"),
+            sftp_pool_size=env_int("SFTP_POOL_SIZE", 4),
+            sftp_download_mode=env_str("SFTP_DOWNLOAD_MODE", "default"),
+            sftp_chunk_size=env_int("SFTP_CHUNK_SIZE", 1024 * 1024),
+            sftp_prefetch_depth=env_int("SFTP_PREFETCH_DEPTH", 64),
+            sftp_window_size=int(window_size) if window_size else None,
+            sftp_max_packet_size=int(max_packet_size) if max_packet_size else None,
+            sftp_range_threshold=env_int("SFTP_RANGE_THRESHOLD", 256 * 1024 * 1024),
+            sftp_range_size=env_int("SFTP_RANGE_SIZE", 64 * 1024 * 1024),
+            sftp_list_mode=env_str("SFTP_LIST_MODE", "full"),
+            sftp_file_pattern=env_str("SFTP_FILE_PATTERN", "*"),
+            manifest_path=env_str("MANIFEST_PATH"),
+            partition_timezone=env_str("PARTITION_TIMEZONE", "UTC"),
+            partition_catchup_days=env_int("PARTITION_CATCHUP_DAYS", 7),
+            partition_workers=env_int("PARTITION_WORKERS", 4),
+            spill_dir=env_str("SPILL_DIR"),
+            event_time_cache_size=env_int("EVENT_TIME_CACHE_SIZE", 65536),
+            transform_workers=env_int("TRANSFORM_WORKERS", os.cpu_count() or 1),
+            transform_cache_dir=env_str("TRANSFORM_CACHE_DIR"),
+            transform_cache_max_bytes=env_int(
+                "TRANSFORM_CACHE_MAX_BYTES", 1024 * 1024 * 1024
+            ),
+            day_state_dir=env_str("DAY_STATE_DIR"),
+            age_stats_engine=env_str("AGE_STATS_ENGINE", "auto"),
+            numpy_min_records=env_int("NUMPY_MIN_RECORDS", 512),
+            output_format=env_str("OUTPUT_FORMAT", "jsonl"),
+            output_compression_level=env_str("OUTPUT_COMPRESSION_LEVEL"),
+            write_local_json=env_bool("WRITE_LOCAL_JSON", True),
+            stream_to_s3=env_bool("STREAM_TO_S3", False),
+            s3_bucket=env_str("S3_BUCKET"),
+            s3_path=env_str("S3_PATH"),
+            aws_access_key=env_str("AWS_ACCESS_KEY"),
+            aws_secret_access_key=env_str("AWS_SECRET_ACCESS_KEY"),
+            s3_endpoint_url=env_str("S3_ENDPOINT_URL"),
+            s3_max_pool_connections=env_int("S3_MAX_POOL_CONNECTIONS", 20),
+            s3_multipart_chunk_size=env_int("S3_MULTIPART_CHUNK_SIZE", 8 * 1024 * 1024),
+            s3_max_concurrency=env_int("S3_MAX_CONCURRENCY", 10),
+            s3_upload_workers=env_int("S3_UPLOAD_WORKERS", 4),
+            pipeline_mode=env_str("PIPELINE_MODE", "sequential"),
+            pipeline_queue_size=env_int("PIPELINE_QUEUE_SIZE", 8),
+            watch_interval=env_float("WATCH_INTERVAL", 2),
+            watch_max_interval=env_float("WATCH_MAX_INTERVAL", 60),
+            watch_batch_size=env_int("WATCH_BATCH_SIZE", 64),
+            metrics_file=env_str("METRICS_FILE"),
+            metrics_port=env_str("METRICS_PORT"),
+            log_format=env_str("LOG_FORMAT", "text"),
+            log_level=env_str("LOG_LEVEL", "INFO"),
+        )
+
+
+# Load the .env file and read the configuration, only on the first call
+@lru_cache(maxsize=None)
+def get_config():
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    return Config.from_env()
@@ -0,0 +1,93 @@
+"""
+Day partitions of the input files
+- a file belongs to the day of its modification time in PARTITION_TIMEZONE
+  (UTC by default), not to the day the workflow runs, so a run just after
+  midnight still puts yesterday's files into yesterday's partition
+- every partition from PARTITION_CATCHUP_DAYS days ago up to today is due: one
+  run catches up on the days that earlier runs missed, older files are left
+  where they are and logged
+- each partition is written to json/<date>/ and uploaded under the same
+  prefix, up to PARTITION_WORKERS partitions at the same time
+"""
+
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+
+from config import get_config
+
+PARTITION_TIMEZONE = get_config().partition_timezone
+PARTITION_CATCHUP_DAYS = get_config().partition_catchup_days
+PARTITION_WORKERS = get_config().partition_workers
+
+# Partition names are ISO dates, so they sort and compare as strings
+PARTITION_FORMAT = "%Y-%m-%d"
+
+
+@lru_cache(maxsize=None)
+def get_timezone(name=None):
+    from zoneinfo import ZoneInfo
+
+    return ZoneInfo(name or PARTITION_TIMEZONE)
+
+
+# Partition of a modification time, e.g. "2024-09-10"
+def partition_of(timestamp, timezone=None):
+    moment = datetime.fromtimestamp(timestamp, timezone or get_timezone())
+    return moment.strftime(PARTITION_FORMAT)
+
+
+# Partition of the current day
+def today_partition(timezone=None):
+    return datetime.now(timezone or get_timezone()).strftime(PARTITION_FORMAT)
+
+
+# Oldest and newest due partition when today is the given partition
+@lru_cache(maxsize=16)
+def due_window(today, catchup_days):
+    oldest = date.fromisoformat(today) - timedelta(days=catchup_days)
+    return oldest.strftime(PARTITION_FORMAT), today
+
+
+# Check if a partition is due: within the catch-up window and not in the
+# future (a clock ahead of ours), which is picked up once its day comes
+def is_due(partition, today=None, catchup_days=None):
+    oldest, newest = due_window(
+        today or today_partition(),
+        PARTITION_CATCHUP_DAYS if catchup_days is None else catchup_days,
+    )
+    return oldest <= partition <= newest
+
+
+# Group local files by the partition of their modification time, oldest day
+# first, leaving out the partitions that are not due
+def due_partitions(file_paths, today=None):
+    today = today or today_partition()
+    partitions = {}
+    for file_path in file_paths:
+        partition = partition_of(os.path.getmtime(file_path))
+        if is_due(partition, today):
+            partitions.setdefault(partition, []).append(file_path)
+        else:
+            logging.warning(
+                "File %s of %s is outside the due partitions, skipped.",
+                file_path,
+                partition,
+            )
+    return sorted(partitions.items())
+
+
+# Run function(partition, file_paths) for every partition, several partitions
+# at the same time, returning the results by partition
+def map_partitions(function, partitions, max_workers=None):
+    if not partitions:
+        return {}
+    max_workers = min(max_workers or PARTITION_WORKERS, len(partitions))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            partition: executor.submit(function, partition, file_paths)
+            for partition, file_paths in partitions
+        }
+    return {partition: future.result() for partition, future in futures.items()}
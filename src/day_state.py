@@ -0,0 +1,234 @@
+"""
+Persisted running aggregate of a day partition
+- the parsed (age, json line) records of every file added to a day are kept
+  as one shard per file in <DAY_STATE_DIR>/<date>/, with the age sum and count
+  of the file in state.json
+- a file arriving later in the day only has its own records parsed and moves
+  the average in O(new records), a file sent again with new content replaces
+  the records of its earlier version
+- publishing streams the shards in file name order into the above/below
+  outputs, so they are byte for byte the outputs of a batch transform of the
+  same files. It reads every record of the day but parses no XML.
+Set DAY_STATE_DIR to keep the state between runs, e.g. DAY_STATE_DIR=./state
+"""
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+from config import get_config
+from day_partitions import is_due, map_partitions
+from metrics import RECORDS_RECLASSIFIED
+from transform_xml_to_json import (
+    SPILL_DIR,
+    iter_spilled_users,
+    open_json_file,
+    spill_xml_files,
+    write_spilled_users_by_average,
+)
+
+DAY_STATE_DIR = get_config().day_state_dir
+
+STATE_FILE = "state.json"
+
+
+# Key of a local input file, a file sent again with new content is a new file
+def file_key(file_path):
+    stat = os.stat(file_path)
+    return [os.path.basename(file_path), stat.st_size, int(stat.st_mtime)]
+
+
+class DayState:
+    def __init__(self, directory):
+        self.directory = directory
+        # file name: size, mtime, age sum and count of the file, its shard and
+        # whether the last published outputs include it
+        self.files = {}
+        self.avg_age = None  # average of the last published outputs
+        os.makedirs(directory, exist_ok=True)
+        self.load()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    @property
+    def total(self):
+        return sum(entry["total"] for entry in self.files.values())
+
+    @property
+    def count(self):
+        return sum(entry["count"] for entry in self.files.values())
+
+    @property
+    def average(self):
+        count = self.count
+        return self.total / count if count else None
+
+    def load(self):
+        try:
+            with open(self._path(STATE_FILE)) as state_file:
+                state = json.load(state_file)
+        except FileNotFoundError:
+            state = None
+
+        if state is not None:
+            self.files = state["files"]
+            self.avg_age = state["avg_age"]
+
+        # Shards that are not in the state belong to a batch that did not
+        # finish, or to a file that was replaced, they are removed
+        self.remove_unused_shards()
+
+    # Write the state to a temporary name and rename it into place
+    def save(self):
+        state = {"files": self.files, "avg_age": self.avg_age}
+        tmp_path = self._path(STATE_FILE + ".tmp")
+        with open(tmp_path, "w") as state_file:
+            json.dump(state, state_file)
+        os.replace(tmp_path, self._path(STATE_FILE))
+
+    def remove_unused_shards(self):
+        used = {entry["shard"] for entry in self.files.values()}
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                if entry.name.endswith(".shard") and entry.name not in used:
+                    os.remove(entry.path)
+
+    # Check if a local input file was already added
+    def has_file(self, file_path):
+        name, size, mtime = file_key(file_path)
+        entry = self.files.get(name)
+        return entry is not None and (entry["size"], entry["mtime"]) == (size, mtime)
+
+    # Move the spilled shard of a file into the state, in place of the shard
+    # of an earlier version of the file. `result` is the (sum, count, shard
+    # path) of spill_xml_file.
+    def add_shard(self, file_path, result):
+        total, count, shard_path = result
+        name, size, mtime = file_key(file_path)
+        shard = f"{name}-{size}-{mtime}.shard"
+        shutil.move(shard_path, self._path(shard))
+        self.files[name] = {
+            "size": size,
+            "mtime": mtime,
+            "total": total,
+            "count": count,
+            "shard": shard,
+            "published": False,
+        }
+
+    # Check if the last published outputs include every added file
+    def is_published(self):
+        return all(entry["published"] for entry in self.files.values())
+
+    # Records of every file in file name order, the order of a batch run.
+    # `moved` counts the published records whose class the new average changes.
+    def iter_records(self, avg_age, moved):
+        for name in sorted(self.files):
+            entry = self.files[name]
+            was_published = entry["published"] and self.avg_age is not None
+            with open(self._path(entry["shard"]), "rb") as shard_file:
+                for age, line in iter_spilled_users(shard_file):
+                    if was_published and (age > self.avg_age) != (age > avg_age):
+                        moved[0] += 1
+                    yield age, line
+
+    # Write the above/below outputs with the current average, unless nothing
+    # changed since they were last written. Returns the average age.
+    def publish(self, open_output=None):
+        open_output = open_output or open_json_file
+        avg_age = self.average
+        if avg_age is None:
+            logging.warning("No valid ages found for average calculation.")
+            return None
+        if self.is_published() and avg_age == self.avg_age:
+            logging.info(f"Outputs of {self.directory} are up to date.")
+            return avg_age
+
+        moved = [0]
+        write_spilled_users_by_average(
+            self.iter_records(avg_age, moved), avg_age, open_output
+        )
+        RECORDS_RECLASSIFIED.inc(moved[0])
+
+        logging.info(
+            "Published %d users of %s with average age %.2f, %d changed class.",
+            self.count,
+            self.directory,
+            avg_age,
+            moved[0],
+        )
+        self.avg_age = avg_age
+        for entry in self.files.values():
+            entry["published"] = True
+        self.save()
+        return avg_age
+
+
+# Open the state of a day partition, None when DAY_STATE_DIR is not set
+def open_day_state(partition, state_dir=None):
+    state_dir = state_dir or DAY_STATE_DIR
+    if not state_dir:
+        return None
+    return DayState(os.path.join(state_dir, partition))
+
+
+# Add the files the states do not have yet, the new files of every partition
+# are parsed together in one process pool. Returns the new files by partition.
+def add_new_files(states, partitions, max_workers=None):
+    new_files = [
+        (partition, [path for path in paths if not states[partition].has_file(path)])
+        for partition, paths in partitions
+    ]
+    file_paths = [path for _, paths in new_files for path in paths]
+    if file_paths:
+        with tempfile.TemporaryDirectory(dir=SPILL_DIR) as shard_dir:
+            results = iter(spill_xml_files(file_paths, shard_dir, max_workers))
+            for partition, paths in new_files:
+                for path in paths:
+                    states[partition].add_shard(path, next(results))
+                states[partition].save()
+                states[partition].remove_unused_shards()
+    return dict(new_files)
+
+
+# Remove the states of the days that are no longer due
+def expire_day_states(state_dir=None):
+    state_dir = state_dir or DAY_STATE_DIR
+    if not state_dir or not os.path.isdir(state_dir):
+        return
+    for partition in sorted(os.listdir(state_dir)):
+        directory = os.path.join(state_dir, partition)
+        if os.path.exists(os.path.join(directory, STATE_FILE)) and not is_due(
+            partition
+        ):
+            shutil.rmtree(directory, ignore_errors=True)
+            logging.info(f"Removed the state of the closed partition {partition}.")
+
+
+# Batch transform of day partitions through their persisted state, only the
+# files an earlier run did not add are parsed. Returns the average age by
+# partition, None for a partition without valid ages.
+def update_partitions(partitions, open_output=None, state_dir=None, max_workers=None):
+    open_output = open_output or open_json_file
+    states = {
+        partition: open_day_state(partition, state_dir) for partition, _ in partitions
+    }
+    new_files = add_new_files(states, partitions, max_workers)
+    added = sum(len(paths) for paths in new_files.values())
+    logging.info(
+        "Added %d new files, %d files were added by earlier runs.",
+        added,
+        sum(len(paths) for _, paths in partitions) - added,
+    )
+
+    avg_ages = map_partitions(
+        lambda partition, _: states[partition].publish(
+            lambda file_name: open_output(file_name, partition)
+        ),
+        partitions,
+    )
+    expire_day_states(state_dir)
+    return avg_ages
@@ -2,41 +2,74 @@
 Workflow
 - create the SFTP server connection and
 - retrieve all the files and
-- determine if the file has been modified in today and
-- copy them to local folder and delete in the server
+- determine if the file belongs to a due day partition (see day_partitions.py) and
+- copy them to local folder, keeping their modification time, and delete in the server
 """
 
+import fnmatch
+import hashlib
 import logging
-import paramiko
-from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor
-from dotenv import load_dotenv
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import os
 
-from utils import setup_logging
+from config import get_config
+from day_partitions import is_due, partition_of, today_partition
+from download_manifest import manifest_key, open_manifest
+from metrics import BYTES_DOWNLOADED, FILES_DELETED, FILES_DOWNLOADED, FILES_LISTED
+from sftp_connection_pool import SFTPConnectionPool, close_sftp
+from utils import get_transfer_stats, setup_logging
 
-# Load configuration from environment variables
-load_dotenv()
+CONFIG = get_config()
 
-SFTP_HOST = os.getenv("SFTP_HOST")
-SFTP_USER = os.getenv("SFTP_USER")
-SFTP_PASSWORD = os.getenv("SFTP_PASSWORD")
-SFTP_PATH = os.getenv("SFTP_PATH")
-DOWNLOAD_PATH = os.getenv("DOWNLOAD_PATH")
+SFTP_HOST = CONFIG.sftp_host
+SFTP_PORT = CONFIG.sftp_port
+SFTP_USER = CONFIG.sftp_user
+SFTP_PASSWORD = CONFIG.sftp_password
+SFTP_PATH = CONFIG.sftp_path
+DOWNLOAD_PATH = CONFIG.download_path
 
-# Ensure the local download directory exists
-os.makedirs(DOWNLOAD_PATH, exist_ok=True)
+# Number of independent SFTP sessions, one per download worker
+SFTP_POOL_SIZE = CONFIG.sftp_pool_size
 
-# Setup logging
-setup_logging()
+# Download tuning: "default" uses getfo, "pipelined" keeps many read requests
+# in flight, which matters on high-latency links
+SFTP_DOWNLOAD_MODE = CONFIG.sftp_download_mode
+SFTP_CHUNK_SIZE = CONFIG.sftp_chunk_size
+SFTP_PREFETCH_DEPTH = CONFIG.sftp_prefetch_depth
+# None keeps the paramiko defaults
+SFTP_WINDOW_SIZE = CONFIG.sftp_window_size
+SFTP_MAX_PACKET_SIZE = CONFIG.sftp_max_packet_size
 
+# Files at least this large are split into byte ranges that are fetched
+# concurrently over several pooled sessions
+SFTP_RANGE_THRESHOLD = CONFIG.sftp_range_threshold
+SFTP_RANGE_SIZE = CONFIG.sftp_range_size
 
-# Create sftp connection
+# "full" lists the whole directory before filtering it, "streaming" filters
+# the entries as they arrive and starts downloading before the listing ends
+SFTP_LIST_MODE = CONFIG.sftp_list_mode
+# Only the file names matching this pattern are downloaded
+SFTP_FILE_PATTERN = CONFIG.sftp_file_pattern
+
+
+# Create sftp connection, paramiko is only loaded when the step runs
 def create_sftp_connection():
+    import paramiko
+
+    transport_options = {}
+    if SFTP_WINDOW_SIZE is not None:
+        transport_options["default_window_size"] = SFTP_WINDOW_SIZE
+    if SFTP_MAX_PACKET_SIZE is not None:
+        transport_options["default_max_packet_size"] = SFTP_MAX_PACKET_SIZE
     try:
-        transport = paramiko.Transport((SFTP_HOST, 22))  # Port 22 is default for SFTP
+        transport = paramiko.Transport((SFTP_HOST, SFTP_PORT), **transport_options)
         transport.connect(username=SFTP_USER, password=SFTP_PASSWORD)
-        sftp = paramiko.SFTPClient.from_transport(transport)
+        sftp = paramiko.SFTPClient.from_transport(
+            transport,
+            window_size=SFTP_WINDOW_SIZE,
+            max_packet_size=SFTP_MAX_PACKET_SIZE,
+        )
         logging.info("SFTP connection established.")
         return sftp
     except Exception as e:
@@ -48,6 +81,7 @@ def create_sftp_connection():
 def get_files_from_sftp(sftp, pathname):
     try:
         file_list = sftp.listdir_attr(pathname)  # Retrieve files with attributes
+        FILES_LISTED.inc(len(file_list))
         logging.info(f"Files retrieved from SFTP server {sftp}{pathname}.")
         return file_list
     except Exception as e:
@@ -55,62 +89,383 @@ def get_files_from_sftp(sftp, pathname):
         return []
 
 
-# Check if a file is modified today
-def is_modified_today(file_attr):
-    last_modified_time = file_attr.st_mtime
-    file_date = datetime.fromtimestamp(last_modified_time).date()
-    today_date = datetime.now().date()
+# Yield the attributes of the files in the pathname as the server sends them,
+# keeping only those accepted by the predicate
+def iter_files_from_sftp(sftp, pathname, predicate=None):
+    for file_attr in sftp.listdir_iter(pathname):
+        FILES_LISTED.inc()
+        if predicate is None or predicate(file_attr):
+            yield file_attr
+    logging.info(f"Files streamed from SFTP server {sftp}{pathname}.")
+
+
+# Check if a file should be downloaded: its name matches the pattern and its
+# day partition is due
+def is_due_file(file_attr, pattern=None):
+    pattern = pattern or SFTP_FILE_PATTERN
+    if pattern != "*" and not fnmatch.fnmatchcase(file_attr.filename, pattern):
+        return False
+    return is_in_due_partition(file_attr)
+
+
+# Check if a file was modified on a due day: today or a day earlier runs
+# missed, in the partition timezone
+def is_in_due_partition(file_attr, today=None):
+    partition = partition_of(file_attr.st_mtime)
+    today = today or today_partition()
+
+    # Formatted only when debug logging is on, this runs for every remote file
+    logging.debug("File %s partition: %s, Today: %s", file_attr, partition, today)
+
+    return is_due(partition, today)
 
-    logging.info(f"File {file_attr} date: {file_date}, Today date: {today_date}")
 
-    return file_date == today_date
+# Give the local copy the modification time of the remote file, the local
+# files are assigned to their day partition by it
+def keep_remote_mtime(local_file_path, file_attr):
+    os.utime(local_file_path, (file_attr.st_mtime, file_attr.st_mtime))
+
+
+# Download a remote file with many outstanding read requests at once
+def download_file_pipelined(
+    sftp, remote_path, local_file, chunk_size=None, prefetch_depth=None
+):
+    chunk_size = chunk_size or SFTP_CHUNK_SIZE
+    prefetch_depth = prefetch_depth or SFTP_PREFETCH_DEPTH
+
+    size = 0
+    with sftp.open(remote_path, "rb") as remote_file:
+        file_size = remote_file.stat().st_size
+        remote_file.prefetch(file_size, max_concurrent_requests=prefetch_depth)
+        while True:
+            data = remote_file.read(chunk_size)
+            if not data:
+                break
+            local_file.write(data)
+            size += len(data)
+
+    return size
 
 
 # Download and delete the files from the SFTP server
-def download_and_delete_file(sftp, file_attr):
+def download_and_delete_file(sftp, file_attr, manifest=None):
     try:
         file_path = os.path.join(SFTP_PATH, file_attr.filename)
         local_file_path = os.path.join(DOWNLOAD_PATH, file_attr.filename)
 
         # Download the file using streaming for large files
+        start_time = time.perf_counter()
         with open(local_file_path, "wb") as local_file:
-            sftp.getfo(file_path, local_file)  # Stream the file content
+            if SFTP_DOWNLOAD_MODE == "pipelined":
+                size = download_file_pipelined(sftp, file_path, local_file)
+            else:
+                size = sftp.getfo(file_path, local_file)  # Stream the file content
+        stats = get_transfer_stats(
+            file_attr.filename,
+            int(size),
+            time.perf_counter() - start_time,
+            SFTP_DOWNLOAD_MODE,
+        )
+        keep_remote_mtime(local_file_path, file_attr)
+        FILES_DOWNLOADED.inc()
+        BYTES_DOWNLOADED.inc(stats["bytes"])
 
-        logging.info(f"File {file_attr.filename} downloaded to {local_file_path}.")
+        logging.info(
+            f"File {file_attr.filename} downloaded to {local_file_path}: "
+            f"{stats['bytes']} bytes in {stats['seconds']:.3f}s "
+            f"({stats['mb_per_second']:.2f} MB/s, mode {SFTP_DOWNLOAD_MODE})."
+        )
+        if manifest is not None:
+            manifest.mark_downloaded(file_attr)
 
         # Delete the file from the SFTP server after downloading
         sftp.remove(file_path)
+        FILES_DELETED.inc()
         logging.info(f"File {file_attr.filename} deleted from SFTP server.")
+        return stats
     except Exception as e:
         logging.error(f"Error downloading or deleting file: {e}")
+        return None
 
 
-# Main function to execute the process of Step 1
-def download_today_files():
+# Split a file size into (offset, length) byte ranges
+def split_ranges(size, range_size):
+    return [
+        (offset, min(range_size, size - offset))
+        for offset in range(0, size, range_size)
+    ]
 
-    # create the connection
-    sftp = create_sftp_connection()
 
-    if not sftp:
+# Fetch one byte range with a pooled session and write it in place with
+# positional writes, returning the sha256 of the received bytes and their count
+def download_range(pool, remote_path, fd, offset, length, chunk_size=None):
+    chunk_size = chunk_size or SFTP_CHUNK_SIZE
+    chunks = [
+        (offset + chunk_offset, chunk_length)
+        for chunk_offset, chunk_length in split_ranges(length, chunk_size)
+    ]
+
+    digest = hashlib.sha256()
+    received = 0
+    with pool.connection() as sftp:
+        with sftp.open(remote_path, "rb") as remote_file:
+            # readv keeps the read requests of the whole range in flight
+            for (chunk_offset, _), data in zip(chunks, remote_file.readv(chunks)):
+                os.pwrite(fd, data, chunk_offset)
+                digest.update(data)
+                received += len(data)
+
+    return digest.hexdigest(), received
+
+
+# Hash a byte range of the local file
+def hash_local_range(fd, offset, length, hash_algorithm="sha256", chunk_size=None):
+    chunk_size = chunk_size or SFTP_CHUNK_SIZE
+    digest = hashlib.new(hash_algorithm)
+    for chunk_offset, chunk_length in split_ranges(length, chunk_size):
+        digest.update(os.pread(fd, chunk_length, offset + chunk_offset))
+    return digest.hexdigest()
+
+
+# Check the downloaded file against the remote one before it is deleted:
+# every range received all its bytes and they were written as received, the
+# remote file has the size and mtime it was listed with (a file still being
+# written has grown or changed since), and when the server supports the
+# check-file extension, the server side hash matches
+def verify_ranged_download(pool, remote_path, fd, file_attr, range_results):
+    for (offset, length), (digest, received) in range_results.items():
+        if received != length:
+            raise IOError(
+                f"Short read for {remote_path} at offset {offset}: "
+                f"{received} of {length} bytes"
+            )
+        if hash_local_range(fd, offset, length) != digest:
+            raise IOError(f"Checksum mismatch for {remote_path} at offset {offset}")
+
+    with pool.connection() as sftp:
+        remote_attr = sftp.stat(remote_path)
+        if remote_attr.st_size != file_attr.st_size or int(remote_attr.st_mtime) != int(
+            file_attr.st_mtime
+        ):
+            raise IOError(f"File {remote_path} changed while it was downloaded")
+
+        with sftp.open(remote_path, "rb") as remote_file:
+            try:
+                remote_digest = remote_file.check("sha1").hex()
+            except IOError:
+                return  # check-file is optional, the range checksums still apply
+
+    if hash_local_range(fd, 0, file_attr.st_size, hash_algorithm="sha1") != (
+        remote_digest
+    ):
+        raise IOError(f"Checksum mismatch for {remote_path}")
+
+
+# Download a large file as concurrent byte ranges into a preallocated local
+# file, verify it and only then delete it from the SFTP server
+def download_and_delete_file_in_ranges(pool, file_attr, range_size=None, manifest=None):
+    range_size = range_size or SFTP_RANGE_SIZE
+    file_path = os.path.join(SFTP_PATH, file_attr.filename)
+    local_file_path = os.path.join(DOWNLOAD_PATH, file_attr.filename)
+    size = file_attr.st_size
+
+    start_time = time.perf_counter()
+    fd = os.open(local_file_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.ftruncate(fd, size)  # preallocate so the ranges can be written in place
+
+        with ThreadPoolExecutor(max_workers=pool.size) as executor:
+            futures = {
+                executor.submit(download_range, pool, file_path, fd, offset, length): (
+                    offset,
+                    length,
+                )
+                for offset, length in split_ranges(size, range_size)
+            }
+            range_results = {
+                futures[future]: future.result() for future in as_completed(futures)
+            }
+
+        verify_ranged_download(pool, file_path, fd, file_attr, range_results)
+        keep_remote_mtime(local_file_path, file_attr)
+    except Exception as e:
+        os.close(fd)
+        os.remove(local_file_path)
+        logging.error(f"Error downloading file {file_attr.filename} in ranges: {e}")
+        return None
+    os.close(fd)
+
+    stats = get_transfer_stats(
+        file_attr.filename, size, time.perf_counter() - start_time, "ranged"
+    )
+    FILES_DOWNLOADED.inc()
+    BYTES_DOWNLOADED.inc(size)
+    logging.info(
+        f"File {file_attr.filename} downloaded to {local_file_path} in "
+        f"{len(range_results)} ranges: {stats['bytes']} bytes in "
+        f"{stats['seconds']:.3f}s ({stats['mb_per_second']:.2f} MB/s)."
+    )
+    if manifest is not None:
+        manifest.mark_downloaded(file_attr)
+
+    remove_remote_file(pool, file_attr)
+    return stats
+
+
+# Delete a downloaded file from the SFTP server with a pooled session
+def remove_remote_file(pool, file_attr):
+    try:
+        with pool.connection() as sftp:
+            sftp.remove(os.path.join(SFTP_PATH, file_attr.filename))
+        FILES_DELETED.inc()
+        logging.info(f"File {file_attr.filename} deleted from SFTP server.")
+    except Exception as e:
+        logging.error(f"Error deleting file {file_attr.filename}: {e}")
+
+
+# Download one file with a session checked out from the pool
+def download_with_pool(pool, file_attr, manifest=None):
+    # Split a single large file across several sessions
+    if pool.size > 1 and file_attr.st_size >= SFTP_RANGE_THRESHOLD:
+        return download_and_delete_file_in_ranges(pool, file_attr, manifest=manifest)
+
+    try:
+        with pool.connection() as sftp:
+            return download_and_delete_file(sftp, file_attr, manifest)
+    except ConnectionError as e:
+        logging.error(f"Error downloading file {file_attr.filename}: {e}")
+        return None
+
+
+# Log the overall throughput of a download run
+def log_transfer_summary(transfer_stats):
+    if not transfer_stats:
         return
+    total_bytes = sum(int(stats["bytes"]) for stats in transfer_stats)
+    total_seconds = sum(float(stats["seconds"]) for stats in transfer_stats)
+    logging.info(
+        f"Downloaded {len(transfer_stats)} files, {total_bytes} bytes, "
+        f"{total_seconds:.3f}s of transfer time."
+    )
+
+
+# List the files of the due partitions with a pooled session, None if not
+# connected
+def get_due_files(pool):
+    try:
+        # get all the files on the server
+        with pool.connection() as sftp:
+            file_list = get_files_from_sftp(sftp, SFTP_PATH)
+    except ConnectionError:
+        return None
+
+    # identify files modified on a due day
+    due_files = [file_attr for file_attr in file_list if is_due_file(file_attr)]
+    logging.info(
+        "%d of %d listed files belong to due partitions.",
+        len(due_files),
+        len(file_list),
+    )
+    return due_files
+
+
+# Leave out the files the manifest already has on local disk; a run that
+# crashed before deleting them from the server only retries the delete
+def iter_new_files(pool, file_attrs, manifest):
+    downloaded = manifest.downloaded_keys()
+    for file_attr in file_attrs:
+        if manifest_key(file_attr) not in downloaded:
+            yield file_attr
+        elif os.path.exists(os.path.join(DOWNLOAD_PATH, file_attr.filename)):
+            logging.info(f"File {file_attr.filename} was already downloaded.")
+            remove_remote_file(pool, file_attr)
+        else:
+            yield file_attr  # the local copy is gone, fetch it again
+
+
+# List version of iter_new_files, the list is returned as is without manifest
+def skip_downloaded_files(pool, file_list, manifest):
+    if manifest is None:
+        return file_list
+    return list(iter_new_files(pool, file_list, manifest))
+
+
+# Download the files of a listing with the pooled sessions, each file is
+# submitted as soon as the listing yields it
+def download_files(pool, file_attrs, pool_size, manifest=None):
+    if manifest is not None:
+        file_attrs = iter_new_files(pool, file_attrs, manifest)
+
+    # Download files in parallel using threads
+    with ThreadPoolExecutor(max_workers=pool_size) as executor:
+        futures = []
+        try:
+            for file_attr in file_attrs:
+                futures.append(
+                    executor.submit(download_with_pool, pool, file_attr, manifest)
+                )
+        except Exception as e:
+            # The files already submitted are still downloaded
+            logging.error(f"Failed to list files: {e}")
+
+    if not futures:
+        logging.info("No file found for the due partitions.")
+        return []
+
+    transfer_stats = [
+        future.result() for future in futures if future.result() is not None
+    ]
+    log_transfer_summary(transfer_stats)
+    return transfer_stats
+
+
+# Stream the listing over its own session while the pooled sessions download.
+# The listing is not taken from the pool: it stays open until the last entry,
+# and the downloads and deletes would wait for it forever with one session.
+def download_streamed_listing(pool, pool_size, manifest=None):
+    sftp = create_sftp_connection()
+    if sftp is None:
+        return []
+    try:
+        return download_files(
+            pool,
+            iter_files_from_sftp(sftp, SFTP_PATH, is_due_file),
+            pool_size,
+            manifest,
+        )
+    finally:
+        close_sftp(sftp)
+
+
+# Main function to execute the process of Step 1
+def download_due_files(pool_size=None, manifest=None):
+    if pool_size is None:
+        pool_size = SFTP_POOL_SIZE
+    own_manifest = manifest is None
+    if own_manifest:
+        manifest = open_manifest()
 
-    # get all the files on the server
-    file_list = get_files_from_sftp(sftp, SFTP_PATH)
+    # Ensure the local download directory exists
+    os.makedirs(DOWNLOAD_PATH, exist_ok=True)
 
-    # identify files modified today
-    today_files = [file_attr for file_attr in file_list if is_modified_today(file_attr)]
+    # create the connection pool, each download worker gets its own session
+    pool = SFTPConnectionPool(create_sftp_connection, size=pool_size)
 
-    if not today_files:
-        logging.info("No file found for today.")
+    if SFTP_LIST_MODE == "streaming":
+        transfer_stats = download_streamed_listing(pool, pool_size, manifest)
     else:
-        # Download files in parallel using threads
-        with ThreadPoolExecutor(max_workers=4) as executor:
-            for file_attr in today_files:
-                executor.submit(download_and_delete_file, sftp, file_attr)
+        due_files = get_due_files(pool)
+        if due_files is None:
+            transfer_stats = []
+        else:
+            transfer_stats = download_files(pool, due_files, pool_size, manifest)
 
-    sftp.close()  # Close the SFTP connection after the task is done
-    logging.info("SFTP connection closed.")
+    pool.close()  # Close the SFTP connections after the task is done
+    if own_manifest and manifest is not None:
+        manifest.close()
+    return transfer_stats
 
 
 if __name__ == "__main__":
-    download_today_files()
+    setup_logging()
+    download_due_files()
@@ -0,0 +1,114 @@
+"""
+Persistent manifest of the processed SFTP files, kept in SQLite
+- every remote file is keyed by (filename, size, mtime), so a file sent again
+  with new content is a new entry
+- the download, transform and upload steps record when they finished a file,
+  a rerun after a crash only does the missing work
+- the keys and the finished file names are loaded in one query into sets, so
+  checking a listing of 100k+ entries costs one set lookup per entry
+Set MANIFEST_PATH to enable it, e.g. MANIFEST_PATH=./manifest.sqlite3
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+from config import get_config
+
+MANIFEST_PATH = get_config().manifest_path
+
+MANIFEST_STAGES = ("downloaded", "transformed", "uploaded")
+
+
+# Manifest key of a remote file attribute
+def manifest_key(file_attr):
+    return (file_attr.filename, int(file_attr.st_size), int(file_attr.st_mtime))
+
+
+class DownloadManifest:
+    def __init__(self, path):
+        self.path = path
+        # The download workers share one connection, the lock serializes them
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS files (
+                    filename TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime INTEGER NOT NULL,
+                    downloaded_at REAL,
+                    transformed_at REAL,
+                    uploaded_at REAL,
+                    PRIMARY KEY (filename, size, mtime)
+                )
+                """)
+
+    # Record that a remote file is fully on local disk
+    def mark_downloaded(self, file_attr):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT INTO files (filename, size, mtime, downloaded_at) "
+                "VALUES (?, ?, ?, ?) ON CONFLICT (filename, size, mtime) "
+                "DO UPDATE SET downloaded_at = excluded.downloaded_at",
+                (*manifest_key(file_attr), time.time()),
+            )
+
+    # Keys of the remote files already downloaded
+    def downloaded_keys(self):
+        with self._lock:
+            return set(
+                self._connection.execute(
+                    "SELECT filename, size, mtime FROM files "
+                    "WHERE downloaded_at IS NOT NULL"
+                )
+            )
+
+    # Record that the transform or upload step finished the given files. A
+    # file the manifest never saw (e.g. copied into the download folder by
+    # hand) gets a row without remote size and mtime, so it stops being pending.
+    def mark(self, filenames, stage):
+        if stage not in MANIFEST_STAGES:
+            raise ValueError(f"Unknown manifest stage {stage}.")
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.executemany(
+                f"UPDATE files SET {stage}_at = ? "
+                f"WHERE filename = ? AND {stage}_at IS NULL",
+                [(now, filename) for filename in filenames],
+            )
+            self._connection.executemany(
+                f"INSERT INTO files (filename, size, mtime, {stage}_at) "
+                f"SELECT ?, 0, 0, ? WHERE NOT EXISTS "
+                f"(SELECT 1 FROM files WHERE filename = ?)",
+                [(filename, now, filename) for filename in filenames],
+            )
+
+    # File names the given stage has not finished yet, files unknown to the
+    # manifest (e.g. copied into the download folder by hand) are pending
+    def pending(self, filenames, stage):
+        if stage not in MANIFEST_STAGES:
+            raise ValueError(f"Unknown manifest stage {stage}.")
+        with self._lock:
+            finished = {
+                filename
+                for (filename,) in self._connection.execute(
+                    f"SELECT filename FROM files GROUP BY filename "
+                    f"HAVING COUNT(*) = COUNT({stage}_at)"
+                )
+            }
+        return [filename for filename in filenames if filename not in finished]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+# Open the configured manifest, None when MANIFEST_PATH is not set
+def open_manifest(path=None):
+    path = path or MANIFEST_PATH
+    if not path:
+        return None
+    return DownloadManifest(path)
@@ -0,0 +1,67 @@
+"""
+Fast JSON lines serializer for the fixed user schema
+- encode a record with a template and the C string escaper of the json module
+  instead of the generic encoder, keeping the output of json.dumps byte for byte
+- collect the encoded lines of a batch and write them as one large block
+"""
+
+import json
+from json.encoder import encode_basestring_ascii
+
+USER_FIELDS = ("UserID", "UserName", "UserAge", "EventTime")
+
+# Number of records encoded before one block is written
+JSON_LINES_BATCH_SIZE = 4096
+
+
+# Encode one user as a JSON line, same bytes as json.dumps(user) + "\n"
+def encode_user_line(user):
+    age = user.get("UserAge")
+    if tuple(user) != USER_FIELDS or not (age is None or type(age) is int):
+        # Anything outside the fixed schema goes through the generic encoder
+        return json.dumps(user) + "\n"
+
+    try:
+        return encode_user_fields(
+            user["UserID"], user["UserName"], age, user["EventTime"]
+        )
+    except TypeError:  # a field that is not a string
+        return json.dumps(user) + "\n"
+
+
+# Encode the four fields of a user, the strings must be str and the age an
+# int or None
+def encode_user_fields(user_id, user_name, user_age, event_time):
+    return (
+        '{"UserID": '
+        + encode_basestring_ascii(user_id)
+        + ', "UserName": '
+        + encode_basestring_ascii(user_name)
+        + ', "UserAge": '
+        + ("null" if user_age is None else str(user_age))
+        + ', "EventTime": '
+        + encode_basestring_ascii(event_time)
+        + "}\n"
+    )
+
+
+# Write users as JSON lines in large blocks, returning the number of records
+def write_json_lines(file, users, batch_size=JSON_LINES_BATCH_SIZE):
+    return write_lines(file, map(encode_user_line, users), batch_size)
+
+
+# Write encoded lines in large blocks, returning the number of lines
+def write_lines(file, lines, batch_size=JSON_LINES_BATCH_SIZE):
+    batch = []
+    count = 0
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= batch_size:
+            file.write("".join(batch))
+            count += len(batch)
+            batch.clear()
+
+    if batch:
+        file.write("".join(batch))
+        count += len(batch)
+    return count
@@ -1,44 +1,142 @@
+import asyncio
 import logging
 import os
 
-from dotenv import load_dotenv
-from transform_xml_to_json import transform_xml_to_json
-from upload_files_to_s3 import upload_json_files_to_s3
-from download_files_from_sftp import download_today_files
+from config import get_config
+from day_partitions import due_partitions, map_partitions
+from day_state import update_partitions
+from transform_xml_to_json import get_xml_files, transform_partitions
+from upload_files_to_s3 import uploaded_all_outputs, upload_json_files_to_s3
+from download_files_from_sftp import download_due_files
+from download_manifest import open_manifest
+from metrics import (
+    METRICS_FILE,
+    METRICS_PORT,
+    serve_metrics,
+    time_stage,
+    write_metrics_file,
+)
+from output_sinks import needs_upload, open_output
+from pipeline import run_pipeline
 from utils import setup_logging
+from watch import run_watch
 
-# Load configuration from environment variables
-load_dotenv()
+CONFIG = get_config()
 
-DOWNLOAD_PATH = os.getenv("DOWNLOAD_PATH")
+DOWNLOAD_PATH = CONFIG.download_path
+
+# With a day state directory only the files earlier runs did not add are parsed
+DAY_STATE_DIR = CONFIG.day_state_dir
+
+# "sequential" runs the three steps one after another, "async" overlaps them,
+# "watch" keeps running and publishes new files as they land
+PIPELINE_MODE = CONFIG.pipeline_mode
+
+
+# Run the three steps one after another for every due day partition, with a
+# manifest only the partitions a previous run did not finish are processed
+# again
+def run_steps(manifest=None):
+    # Step 1: Download the files of the due partitions from the SFTP server
+    logging.info("Starting the process: Step 1 - Download files from SFTP server")
+    with time_stage("download"):
+        download_due_files(manifest=manifest)
+
+    partitions = due_partitions(get_xml_files(DOWNLOAD_PATH))
+    if manifest is not None:
+        partitions = [
+            (partition, file_paths)
+            for partition, file_paths in partitions
+            if manifest.pending(file_names_of(file_paths), "uploaded")
+        ]
+    if not partitions:
+        logging.info("Every downloaded file was already transformed and uploaded.")
+        return
+    logging.info(f"Processing the partitions {[day for day, _ in partitions]}.")
+
+    # Step 2: Transform the XML files of each partition into JSON at once so
+    # the average age is computed across every file of the day
+    logging.info("Starting the process: Step 2 - Transform XML files to JSON")
+    with time_stage("transform"):
+        if DAY_STATE_DIR:
+            avg_ages = update_partitions(partitions, open_output=open_output)
+        else:
+            avg_ages = transform_partitions(partitions, open_output=open_output)
+    transformed = [
+        (partition, file_paths)
+        for partition, file_paths in partitions
+        if avg_ages.get(partition) is not None
+    ]
+    if manifest is not None:
+        for _, file_paths in transformed:
+            manifest.mark(file_names_of(file_paths), "transformed")
+
+    # Step 3: Upload the generated JSON files of each partition to S3
+    logging.info("Starting the process: Step 3 - Upload JSON files to S3")
+    if needs_upload():
+        with time_stage("upload"):
+            uploaded = map_partitions(
+                lambda partition, _: uploaded_all_outputs(
+                    upload_json_files_to_s3(partition)
+                ),
+                transformed,
+            )
+    else:
+        logging.info("JSON files were streamed to S3 during Step 2.")
+        uploaded = {partition: True for partition, _ in transformed}
+    for partition, file_paths in transformed:
+        if uploaded.get(partition):
+            if manifest is not None:
+                manifest.mark(file_names_of(file_paths), "uploaded")
+        else:
+            logging.error(
+                "Upload of partition %s failed, the next run uploads it again.",
+                partition,
+            )
+
+
+# Base names of local files, as the manifest records them
+def file_names_of(file_paths):
+    return [os.path.basename(file_path) for file_path in file_paths]
 
 
 def main_workflow():
     # Setup logging
     setup_logging()
 
+    # Serve the metrics for scraping while the workflow runs
+    metrics_server = serve_metrics() if METRICS_PORT else None
+
     try:
-        # Step 1: Download today's files from the SFTP server
-        logging.info("Starting the process: Step 1 - Download files from SFTP server")
-        download_today_files()
-
-        # Step 2: Locate and transform the downloaded XML files into JSON
-        logging.info("Starting the process: Step 2 - Transform XML files to JSON")
-        for file_name in os.listdir(DOWNLOAD_PATH):
-            if file_name.endswith(".xml"):
-                xml_file_path = os.path.join(DOWNLOAD_PATH, file_name)
-                logging.info(f"Processing file: {xml_file_path}")
-                transform_xml_to_json(xml_file_path)
-
-        # Step 3: Upload the generated JSON files to S3
-        logging.info("Starting the process: Step 3 - Upload JSON files to S3")
-        upload_json_files_to_s3()
+        if PIPELINE_MODE == "async":
+            logging.info("Starting the process: asynchronous pipeline")
+            with time_stage("pipeline"):
+                asyncio.run(run_pipeline())
+            logging.info("Process completed successfully!")
+            return
+
+        if PIPELINE_MODE == "watch":
+            logging.info("Starting the process: watch mode")
+            run_watch()
+            return
+
+        manifest = open_manifest()  # None unless MANIFEST_PATH is set
+        try:
+            run_steps(manifest)
+        finally:
+            if manifest is not None:
+                manifest.close()
 
         logging.info("Process completed successfully!")
 
     except Exception as e:
         logging.error(f"An error occurred: {e}")
         raise  # Reraise the exception if necessary for higher-level handling
+    finally:
+        if METRICS_FILE:
+            write_metrics_file()
+        if metrics_server is not None:
+            metrics_server.shutdown()
 
 
 if __name__ == "__main__":
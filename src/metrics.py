@@ -0,0 +1,241 @@
+"""
+Process metrics of the three steps - counters and histograms
+- the steps record into one registry: files listed/downloaded/deleted, bytes
+  transferred, records parsed, missing fields, parse time per file and upload
+  latency, plus the duration of every stage of main.py
+- the registry is exported in the OpenMetrics text format, written to a file
+  (METRICS_FILE) or served for scraping on a local port (METRICS_PORT)
+- the XML files parsed in worker processes send their metrics back to the
+  parent with run_with_metrics()
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+from config import get_config
+
+METRICS_FILE = get_config().metrics_file
+METRICS_PORT = get_config().metrics_port
+
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# Upper bounds in seconds of the duration histograms
+DEFAULT_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900)
+
+
+# Label set of a sample as it is written, e.g. {field="UserAge"}
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (
+            name,
+            str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'),
+        )
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Counter:
+    type_name = "counter"
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.values = {}  # sorted label tuple: value
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self.values.get(tuple(sorted(labels.items())), 0)
+
+    def samples(self):
+        for key, value in sorted(self.values.items()):
+            yield f"{self.name}_total{format_labels(key)} {value}"
+
+    def dump(self):
+        return dict(self.values)
+
+    def merge(self, values):
+        with self._lock:
+            for key, value in values.items():
+                self.values[key] = self.values.get(key, 0) + value
+
+
+class Histogram:
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.values = {}  # sorted label tuple: [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def count(self, **labels):
+        state = self.values.get(tuple(sorted(labels.items())))
+        return state[-1] if state else 0
+
+    def samples(self):
+        for key, state in sorted(self.values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, state):
+                cumulative += bucket_count
+                labels = format_labels(key + (("le", bound),))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = format_labels(key + (("le", "+Inf"),))
+            yield f"{self.name}_bucket{labels} {state[-1]}"
+            yield f"{self.name}_sum{format_labels(key)} {state[-2]}"
+            yield f"{self.name}_count{format_labels(key)} {state[-1]}"
+
+    def dump(self):
+        return {key: list(state) for key, state in self.values.items()}
+
+    def merge(self, values):
+        with self._lock:
+            for key, state in values.items():
+                current = self.values.setdefault(key, [0] * len(state))
+                for index, value in enumerate(state):
+                    current[index] += value
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+
+    def counter(self, name, documentation):
+        return self.metrics.setdefault(name, Counter(name, documentation))
+
+    def histogram(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        return self.metrics.setdefault(name, Histogram(name, documentation, buckets))
+
+    # All the metrics in the OpenMetrics text format
+    def render(self):
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.extend(metric.samples())
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    # Picklable copy of the values, to be merged into another registry
+    def dump(self):
+        return {name: metric.dump() for name, metric in self.metrics.items()}
+
+    def merge(self, dumped):
+        for name, values in dumped.items():
+            if name in self.metrics:
+                self.metrics[name].merge(values)
+
+    def reset(self):
+        for metric in self.metrics.values():
+            with metric._lock:
+                metric.values.clear()
+
+
+REGISTRY = MetricsRegistry()
+
+FILES_LISTED = REGISTRY.counter("sftp_files_listed", "Files listed on the SFTP server")
+FILES_DOWNLOADED = REGISTRY.counter(
+    "sftp_files_downloaded", "Files downloaded from the SFTP server"
+)
+FILES_DELETED = REGISTRY.counter(
+    "sftp_files_deleted", "Files deleted from the SFTP server"
+)
+BYTES_DOWNLOADED = REGISTRY.counter(
+    "sftp_downloaded_bytes", "Bytes downloaded from the SFTP server"
+)
+RECORDS_PARSED = REGISTRY.counter("xml_records_parsed", "Users parsed from XML files")
+FIELD_WARNINGS = REGISTRY.counter(
+    "xml_field_warnings", "Missing or empty fields by field name"
+)
+FIELD_ERRORS = REGISTRY.counter(
+    "xml_invalid_fields", "Fields with a value that cannot be converted by field name"
+)
+PARSE_SECONDS = REGISTRY.histogram("xml_parse_seconds", "Parse time of one XML file")
+RECORDS_RECLASSIFIED = REGISTRY.counter(
+    "day_state_reclassified_records",
+    "Users moved between the above and below outputs by a new average",
+)
+BYTES_UPLOADED = REGISTRY.counter("s3_uploaded_bytes", "Bytes uploaded to S3")
+UPLOAD_SECONDS = REGISTRY.histogram("s3_upload_seconds", "Upload time of one file")
+STAGE_SECONDS = REGISTRY.histogram("stage_seconds", "Duration of a workflow stage")
+LANDING_SECONDS = REGISTRY.histogram(
+    "watch_landing_seconds",
+    "Time from a file landing on the SFTP server to its outputs being published",
+)
+
+
+# Record the duration of a workflow stage
+@contextmanager
+def time_stage(stage):
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start_time, stage=stage)
+
+
+# Run a function in a worker process and return its result together with the
+# metrics it recorded, see merge_worker_metrics()
+def run_with_metrics(function, *args):
+    REGISTRY.reset()  # the worker registry only holds this call
+    result = function(*args)
+    return result, REGISTRY.dump()
+
+
+# Merge the metrics of a run_with_metrics() call and return its result
+def merge_worker_metrics(result_with_metrics):
+    result, dumped = result_with_metrics
+    REGISTRY.merge(dumped)
+    return result
+
+
+# Write the metrics to a file in the OpenMetrics text format
+def write_metrics_file(path=None):
+    path = path or METRICS_FILE
+    with open(path, "w") as file:
+        file.write(REGISTRY.render())
+
+
+# Serve the metrics on a local port from a background thread, http.server is
+# only loaded when the metrics are served
+def serve_metrics(port=None, host="127.0.0.1"):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = REGISTRY.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", OPENMETRICS_CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # keep the scrapes out of the log file
+
+    port = METRICS_PORT if port is None else port
+    server = ThreadingHTTPServer((host, int(port)), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
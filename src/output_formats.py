@@ -0,0 +1,216 @@
+"""
+Output formats of the above/below average files
+- jsonl: plain JSON lines, the original format
+- jsonl.gz / jsonl.zst: JSON lines compressed while streaming, zstd needs the
+  optional `zstandard` package
+- parquet: columnar file with typed UserAge and EventTime columns, needs the
+  optional `pyarrow` package
+Every format writer takes the JSON lines as text and writes bytes to a binary
+stream (a local file or an S3 multipart stream).
+"""
+
+import gzip
+import importlib
+import json
+import os
+
+from config import get_config
+
+OUTPUT_FORMAT = get_config().output_format
+OUTPUT_COMPRESSION_LEVEL = get_config().output_compression_level
+
+# Rows buffered before one Parquet row group is written
+PARQUET_ROW_GROUP_SIZE = 65536
+
+JSONL_CONTENT_TYPE = "application/x-ndjson"
+PARQUET_CONTENT_TYPE = "application/vnd.apache.parquet"
+
+# Format name: (file name suffix, Content-Type, Content-Encoding)
+OUTPUT_FORMATS = {
+    "jsonl": ("", JSONL_CONTENT_TYPE, None),
+    "jsonl.gz": (".gz", JSONL_CONTENT_TYPE, "gzip"),
+    "jsonl.zst": (".zst", JSONL_CONTENT_TYPE, "zstd"),
+    "parquet": (".parquet", PARQUET_CONTENT_TYPE, None),
+}
+
+
+# File name of an output in the given format, e.g. above_average_output.json.gz
+def output_file_name(file_name, output_format=None):
+    output_format = output_format or OUTPUT_FORMAT
+    suffix = OUTPUT_FORMATS[output_format][0]
+    if output_format == "parquet":
+        return os.path.splitext(file_name)[0] + suffix
+    return file_name + suffix
+
+
+# S3 headers of an output file, picked by its file name
+def get_content_headers(file_name):
+    # Longest suffix first, plain JSON lines (no suffix) last
+    for suffix, content_type, content_encoding in sorted(
+        OUTPUT_FORMATS.values(), key=lambda output_format: -len(output_format[0])
+    ):
+        if file_name.endswith(suffix):
+            headers = {"ContentType": content_type}
+            if content_encoding:
+                headers["ContentEncoding"] = content_encoding
+            return headers
+
+
+# Import the optional package a format needs only when the format is used
+def import_optional(module_name, output_format):
+    try:
+        return importlib.import_module(module_name)
+    except ImportError:
+        raise ValueError(f"The {output_format} format needs the {module_name} package.")
+
+
+# Encode text and pass it through to a binary stream
+class TextStreamWriter:
+    def __init__(self, stream, level=None):
+        self.stream = stream
+
+    def write(self, text):
+        return self.stream.write(text.encode())
+
+    def close(self):
+        pass
+
+
+class GzipStreamWriter(TextStreamWriter):
+    def __init__(self, stream, level=None):
+        super().__init__(
+            gzip.GzipFile(
+                fileobj=stream,
+                mode="wb",
+                compresslevel=int(level) if level else 6,
+                mtime=0,
+            )
+        )
+
+    def close(self):
+        self.stream.close()  # writes the gzip trailer, leaves the stream open
+
+
+class ZstdStreamWriter(TextStreamWriter):
+    def __init__(self, stream, level=None):
+        zstandard = import_optional("zstandard", "jsonl.zst")
+        compressor = zstandard.ZstdCompressor(level=int(level) if level else 3)
+        super().__init__(compressor.stream_writer(stream, closefd=False))
+
+    def close(self):
+        self.stream.close()  # flushes the last zstd frame, leaves the stream open
+
+
+# File object handed to pyarrow: pyarrow closes it when the Parquet file is
+# finished, but the sink itself is closed (or aborted) by FormattedOutput
+class UncloseableStream:
+    def __init__(self, stream):
+        self.stream = stream
+        self.closed = False
+        self._position = 0
+
+    def write(self, data):
+        self.stream.write(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+# Convert JSON lines into Parquet row groups with typed columns
+class ParquetStreamWriter:
+    def __init__(self, stream, level=None):
+        pyarrow = import_optional("pyarrow", "parquet")
+        import_optional("pyarrow.compute", "parquet")
+        import_optional("pyarrow.parquet", "parquet")
+        self.pyarrow = pyarrow
+        self.schema = pyarrow.schema(
+            [
+                ("UserID", pyarrow.string()),
+                ("UserName", pyarrow.string()),
+                ("UserAge", pyarrow.int64()),
+                ("EventTime", pyarrow.timestamp("ms", tz="UTC")),
+            ]
+        )
+        self.writer = pyarrow.parquet.ParquetWriter(
+            UncloseableStream(stream),
+            self.schema,
+            compression="zstd",
+            compression_level=int(level) if level else None,
+        )
+        self._pending = ""
+        self._rows = []
+
+    def write(self, text):
+        lines = (self._pending + text).split("\n")
+        self._pending = lines.pop()
+        self._rows.extend(json.loads(line) for line in lines if line)
+        if len(self._rows) >= PARQUET_ROW_GROUP_SIZE:
+            self._write_row_group()
+        return len(text)
+
+    def _write_row_group(self):
+        pyarrow = self.pyarrow
+        columns = {
+            field: [row.get(field) for row in self._rows] for field in self.schema.names
+        }
+        # Invalid event times ("0000-00-00T00:00:00.000Z") become nulls
+        columns["EventTime"] = pyarrow.compute.strptime(
+            pyarrow.array(columns["EventTime"], pyarrow.string()),
+            format="%Y-%m-%dT%H:%M:%S.000Z",
+            unit="ms",
+            error_is_null=True,
+        ).cast(pyarrow.timestamp("ms", tz="UTC"))
+        self.writer.write_table(pyarrow.table(columns, schema=self.schema))
+        self._rows = []
+
+    def close(self):
+        if self._pending:
+            self.write("\n")
+        if self._rows:
+            self._write_row_group()
+        self.writer.close()
+
+
+FORMAT_WRITERS = {
+    "jsonl": TextStreamWriter,
+    "jsonl.gz": GzipStreamWriter,
+    "jsonl.zst": ZstdStreamWriter,
+    "parquet": ParquetStreamWriter,
+}
+
+
+# Wrap a binary sink (a context manager) with the writer of an output format
+class FormattedOutput:
+    def __init__(self, sink, output_format=None, level=None):
+        self.sink = sink
+        output_format = output_format or OUTPUT_FORMAT
+        try:
+            self.writer = FORMAT_WRITERS[output_format](
+                sink, level or OUTPUT_COMPRESSION_LEVEL
+            )
+        except BaseException as e:
+            sink.__exit__(type(e), e, e.__traceback__)
+            raise
+
+    def write(self, text):
+        return self.writer.write(text)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.writer.close()
+        except BaseException as e:
+            self.sink.__exit__(type(e), e, e.__traceback__)
+            raise
+        return self.sink.__exit__(exc_type, exc_value, traceback)
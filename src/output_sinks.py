@@ -0,0 +1,62 @@
+"""
+Output sinks - where the above/below average JSON lines are written to
+- a local file in the json/<date>/ folder of its day partition and/or
+- a multipart upload streamed straight to S3 without staging files on disk
+in the configured output format (see output_formats.py)
+"""
+
+import os
+
+from config import get_config
+from output_formats import FormattedOutput, output_file_name
+from transform_xml_to_json import get_json_file_path
+from upload_files_to_s3 import open_s3_stream
+
+WRITE_LOCAL_JSON = get_config().write_local_json
+STREAM_TO_S3 = get_config().stream_to_s3
+
+
+# Write the same data to several outputs
+class TeeWriter:
+    def __init__(self, writers):
+        self.writers = writers
+
+    def write(self, data):
+        for writer in self.writers:
+            writer.write(data)
+        return len(data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Close every writer even if one of them fails
+        error = None
+        for writer in self.writers:
+            try:
+                writer.__exit__(exc_type, exc_value, traceback)
+            except Exception as e:
+                error = error or e
+        if error is not None:
+            raise error
+        return False
+
+
+# Open the configured outputs for one file name of a day partition, today's
+# by default
+def open_output(file_name, partition=None):
+    file_name = output_file_name(file_name)
+    writers = []
+    if WRITE_LOCAL_JSON:
+        writers.append(open(get_json_file_path(file_name, partition), "wb"))
+    if STREAM_TO_S3:
+        writers.append(open_s3_stream(file_name, partition=partition))
+
+    if not writers:
+        raise ValueError("Enable WRITE_LOCAL_JSON or STREAM_TO_S3 to write outputs.")
+    return FormattedOutput(writers[0] if len(writers) == 1 else TeeWriter(writers))
+
+
+# The local files still have to be uploaded when they were not streamed
+def needs_upload():
+    return WRITE_LOCAL_JSON and not STREAM_TO_S3
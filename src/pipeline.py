@@ -0,0 +1,240 @@
+"""
+Asynchronous pipeline - the three steps overlap instead of running one after another
+- download the files with pooled SFTP sessions and
+- parse each file in the process pool as soon as its download finishes and
+- merge the partial aggregates of every day partition, write its outputs and
+  upload them to S3 under the json/<date>/ prefix of the partition
+The stages are connected with bounded queues, so a slow stage holds back the
+ones before it and the number of files waiting between stages stays bounded.
+"""
+
+import asyncio
+import logging
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from config import get_config
+from day_partitions import due_partitions, map_partitions, partition_of
+from download_files_from_sftp import (
+    DOWNLOAD_PATH,
+    SFTP_POOL_SIZE,
+    create_sftp_connection,
+    download_with_pool,
+    get_due_files,
+    skip_downloaded_files,
+)
+from download_manifest import open_manifest
+from metrics import merge_worker_metrics, run_with_metrics
+from output_formats import output_file_name
+from output_sinks import needs_upload, open_output
+from sftp_connection_pool import SFTPConnectionPool
+from transform_xml_to_json import (
+    SPILL_DIR,
+    TRANSFORM_WORKERS,
+    get_json_file_path,
+    get_xml_files,
+    spill_xml_file,
+    write_merged_shards,
+)
+from upload_files_to_s3 import OUTPUT_FILE_NAMES, S3_BUCKET, get_s3_path, upload_to_s3
+
+# Maximum number of files waiting between two stages
+PIPELINE_QUEUE_SIZE = get_config().pipeline_queue_size
+
+
+# Stage 1: download files and hand each one over as soon as it is on disk
+async def download_stage(pool, download_queue, parse_queue, manifest=None):
+    while True:
+        item = await download_queue.get()
+        if item is None:
+            return
+        index, file_attr = item
+        stats = await asyncio.to_thread(download_with_pool, pool, file_attr, manifest)
+        if stats is not None:
+            local_file_path = os.path.join(DOWNLOAD_PATH, file_attr.filename)
+            await parse_queue.put((index, local_file_path))
+
+
+# Stage 2: parse each file into a record shard in the process pool
+async def transform_stage(executor, shard_dir, parse_queue, results):
+    loop = asyncio.get_running_loop()
+    while True:
+        item = await parse_queue.get()
+        if item is None:
+            return
+        index, file_path = item
+        shard_path = os.path.join(shard_dir, f"{index}.shard")
+        results[index] = merge_worker_metrics(
+            await loop.run_in_executor(
+                executor, run_with_metrics, spill_xml_file, file_path, shard_path
+            )
+        )
+
+
+# Stage 3: merge the partial aggregates of one partition, write its outputs
+# and upload every output file concurrently once it is sealed, unless it was
+# streamed to S3. Returns the average age and whether every output reached S3.
+def publish_partition(partition, results):
+    avg_age = write_merged_shards(
+        results, lambda file_name: open_output(file_name, partition)
+    )
+    if avg_age is None:
+        return None, False
+    if not needs_upload():
+        return avg_age, True
+
+    with ThreadPoolExecutor(max_workers=len(OUTPUT_FILE_NAMES)) as executor:
+        futures = [
+            executor.submit(
+                upload_to_s3,
+                get_json_file_path(output_file_name(file_name), partition),
+                S3_BUCKET,
+                get_s3_path(partition),
+            )
+            for file_name in OUTPUT_FILE_NAMES
+        ]
+    return avg_age, all(future.result() is not None for future in futures)
+
+
+# Publish the partitions at the same time, returning the (average age,
+# uploaded) pair by partition
+async def publish_stage(partition_results):
+    return await asyncio.to_thread(map_partitions, publish_partition, partition_results)
+
+
+# Main function to run download, transform and upload as one pipeline,
+# returning the average age by day partition, None without an SFTP connection
+async def run_pipeline(pool_size=None, transform_workers=None, queue_size=None):
+    manifest = open_manifest()  # None unless MANIFEST_PATH is set
+    try:
+        return await run_pipeline_stages(
+            pool_size, transform_workers, queue_size, manifest
+        )
+    finally:
+        if manifest is not None:
+            manifest.close()
+
+
+async def run_pipeline_stages(
+    pool_size=None, transform_workers=None, queue_size=None, manifest=None
+):
+    pool_size = pool_size or SFTP_POOL_SIZE
+    transform_workers = transform_workers or TRANSFORM_WORKERS
+    queue_size = queue_size or PIPELINE_QUEUE_SIZE
+
+    os.makedirs(DOWNLOAD_PATH, exist_ok=True)
+    pool = SFTPConnectionPool(create_sftp_connection, size=pool_size)
+    due_files = await asyncio.to_thread(get_due_files, pool)
+    if due_files is None:
+        return None
+    due_files = await asyncio.to_thread(
+        skip_downloaded_files, pool, due_files, manifest
+    )
+
+    # XML files left in the download folder are transformed as well, like the
+    # sequential workflow does; the shards of a partition are merged in file
+    # name order
+    due_file_names = {file_attr.filename for file_attr in due_files}
+    jobs = [
+        (os.path.basename(file_path), partition, file_path, None)
+        for partition, file_paths in due_partitions(get_xml_files(DOWNLOAD_PATH))
+        for file_path in file_paths
+        if os.path.basename(file_path) not in due_file_names
+    ]
+    jobs += [
+        (file_attr.filename, partition_of(file_attr.st_mtime), None, file_attr)
+        for file_attr in due_files
+    ]
+    if manifest is not None:
+        # Leave out the partitions a previous run already finished
+        pending_partitions = {
+            partition
+            for partition, file_names in group_by_partition(jobs).items()
+            if manifest.pending(file_names, "uploaded")
+        }
+        jobs = [job for job in jobs if job[1] in pending_partitions]
+    if not jobs:
+        pool.close()
+        logging.info("Every downloaded file was already transformed and uploaded.")
+        return {}
+    jobs.sort(key=lambda job: (job[1], job[0]))
+    logging.info(f"Pipeline started for {len(jobs)} files.")
+
+    download_queue = asyncio.Queue(maxsize=queue_size)
+    parse_queue = asyncio.Queue(maxsize=queue_size)
+    results = {}
+
+    with tempfile.TemporaryDirectory(dir=SPILL_DIR) as shard_dir:
+        with ProcessPoolExecutor(max_workers=transform_workers) as executor:
+            downloaders = [
+                asyncio.create_task(
+                    download_stage(pool, download_queue, parse_queue, manifest)
+                )
+                for _ in range(pool_size)
+            ]
+            transformers = [
+                asyncio.create_task(
+                    transform_stage(executor, shard_dir, parse_queue, results)
+                )
+                for _ in range(transform_workers)
+            ]
+
+            async def feed():
+                for index, (_, _, local_file_path, file_attr) in enumerate(jobs):
+                    if file_attr is None:
+                        await parse_queue.put((index, local_file_path))
+                    else:
+                        await download_queue.put((index, file_attr))
+                for _ in downloaders:
+                    await download_queue.put(None)
+                await asyncio.gather(*downloaders)
+                for _ in transformers:
+                    await parse_queue.put(None)
+
+            tasks = [asyncio.create_task(feed()), *downloaders, *transformers]
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                raise
+            finally:
+                pool.close()
+
+        # The parsed files of each partition, in file name order
+        partition_results = {}
+        for index in sorted(results):
+            partition_results.setdefault(jobs[index][1], []).append(results[index])
+        published = await publish_stage(sorted(partition_results.items()))
+
+    avg_ages = {partition: avg_age for partition, (avg_age, _) in published.items()}
+    for partition, (avg_age, uploaded) in published.items():
+        if avg_age is None:
+            continue
+        if not uploaded:
+            logging.error(
+                "Upload of partition %s failed, the next run uploads it again.",
+                partition,
+            )
+        if manifest is not None:
+            finished = [
+                jobs[index][0] for index in results if jobs[index][1] == partition
+            ]
+            manifest.mark(finished, "transformed")
+            if uploaded:
+                manifest.mark(finished, "uploaded")
+        print(f"Transformation of {partition} complete. Average age: {avg_age:.2f}")
+    return avg_ages
+
+
+# File names of the pipeline jobs by partition
+def group_by_partition(jobs):
+    partitions = {}
+    for file_name, partition, _, _ in jobs:
+        partitions.setdefault(partition, []).append(file_name)
+    return partitions
+
+
+if __name__ == "__main__":
+    asyncio.run(run_pipeline())
@@ -0,0 +1,112 @@
+"""
+Pool of independent SFTP sessions
+- every session has its own transport, so requests from different threads
+  are not serialized over one channel
+- sessions are checked out and returned, and health checked on checkout
+- dead or failed sessions are closed and reconnected transparently
+"""
+
+import logging
+import threading
+from contextlib import contextmanager
+
+
+# Check that the transport behind an SFTP session is still alive
+def is_sftp_healthy(sftp):
+    try:
+        channel = sftp.get_channel()
+        return channel is not None and channel.get_transport().is_active()
+    except Exception:
+        return False
+
+
+# Close an SFTP session together with its transport
+def close_sftp(sftp):
+    try:
+        channel = sftp.get_channel()
+        sftp.close()
+        if channel is not None:
+            channel.get_transport().close()
+    except Exception as e:
+        logging.warning(f"Error closing SFTP session: {e}")
+
+
+class SFTPConnectionPool:
+    # `connect` returns a new SFTP session or None when the connection fails
+    def __init__(self, connect, size=4):
+        self.size = size
+        self._connect = connect
+        self._idle = []
+        self._created = 0
+        self._available = threading.Condition()
+
+    # Open a new session for a slot that is already reserved
+    def _open(self):
+        try:
+            sftp = self._connect()
+        except Exception:
+            self._release_slot()
+            raise
+        if sftp is None:
+            self._release_slot()
+            raise ConnectionError("Failed to open an SFTP session.")
+        return sftp
+
+    # Free a slot and wake up one thread waiting for a session
+    def _release_slot(self):
+        with self._available:
+            self._created -= 1
+            self._available.notify()
+
+    # Take a session from the pool, opening one while below the pool size and
+    # waiting for a returned one otherwise
+    def checkout(self):
+        with self._available:
+            while not self._idle and self._created >= self.size:
+                self._available.wait()
+            if self._idle:
+                sftp = self._idle.pop()
+            else:
+                self._created += 1
+                sftp = None
+
+        if sftp is None:
+            return self._open()
+
+        if not is_sftp_healthy(sftp):
+            logging.warning("SFTP session is not healthy, reconnecting.")
+            close_sftp(sftp)
+            return self._open()
+
+        return sftp
+
+    # Give a session back to the pool
+    def checkin(self, sftp):
+        with self._available:
+            self._idle.append(sftp)
+            self._available.notify()
+
+    # Drop a broken session so its slot is reconnected on the next checkout
+    def discard(self, sftp):
+        close_sftp(sftp)
+        self._release_slot()
+
+    @contextmanager
+    def connection(self):
+        sftp = self.checkout()
+        try:
+            yield sftp
+        except Exception:
+            self.discard(sftp)
+            raise
+        else:
+            self.checkin(sftp)
+
+    # Close every idle session
+    def close(self):
+        with self._available:
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+        for sftp in idle:
+            close_sftp(sftp)
+        logging.info("SFTP connection pool closed.")
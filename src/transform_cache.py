@@ -0,0 +1,127 @@
+"""
+Content-addressed cache of transformed XML files
+- an input file is keyed by the blake2b hash of its bytes, so the same file
+  sent again under a new name is not parsed again
+- an entry is the record shard of the file plus its partial age sum and count
+- the least recently used entries are evicted once the cache is larger than
+  TRANSFORM_CACHE_MAX_BYTES
+Set TRANSFORM_CACHE_DIR to enable it. The process pool workers share the
+directory, entries are written to a temporary name and renamed into place.
+"""
+
+import json
+import logging
+import os
+import shutil
+
+from config import get_config
+
+TRANSFORM_CACHE_DIR = get_config().transform_cache_dir
+TRANSFORM_CACHE_MAX_BYTES = get_config().transform_cache_max_bytes
+
+# Part of every key, bump it when the shard format changes
+TRANSFORM_CACHE_VERSION = b"shard-v1"
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+# Hash the bytes of a file, hashlib is only loaded once the cache is used
+def hash_file(file_path):
+    import hashlib
+
+    digest = hashlib.blake2b(person=TRANSFORM_CACHE_VERSION)
+    with open(file_path, "rb") as file:
+        while chunk := file.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Hard link a file, or copy it on file systems without hard links
+def link_or_copy(source, destination):
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+class TransformCache:
+    def __init__(self, directory, max_bytes=None):
+        self.directory = directory
+        self.max_bytes = TRANSFORM_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _shard_path(self, key):
+        return os.path.join(self.directory, f"{key}.shard")
+
+    def _meta_path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    # Place the cached shard of a key at shard_path and return its (total,
+    # count), None on a miss
+    def get(self, key, shard_path):
+        try:
+            with open(self._meta_path(key)) as meta_file:
+                meta = json.load(meta_file)
+            # A link keeps the shard readable even if it is evicted meanwhile
+            link_or_copy(self._shard_path(key), shard_path)
+            os.utime(self._meta_path(key))  # mark as recently used
+        except (OSError, ValueError):
+            return None
+
+        return meta["total"], meta["count"]
+
+    # Store the shard of a key with its partial aggregates
+    def put(self, key, shard_path, total, count):
+        suffix = f".{os.getpid()}.tmp"  # the workers never share a temporary
+        try:
+            tmp_shard = self._shard_path(key) + suffix
+            if os.path.exists(tmp_shard):
+                os.remove(tmp_shard)
+            link_or_copy(shard_path, tmp_shard)
+            os.replace(tmp_shard, self._shard_path(key))
+
+            # The metadata goes last, an entry without it is never read
+            tmp_meta = self._meta_path(key) + suffix
+            with open(tmp_meta, "w") as meta_file:
+                json.dump({"total": total, "count": count}, meta_file)
+            os.replace(tmp_meta, self._meta_path(key))
+        except OSError as e:
+            logging.error(f"Failed to cache the shard {key}: {e}")
+            return
+
+        self.evict()
+
+    # Remove the least recently used entries until the cache fits max_bytes
+    def evict(self):
+        entries = []
+        total_size = 0
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                if not entry.name.endswith(".json"):
+                    continue
+                key = entry.name[: -len(".json")]
+                try:
+                    size = os.path.getsize(self._shard_path(key))
+                    entries.append((entry.stat().st_mtime, key, size))
+                except OSError:
+                    continue  # evicted by another worker
+                total_size += size
+
+        for _, key, size in sorted(entries):
+            if total_size <= self.max_bytes:
+                break
+            for path in (self._meta_path(key), self._shard_path(key)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total_size -= size
+            logging.info(f"Evicted shard {key} from the transform cache.")
+
+
+# Open the configured cache, None when TRANSFORM_CACHE_DIR is not set
+def open_transform_cache(directory=None, max_bytes=None):
+    directory = directory or TRANSFORM_CACHE_DIR
+    if not directory:
+        return None
+    return TransformCache(directory, max_bytes)
@@ -7,15 +7,53 @@ workflow - the key of step 2 is to read the content from xml files
 """
 
 import xml.etree.ElementTree as ET
-import json
+import marshal
 import os
+import re
+import tempfile
+import time
 from datetime import datetime
+from functools import lru_cache
+from itertools import repeat
 import logging
 
+from config import get_config
+from day_partitions import map_partitions
+from json_lines_writer import encode_user_line, write_lines
+from metrics import (
+    FIELD_ERRORS,
+    FIELD_WARNINGS,
+    PARSE_SECONDS,
+    RECORDS_PARSED,
+    merge_worker_metrics,
+    run_with_metrics,
+)
+from transform_cache import hash_file, open_transform_cache
+from user_record_store import UserRecordStore
 from utils import setup_logging
 
-# Setup logging
-setup_logging()
+CONFIG = get_config()
+
+# Directory for temporary spill files, defaults to the system temp directory
+SPILL_DIR = CONFIG.spill_dir
+
+# Number of distinct EventTime values whose conversion is cached
+EVENT_TIME_CACHE_SIZE = CONFIG.event_time_cache_size
+
+FIXED_WIDTH_EVENT_TIME = re.compile(
+    r"(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})", re.ASCII
+)
+DAYS_IN_MONTH = (0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+# Missing fields counted since the last flush_field_warnings(), by field name
+MISSING_FIELDS = {}
+
+# Fields whose value cannot be converted, counted the same way, by field name:
+# [count, first invalid value]
+INVALID_FIELDS = {}
+
+# Number of processes used to parse XML files in parallel
+TRANSFORM_WORKERS = CONFIG.transform_workers
 
 
 # Parse xml files
@@ -25,90 +63,271 @@ def parse_xml_file(file_path):
 
     users = []
     for user in root.findall("User"):
-        user_data = {
-            "UserID": get_field(user, "UserID", default="Unknown"),
-            "UserName": get_field(user, "UserName", default="Unknown"),
-            "UserAge": safe_int_conversion(get_field(user, "UserAge", default=None)),
-            "EventTime": convert_to_iso8601(get_field(user, "EventTime", default=None)),
-        }
-        users.append(user_data)
+        users.append(build_user_record(user))
+    RECORDS_PARSED.inc(len(users))
+    flush_field_warnings(file_path)
 
     return users
 
 
+# Parse an XML file into the compact record store, no dict per user is kept
+def load_user_store(file_path):
+    return UserRecordStore.from_users(iter_users(file_path))
+
+
+# Stream user records one at a time without building the whole tree
+def iter_users(file_path):
+    records = 0
+    try:
+        for user in iter_user_elements(file_path):
+            records += 1
+            yield build_user_record(user)
+    finally:
+        RECORDS_PARSED.inc(records)
+        flush_field_warnings(file_path)
+
+
+# Yield each <User> element with incremental parsing and clear it afterwards
+def iter_user_elements(file_path):
+    depth = 0
+    root = None
+    for event, element in ET.iterparse(file_path, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = element
+            depth += 1
+            continue
+
+        depth -= 1
+        # Only direct children of the root are users, same as root.findall("User")
+        if depth == 1:
+            if element.tag == "User":
+                yield element
+            # Drop the finished element so memory stays flat for large files
+            element.clear()
+            root.clear()
+
+
+# Build one user record from a <User> element
+def build_user_record(user):
+    return {
+        "UserID": get_field(user, "UserID", default="Unknown"),
+        "UserName": get_field(user, "UserName", default="Unknown"),
+        "UserAge": safe_int_conversion(get_field(user, "UserAge", default=None)),
+        "EventTime": convert_to_iso8601(get_field(user, "EventTime", default=None)),
+    }
+
+
 # get fields safely by handling missing fields
 def get_field(element, field_name, default=None):
     field = element.find(field_name)
     if field is not None and field.text:
         return field.text
     else:
-        logging.warning(f"Missing or empty field: {field_name}")
+        # Counted here and logged once per field and file, a dirty file can
+        # miss millions of fields
+        MISSING_FIELDS[field_name] = MISSING_FIELDS.get(field_name, 0) + 1
         return default
 
 
+# Count a field value that cannot be converted, logged by flush_field_warnings()
+def count_invalid_field(field_name, value):
+    invalid = INVALID_FIELDS.get(field_name)
+    if invalid is None:
+        INVALID_FIELDS[field_name] = [1, value]
+    else:
+        invalid[0] += 1
+
+
+# Log one warning per missing field and one error per invalid field with
+# their counts in the file
+def flush_field_warnings(file_path):
+    for field_name, count in MISSING_FIELDS.items():
+        logging.warning(
+            "Missing or empty field: %s (%d times in %s)",
+            field_name,
+            count,
+            file_path,
+            extra={"field": field_name, "count": count, "file": file_path},
+        )
+        FIELD_WARNINGS.inc(count, field=field_name)
+    MISSING_FIELDS.clear()
+
+    for field_name, (count, value) in INVALID_FIELDS.items():
+        logging.error(
+            "%d invalid %s values in %s, first: %r",
+            count,
+            field_name,
+            file_path,
+            value,
+            extra={"field": field_name, "count": count, "file": file_path},
+        )
+        FIELD_ERRORS.inc(count, field=field_name)
+    INVALID_FIELDS.clear()
+
+
 # Convert EventTime to ISO 8601 format
 def convert_to_iso8601(event_time):
     if event_time is None:
         return (
             "0000-00-00T00:00:00.000Z"  # Return a default date if EventTime is missing
         )
+    converted = reformat_event_time(event_time)
+    if converted is None:
+        count_invalid_field("EventTime", event_time)
+        return (
+            "0000-00-00T00:00:00.000Z"  # Return default date in case of format errors
+        )
+    return converted
+
+
+# Reformat a "%Y-%m-%dT%H:%M:%S" value to ISO 8601 with milliseconds, None if
+# it is invalid. Fixed-width values are validated and reformatted without a
+# datetime round trip, anything else (e.g. no zero padding) uses strptime.
+@lru_cache(maxsize=EVENT_TIME_CACHE_SIZE)
+def reformat_event_time(event_time):
+    match = FIXED_WIDTH_EVENT_TIME.fullmatch(event_time)
+    # strftime does not zero pad years below 1000, leave those to the slow path
+    if match and event_time[0] != "0":
+        year, month, day, hour, minute, second = map(int, match.groups())
+        if not 1 <= month <= 12 or hour > 23 or minute > 59 or second > 59:
+            return None
+        days_in_month = DAYS_IN_MONTH[month]
+        if month == 2 and year % 4 == 0 and (year % 100 != 0 or year % 400 == 0):
+            days_in_month = 29
+        if not 1 <= day <= days_in_month:
+            return None
+        return event_time + ".000Z"
+
     try:
         event_time_obj = datetime.strptime(event_time, "%Y-%m-%dT%H:%M:%S")
         return event_time_obj.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
     except ValueError:
-        logging.error(f"Invalid EventTime format: {event_time}")
-        return (
-            "0000-00-00T00:00:00.000Z"  # Return default date in case of format errors
-        )
+        return None
 
 
-#  Convert UserAge to an integer
+#  Convert UserAge to an integer, a missing value is already counted by
+# get_field
 def safe_int_conversion(value):
+    if value is None:
+        return None
     try:
         return int(value)
     except (ValueError, TypeError):
-        logging.error(f"Invalid UserAge value: {value}")
+        count_invalid_field("UserAge", value)
         return None
 
 
 # Calculate average UserAge, excluding None values
 def calculate_average_age(users):
-    valid_ages = [user["UserAge"] for user in users if user["UserAge"] is not None]
+    if isinstance(users, UserRecordStore):
+        # Sum the typed age column directly
+        total, count = users.age_stats()
+    else:
+        # Accumulate in a single pass so a generator of users works as well
+        total = 0
+        count = 0
+        for user in users:
+            if user["UserAge"] is not None:
+                total += user["UserAge"]
+                count += 1
 
-    if not valid_ages:  # Check if the list is empty
+    if not count:  # Check if there is no valid age
         logging.warning("No valid ages found for average calculation.")
         return None  # Return None or an appropriate fallback if there are no valid ages
 
-    return sum(valid_ages) / len(valid_ages)
+    return total / count
 
 
-# Write users to JSON file inside a date folder
-def write_to_json_file(file_name, users):
+# Build the output path inside the date folder of a partition, today's by
+# default
+def get_json_file_path(file_name, partition=None):
 
-    # Define the directory structure: "json/today's_date/"
-    today = datetime.now().strftime("%Y-%m-%d")
-    directory = os.path.join("json", today)
+    # Define the directory structure: "json/<date>/"
+    partition = partition or datetime.now().strftime("%Y-%m-%d")
+    directory = os.path.join("json", partition)
 
     # Create the directory if it doesn't exist
     os.makedirs(directory, exist_ok=True)
 
     # Full path for the JSON file
-    full_file_path = os.path.join(directory, file_name)
+    return os.path.join(directory, file_name)
+
+
+# Open a local JSON output file inside the date folder
+def open_json_file(file_name, partition=None):
+    return open(get_json_file_path(file_name, partition), "w")
+
+
+# Write users to JSON file inside a date folder
+def write_to_json_file(file_name, users):
+    write_lines_to_json_file(file_name, map(encode_user_line, users))
+
+
+# Write already encoded JSON lines to the date folder
+def write_lines_to_json_file(file_name, lines):
+    full_file_path = get_json_file_path(file_name)
 
     # Write the JSON data to the file
     with open(full_file_path, "w") as file:
-        for user in users:
-            json.dump(user, file)
-            file.write("\n")
+        write_lines(file, lines)
+
+    logging.info(f"Saved {file_name} in {os.path.dirname(full_file_path)}")
+
 
-    logging.info(f"Saved {file_name} in {directory}")
+# Spill users with a valid age to a compact temporary file as (age, json line)
+# records, returning the running sum and count of the ages
+def spill_users(users, spill_file):
+    total = 0
+    count = 0
+    for user in users:
+        age = user["UserAge"]
+        if age is None:
+            continue
+        marshal.dump((age, encode_user_line(user)), spill_file)
+        total += age
+        count += 1
+
+    return total, count
+
+
+# Read the (age, json line) records back from a spill file
+def iter_spilled_users(spill_file):
+    spill_file.seek(0)
+    while True:
+        try:
+            yield marshal.load(spill_file)
+        except EOFError:
+            return
+
+
+# Split spilled users into the above/below average files in a single pass
+# `open_output` opens a writable output by file name, a local file by default
+def write_spilled_users_by_average(spilled_users, avg_age, open_output=None):
+    open_output = open_output or open_json_file
+
+    with open_output("above_average_output.json") as above_file, open_output(
+        "below_average_output.json"
+    ) as below_file:
+        for age, line in spilled_users:
+            if age > avg_age:
+                above_file.write(line)
+            else:
+                below_file.write(line)
+
+    logging.info("Saved above_average_output.json and below_average_output.json")
 
 
 # Main function to transform XML to JSON and categorize users
-def transform_xml_to_json(file_path):
+def transform_xml_to_json(file_path, streaming=False):
     print("Transformation gets started.")
-    # parse xml files
-    users = parse_xml_file(file_path)
+
+    # The shard path goes through the transform cache when it is enabled
+    if streaming or open_transform_cache() is not None:
+        return transform_xml_to_json_streaming(file_path)
+
+    # parse xml files into the compact record store
+    users = load_user_store(file_path)
 
     # calculate average age
     avg_age = calculate_average_age(users)  # Step 2: Calculate average age
@@ -121,22 +340,153 @@ def transform_xml_to_json(file_path):
         return
 
     # Compare user age with the average value and write to json files
-    above_avg_users = [
-        user
-        for user in users
-        if user["UserAge"] is not None and user["UserAge"] > avg_age
+    above_avg_users, below_avg_users = users.partition_by_age(avg_age)
+
+    write_lines_to_json_file(
+        "above_average_output.json", users.iter_json_lines(above_avg_users)
+    )
+    write_lines_to_json_file(
+        "below_average_output.json", users.iter_json_lines(below_avg_users)
+    )
+
+    print(f"Transformation complete. Average age: {avg_age:.2f}")
+
+
+# Transform large XML files with flat memory: parse once while spilling users
+# to disk and keeping the running sum, then stream the spill to the outputs
+def transform_xml_to_json_streaming(file_path):
+    transform_xml_files([file_path])
+
+
+# List the XML files of a directory in a stable order
+def get_xml_files(directory):
+    return [
+        os.path.join(directory, file_name)
+        for file_name in sorted(os.listdir(directory))
+        if file_name.endswith(".xml")
     ]
-    below_avg_users = [
-        user
-        for user in users
-        if user["UserAge"] is not None and user["UserAge"] <= avg_age
+
+
+# Parse one XML file into a record shard on disk, returning the partial
+# aggregate (sum, count, shard path) so it is cheap to send between processes
+def spill_xml_file(file_path, shard_path):
+    # A file with the same bytes as an earlier one reuses its cached shard
+    cache = open_transform_cache()
+    if cache is not None:
+        key = hash_file(file_path)
+        cached = cache.get(key, shard_path)
+        if cached is not None:
+            logging.info(f"Reusing the cached shard of file: {file_path}")
+            return (*cached, shard_path)
+
+    logging.info(f"Processing file: {file_path}")
+    start_time = time.perf_counter()
+    with open(shard_path, "wb") as shard_file:
+        total, count = spill_users(iter_users(file_path), shard_file)
+    PARSE_SECONDS.observe(time.perf_counter() - start_time)
+
+    if cache is not None:
+        cache.put(key, shard_path, total, count)
+    return total, count, shard_path
+
+
+# Stream the records of every shard back in order
+def iter_shards(shard_paths):
+    for shard_path in shard_paths:
+        with open(shard_path, "rb") as shard_file:
+            yield from iter_spilled_users(shard_file)
+
+
+# Merge the partial aggregates into the global average and stream the shards
+# into the output files
+def write_merged_shards(results, open_output=None):
+    total = sum(result[0] for result in results)
+    count = sum(result[1] for result in results)
+
+    if not count:
+        logging.warning("No valid ages found for average calculation.")
+        logging.error(
+            "Cannot calculate average age due to missing or invalid age data."
+        )
+        return None
+
+    avg_age = total / count
+    write_spilled_users_by_average(
+        iter_shards([result[2] for result in results]), avg_age, open_output
+    )
+    return avg_age
+
+
+# Parse XML files into record shards in the shard directory, in a process
+# pool when more than one worker is configured
+def spill_xml_files(file_paths, shard_dir, max_workers=None):
+    if max_workers is None:
+        max_workers = TRANSFORM_WORKERS
+
+    shard_paths = [
+        os.path.join(shard_dir, f"{index}.shard") for index in range(len(file_paths))
     ]
+    if max_workers > 1 and len(file_paths) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        workers = min(max_workers, len(file_paths))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # The workers send back the metrics they recorded
+            return [
+                merge_worker_metrics(result)
+                for result in executor.map(
+                    run_with_metrics,
+                    repeat(spill_xml_file),
+                    file_paths,
+                    shard_paths,
+                )
+            ]
+    return list(map(spill_xml_file, file_paths, shard_paths))
+
+
+# Batch transform: aggregate the ages of every file into one global average
+# and write each output file once. Files are parsed in a process pool when
+# more than one worker is configured.
+def transform_xml_files(file_paths, max_workers=None, open_output=None):
+    with tempfile.TemporaryDirectory(dir=SPILL_DIR) as shard_dir:
+        results = spill_xml_files(file_paths, shard_dir, max_workers)
+        avg_age = write_merged_shards(results, open_output)
 
-    write_to_json_file("above_average_output.json", above_avg_users)
-    write_to_json_file("below_average_output.json", below_avg_users)
+    if avg_age is None:
+        return None
 
     print(f"Transformation complete. Average age: {avg_age:.2f}")
+    return avg_age
+
+
+# Transform day partitions, each with the average of its own files, into its
+# json/<date>/ folder. The files of every partition share one process pool,
+# then the partitions are merged and written at the same time. Returns the
+# average age by partition, None for a partition without valid ages.
+def transform_partitions(partitions, max_workers=None, open_output=None):
+    open_output = open_output or open_json_file
+    file_paths = [file_path for _, paths in partitions for file_path in paths]
+
+    with tempfile.TemporaryDirectory(dir=SPILL_DIR) as shard_dir:
+        results = iter(spill_xml_files(file_paths, shard_dir, max_workers))
+        partition_results = [
+            (partition, [next(results) for _ in paths])
+            for partition, paths in partitions
+        ]
+
+        def write_partition(partition, shard_results):
+            return write_merged_shards(
+                shard_results, lambda file_name: open_output(file_name, partition)
+            )
+
+        avg_ages = map_partitions(write_partition, partition_results)
+
+    for partition, avg_age in avg_ages.items():
+        if avg_age is not None:
+            print(f"Transformation of {partition} complete. Average age: {avg_age:.2f}")
+    return avg_ages
 
 
 if __name__ == "__main__":
+    setup_logging()
     transform_xml_to_json("./downloads/file1.xml")
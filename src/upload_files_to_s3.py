@@ -1,64 +1,267 @@
 from datetime import datetime
-import boto3
 import os
 import logging
-from dotenv import load_dotenv
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
-from utils import setup_logging
+from config import get_config
+from output_formats import get_content_headers, output_file_name
+from metrics import BYTES_UPLOADED, UPLOAD_SECONDS
+from utils import get_transfer_stats, setup_logging
 
-# Load configuration from environment variables
-load_dotenv()
+CONFIG = get_config()
 
-S3_BUCKET = os.getenv("S3_BUCKET")
-S3_PATH = os.getenv("S3_PATH")
-AWS_ACCESS_KEY = os.getenv("AWS_ACCESS_KEY")
-AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
+S3_BUCKET = CONFIG.s3_bucket
+S3_PATH = CONFIG.s3_path
+AWS_ACCESS_KEY = CONFIG.aws_access_key
+AWS_SECRET_ACCESS_KEY = CONFIG.aws_secret_access_key
 
+# Custom endpoint, e.g. a local S3 stand-in such as moto server
+S3_ENDPOINT_URL = CONFIG.s3_endpoint_url
 
-# Setup logging
-setup_logging()
+# Upload tuning: HTTP connection pool, multipart chunk size and concurrency
+# of a single upload, and the number of files uploaded at the same time
+S3_MAX_POOL_CONNECTIONS = CONFIG.s3_max_pool_connections
+S3_MULTIPART_CHUNK_SIZE = CONFIG.s3_multipart_chunk_size
+S3_MAX_CONCURRENCY = CONFIG.s3_max_concurrency
+S3_UPLOAD_WORKERS = CONFIG.s3_upload_workers
+
+# Output files of a day partition, before the extension of the output format
+OUTPUT_FILE_NAMES = ("above_average_output.json", "below_average_output.json")
+
+
+# Guards the creation of the shared client: the first uploads ask for it from
+# several worker threads at once
+S3_CLIENT_LOCK = threading.Lock()
+
+
+# Long-lived S3 client shared by every upload, boto3 clients are thread safe
+# but the default boto3 session is not, the client gets its own session.
+# boto3 is only loaded when the upload step runs.
+@lru_cache(maxsize=None)
+def create_s3_client():
+    import boto3
+    from botocore.config import Config
+
+    return boto3.session.Session().client(
+        "s3",
+        aws_access_key_id=AWS_ACCESS_KEY,
+        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+        endpoint_url=S3_ENDPOINT_URL,
+        config=Config(max_pool_connections=S3_MAX_POOL_CONNECTIONS),
+    )
+
+
+# The shared S3 client, created by the first caller only
+def get_s3_client():
+    with S3_CLIENT_LOCK:
+        return create_s3_client()
+
+
+# Multipart settings of a single upload
+def get_transfer_config(multipart_chunk_size=None, max_concurrency=None):
+    from boto3.s3.transfer import TransferConfig
+
+    return TransferConfig(
+        multipart_threshold=multipart_chunk_size or S3_MULTIPART_CHUNK_SIZE,
+        multipart_chunksize=multipart_chunk_size or S3_MULTIPART_CHUNK_SIZE,
+        max_concurrency=max_concurrency or S3_MAX_CONCURRENCY,
+    )
+
+
+# Count the bytes sent by the upload threads of one file
+class TransferProgress:
+    def __init__(self):
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, bytes_amount):
+        with self._lock:
+            self.bytes += bytes_amount
+
+
+# File-like sink that streams what is written to an S3 object. The data is
+# buffered in memory up to one part and pushed as a multipart upload part
+# whenever the buffer fills; small objects are sent with a single put_object.
+class S3MultipartWriter:
+    def __init__(self, s3_client, s3_bucket, s3_key, part_size=None, extra_args=None):
+        self.s3_client = s3_client
+        self.s3_bucket = s3_bucket
+        self.s3_key = s3_key
+        self.part_size = part_size or S3_MULTIPART_CHUNK_SIZE
+        self.extra_args = extra_args or {}
+        self.bytes_written = 0
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._parts = []
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self._buffer += data
+        self.bytes_written += len(data)
+        if len(self._buffer) >= self.part_size:
+            self._upload_part()
+        return len(data)
+
+    def _upload_part(self):
+        if self._upload_id is None:
+            response = self.s3_client.create_multipart_upload(
+                Bucket=self.s3_bucket, Key=self.s3_key, **self.extra_args
+            )
+            self._upload_id = response["UploadId"]
+
+        part_number = len(self._parts) + 1
+        response = self.s3_client.upload_part(
+            Bucket=self.s3_bucket,
+            Key=self.s3_key,
+            UploadId=self._upload_id,
+            PartNumber=part_number,
+            Body=bytes(self._buffer),
+        )
+        self._parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+        self._buffer.clear()
+
+    def close(self):
+        if self._upload_id is None:
+            self.s3_client.put_object(
+                Bucket=self.s3_bucket,
+                Key=self.s3_key,
+                Body=bytes(self._buffer),
+                **self.extra_args,
+            )
+        else:
+            if self._buffer:
+                self._upload_part()
+            self.s3_client.complete_multipart_upload(
+                Bucket=self.s3_bucket,
+                Key=self.s3_key,
+                UploadId=self._upload_id,
+                MultipartUpload={"Parts": self._parts},
+            )
+        BYTES_UPLOADED.inc(self.bytes_written)
+        logging.info(
+            f"Streamed {self.bytes_written} bytes to s3://{self.s3_bucket}/{self.s3_key}"
+        )
+
+    # Drop the parts uploaded so far so no incomplete upload is left behind
+    def abort(self):
+        if self._upload_id is not None:
+            self.s3_client.abort_multipart_upload(
+                Bucket=self.s3_bucket, Key=self.s3_key, UploadId=self._upload_id
+            )
+        logging.error(f"Aborted streaming to s3://{self.s3_bucket}/{self.s3_key}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+# S3 path of the outputs of a day partition: <S3_PATH>/json/<date>, the
+# S3_PATH itself without a partition
+def get_s3_path(partition=None):
+    if partition is None:
+        return S3_PATH
+    return os.path.join(S3_PATH or "", "json", partition)
+
+
+# Open a streaming writer for an output file under the S3 path, the path of
+# the day partition when one is given
+def open_s3_stream(file_name, s3_bucket=None, s3_path=None, partition=None):
+    s3_key = os.path.join(s3_path or get_s3_path(partition), file_name)
+    return S3MultipartWriter(
+        get_s3_client(),
+        s3_bucket or S3_BUCKET,
+        s3_key,
+        extra_args=get_content_headers(file_name),
+    )
 
 
 # Function to upload a file to S3
-def upload_to_s3(file_name, s3_bucket, s3_path):
+def upload_to_s3(file_name, s3_bucket, s3_path, transfer_config=None):
     try:
-        # Create an S3 client
-        s3_client = boto3.client(
-            "s3",
-            aws_access_key_id=AWS_ACCESS_KEY,
-            aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-        )
+        # Reuse the shared S3 client
+        s3_client = get_s3_client()
 
         # Construct the full S3 key (S3 path + file name)
         s3_key = os.path.join(s3_path, os.path.basename(file_name))
 
         # Upload the file
-        s3_client.upload_file(file_name, s3_bucket, s3_key)
-        logging.info(f"Successfully uploaded {file_name} to s3://{s3_bucket}/{s3_key}")
+        progress = TransferProgress()
+        start_time = time.perf_counter()
+        s3_client.upload_file(
+            file_name,
+            s3_bucket,
+            s3_key,
+            Config=transfer_config or get_transfer_config(),
+            Callback=progress,
+            ExtraArgs=get_content_headers(file_name),
+        )
+        stats = get_transfer_stats(
+            file_name, progress.bytes, time.perf_counter() - start_time, "s3"
+        )
+        BYTES_UPLOADED.inc(stats["bytes"])
+        UPLOAD_SECONDS.observe(stats["seconds"])
+        logging.info(
+            f"Successfully uploaded {file_name} to s3://{s3_bucket}/{s3_key}: "
+            f"{stats['bytes']} bytes in {stats['seconds']:.3f}s "
+            f"({stats['mb_per_second']:.2f} MB/s)"
+        )
+        return stats
     except Exception as e:
         logging.error(f"Error uploading {file_name} to S3: {e}")
+        return None
 
 
-# Main function to upload both JSON files
-def upload_json_files_to_s3():
-    # Get today's file folder (e.g., "2020-01-01")
-    today = datetime.now().strftime("%Y-%m-%d")
-    directory = os.path.join("json", today)
+# Upload several files at the same time over the shared client
+def upload_files_concurrently(file_names, s3_bucket, s3_path, max_workers=None):
+    with ThreadPoolExecutor(max_workers=max_workers or S3_UPLOAD_WORKERS) as executor:
+        futures = [
+            executor.submit(upload_to_s3, file_name, s3_bucket, s3_path)
+            for file_name in file_names
+        ]
+    return [future.result() for future in futures if future.result() is not None]
+
+
+# Check that the upload stats cover every output file of a partition, a
+# partition with a failed or missing output is uploaded again by the next run
+def uploaded_all_outputs(upload_stats):
+    return len(upload_stats) == len(OUTPUT_FILE_NAMES)
+
+
+# Main function to upload both JSON files of a day partition, today's by
+# default, to the S3 path of the partition
+def upload_json_files_to_s3(partition=None):
+    # Get the partition's file folder (e.g., "2020-01-01")
+    day = partition or datetime.now().strftime("%Y-%m-%d")
+    directory = os.path.join("json", day)
 
     # List of files to upload
     files_to_upload = [
-        os.path.join(directory, "above_average_output.json"),
-        os.path.join(directory, "below_average_output.json"),
+        os.path.join(directory, output_file_name(file_name))
+        for file_name in OUTPUT_FILE_NAMES
     ]
 
-    # Upload each file to S3
+    # Upload the existing files to S3 concurrently
+    existing_files = []
     for file in files_to_upload:
         if os.path.exists(file):
-            upload_to_s3(file, S3_BUCKET, S3_PATH)
+            existing_files.append(file)
         else:
             logging.warning(f"File {file} not found. Skipping upload.")
 
+    return upload_files_concurrently(existing_files, S3_BUCKET, get_s3_path(partition))
+
 
 # Call the upload function after transformation is complete
 if __name__ == "__main__":
+    setup_logging()
     upload_json_files_to_s3()
@@ -0,0 +1,169 @@
+"""
+Compact in-memory store of user records
+- UserAge in a typed array with a validity mask instead of one int per dict
+- UserID and EventTime as offset-encoded UTF-8 buffers, UserName interned
+  because the same names repeat a lot
+- UserRow, a __slots__ view of one record, instead of a four-key dict
+The statistics and the above/below split run directly over the arrays.
+"""
+
+from array import array
+from itertools import compress
+
+from age_stats import age_column_stats, partition_age_column
+from json_lines_writer import encode_user_fields
+
+# Ages that do not fit the typed array are kept aside
+MIN_AGE = -(2**63)
+MAX_AGE = 2**63 - 1
+
+
+# Strings stored back to back in one buffer, found by their end offsets
+class OffsetStringColumn:
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets = array("Q", [0])
+
+    def append(self, value):
+        self.data += value.encode()
+        self.offsets.append(len(self.data))
+
+    def __getitem__(self, index):
+        return self.data[self.offsets[index] : self.offsets[index + 1]].decode()
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+
+# Repeated strings stored once, every record keeps a code
+class InternedStringColumn:
+    def __init__(self):
+        self.values = []
+        self.codes = array("I")
+        self._index = {}
+
+    def append(self, value):
+        code = self._index.get(value)
+        if code is None:
+            code = self._index[value] = len(self.values)
+            self.values.append(value)
+        self.codes.append(code)
+
+    def __getitem__(self, index):
+        return self.values[self.codes[index]]
+
+    def __len__(self):
+        return len(self.codes)
+
+
+# View of one record, reads the fields from the store on access
+class UserRow:
+    __slots__ = ("store", "index")
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    @property
+    def UserID(self):
+        return self.store.user_ids[self.index]
+
+    @property
+    def UserName(self):
+        return self.store.user_names[self.index]
+
+    @property
+    def UserAge(self):
+        return self.store.get_age(self.index)
+
+    @property
+    def EventTime(self):
+        return self.store.event_times[self.index]
+
+    def __getitem__(self, field):
+        return getattr(self, field)
+
+    def to_dict(self):
+        return {
+            "UserID": self.UserID,
+            "UserName": self.UserName,
+            "UserAge": self.UserAge,
+            "EventTime": self.EventTime,
+        }
+
+
+class UserRecordStore:
+    def __init__(self):
+        self.ages = array("q")
+        self.valid_ages = bytearray()  # 1 when the record has a valid age
+        self.large_ages = {}  # index: age, for ages outside the int64 range
+        self.user_ids = OffsetStringColumn()
+        self.user_names = InternedStringColumn()
+        self.event_times = OffsetStringColumn()
+
+    @classmethod
+    def from_users(cls, users):
+        store = cls()
+        for user in users:
+            store.append(user)
+        return store
+
+    # Add one user record (a dict as built by build_user_record)
+    def append(self, user):
+        age = user["UserAge"]
+        if age is None:
+            self.ages.append(0)
+            self.valid_ages.append(0)
+        else:
+            if MIN_AGE <= age <= MAX_AGE:
+                self.ages.append(age)
+            else:
+                self.large_ages[len(self.ages)] = age
+                self.ages.append(0)
+            self.valid_ages.append(1)
+        self.user_ids.append(user["UserID"])
+        self.user_names.append(user["UserName"])
+        self.event_times.append(user["EventTime"])
+
+    def __len__(self):
+        return len(self.ages)
+
+    def __getitem__(self, index):
+        return UserRow(self, index)
+
+    def __iter__(self):
+        return (UserRow(self, index) for index in range(len(self)))
+
+    def get_age(self, index):
+        if not self.valid_ages[index]:
+            return None
+        return self.large_ages.get(index, self.ages[index])
+
+    # Sum and count of the valid ages
+    def age_stats(self, engine=None):
+        total, count = age_column_stats(self.ages, self.valid_ages, engine)
+        # The large ages were stored as 0 in the typed array
+        return total + sum(self.large_ages.values()), count
+
+    # Indexes of the valid ages above the average and at or below it
+    def partition_by_age(self, avg_age, engine=None):
+        if not self.large_ages:
+            return partition_age_column(self.ages, self.valid_ages, avg_age, engine)
+
+        # Rare case of ages outside the int64 range, kept in record order
+        above = array("Q")
+        below = array("Q")
+        for index in compress(range(len(self)), self.valid_ages):
+            age = self.get_age(index)
+            (above if age > avg_age else below).append(index)
+        return above, below
+
+    # JSON lines of the selected records, same bytes as json.dumps of the dicts
+    def iter_json_lines(self, indexes):
+        for index in indexes:
+            yield encode_user_fields(
+                self.user_ids[index],
+                self.user_names[index],
+                self.get_age(index),
+                self.event_times[index],
+            )
@@ -1,15 +1,111 @@
 from datetime import datetime
+import atexit
+import copy
+import json
 import logging
+import logging.handlers
 import os
+import queue
+
+from config import get_config
+
+# "text" writes the classic "time message" lines, "json" one JSON object per line
+LOG_FORMAT = get_config().log_format
+LOG_LEVEL = get_config().log_level
+
+# Attributes every LogRecord has, anything else was passed with `extra`
+STANDARD_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message"}
+
+# Background thread writing the queued records to the log file
+_log_listener = None
+
+
+# One JSON object per record with the `extra` fields as keys
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in STANDARD_RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+# Hand records over to the listener thread with their message formatted and
+# their args dropped, the listener never reads arguments the caller changes
+# afterwards. Calls below the log level are dropped before a record exists,
+# and the file I/O stays on the listener thread.
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        return record
 
 
 def setup_logging(log_dir="./logs"):
+    global _log_listener
+
+    root = logging.getLogger()
+    if root.handlers:
+        return  # already configured, like logging.basicConfig
+
     if not os.path.exists(log_dir):
         os.mkdir(log_dir)
 
     log_filename = os.path.join(
         log_dir, f"sftp_xml_to_json_s3_{datetime.now().strftime('%Y%m%d%-H%M%S')}.log"
     )
-    logging.basicConfig(
-        filename=log_filename, level=logging.INFO, format="%(asctime)s %(message)s"
-    )
+    file_handler = logging.FileHandler(log_filename)
+    if LOG_FORMAT == "json":
+        file_handler.setFormatter(JsonFormatter())
+    else:
+        file_handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+
+    log_queue = queue.SimpleQueue()
+    root.addHandler(LazyQueueHandler(log_queue))
+    root.setLevel(LOG_LEVEL)
+
+    _log_listener = logging.handlers.QueueListener(log_queue, file_handler)
+    _log_listener.start()
+    atexit.register(stop_logging)
+    os.register_at_fork(after_in_child=log_directly_in_child)
+
+
+# A forked worker process has no listener thread, it writes to the log file
+# itself, as before
+def log_directly_in_child():
+    global _log_listener
+    if _log_listener is None:
+        return
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, LazyQueueHandler):
+            root.removeHandler(handler)
+            root.addHandler(_log_listener.handlers[0])
+    _log_listener = None
+
+
+# Write the records still queued and stop the listener thread
+def stop_logging():
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
+
+
+# Per-file throughput metrics, used to compare transfer settings
+def get_transfer_stats(file_name, size, seconds, mode):
+    return {
+        "file_name": file_name,
+        "mode": mode,
+        "bytes": size,
+        "seconds": seconds,
+        "mb_per_second": size / seconds / 1_000_000 if seconds > 0 else 0.0,
+    }
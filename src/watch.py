@@ -0,0 +1,320 @@
+"""
+Watch mode - one long-running process instead of one batch per cron run
+- the pooled SFTP sessions and the S3 client stay open between polls, a new
+  file costs no SSH handshake, client setup or interpreter start-up
+- SFTP_PATH is polled every WATCH_INTERVAL seconds, every empty poll doubles
+  the wait up to WATCH_MAX_INTERVAL and the first new file resets it
+- new files are processed in micro-batches of at most WATCH_BATCH_SIZE files:
+  only they are parsed, the running state of their day partition is updated
+  (day_state.py) and the outputs of that day are rewritten and published
+Run it with `python src/watch.py` or PIPELINE_MODE=watch, stop it with
+SIGTERM or Ctrl-C.
+"""
+
+import logging
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
+from xml.etree.ElementTree import ParseError
+
+from config import get_config
+from day_partitions import due_partitions, is_due, map_partitions, partition_of
+from day_state import (
+    DAY_STATE_DIR,
+    add_new_files,
+    expire_day_states,
+    open_day_state,
+)
+from download_files_from_sftp import (
+    DOWNLOAD_PATH,
+    SFTP_PATH,
+    SFTP_POOL_SIZE,
+    create_sftp_connection,
+    download_files,
+    get_due_files,
+)
+from download_manifest import open_manifest
+from metrics import LANDING_SECONDS, time_stage
+from output_sinks import needs_upload, open_output
+from sftp_connection_pool import SFTPConnectionPool
+from transform_xml_to_json import SPILL_DIR, get_xml_files
+from upload_files_to_s3 import (
+    get_s3_client,
+    upload_json_files_to_s3,
+    uploaded_all_outputs,
+)
+from utils import setup_logging
+
+CONFIG = get_config()
+
+# Seconds between two polls, and the longest wait after empty polls
+WATCH_INTERVAL = CONFIG.watch_interval
+WATCH_MAX_INTERVAL = CONFIG.watch_max_interval
+
+# Most files downloaded and published by one poll
+WATCH_BATCH_SIZE = CONFIG.watch_batch_size
+
+# Folder in DOWNLOAD_PATH the XML files that cannot be parsed are moved to
+REJECTED_FOLDER = "rejected"
+
+
+# Poll interval that grows after every empty poll, up to the maximum
+class Backoff:
+    def __init__(self, interval=None, max_interval=None, factor=2):
+        self.interval = WATCH_INTERVAL if interval is None else interval
+        self.max_interval = WATCH_MAX_INTERVAL if max_interval is None else max_interval
+        self.factor = factor
+        self.current = self.interval
+
+    # Wait after an empty poll
+    def next(self):
+        delay = self.current
+        self.current = min(self.current * self.factor, self.max_interval)
+        return delay
+
+    # Wait after a poll that found files
+    def reset(self):
+        self.current = self.interval
+        return self.interval
+
+
+class Watcher:
+    def __init__(self, pool_size=None, batch_size=None, manifest=None):
+        self.pool_size = pool_size or SFTP_POOL_SIZE
+        self.batch_size = batch_size or WATCH_BATCH_SIZE
+        self.manifest = manifest
+        # Kept open for the whole run, the sessions are health checked and
+        # reconnected on checkout
+        self.pool = SFTPConnectionPool(create_sftp_connection, size=self.pool_size)
+        # Without DAY_STATE_DIR the state only lives as long as the process
+        self.own_state_dir = not DAY_STATE_DIR
+        self.state_dir = DAY_STATE_DIR or tempfile.mkdtemp(
+            prefix="watch-", dir=SPILL_DIR
+        )
+        self.partitions = {}  # partition: DayState
+        # partition: files of a publish that did not reach S3. The files are
+        # already off the server and in the day state, so only the publish is
+        # repeated.
+        self.failed = {}
+        # Downloaded files not added to a day state yet, they are off the
+        # server so the next poll adds them again
+        self.unprocessed = set()
+        self.pending = False  # more files were due than one batch holds
+
+    # Parse the XML files already in the download folder, the outputs of
+    # their days include them
+    def load_local_files(self):
+        file_paths = [
+            file_path
+            for _, paths in due_partitions(get_xml_files(DOWNLOAD_PATH))
+            for file_path in paths
+        ]
+        if file_paths:
+            logging.info(f"Loading {len(file_paths)} downloaded files.")
+            self.process(file_paths)
+
+    # Download a micro-batch of new files, oldest first, and publish their
+    # days. Returns the number of files processed, None without a connection.
+    def poll(self):
+        self.retry_unprocessed()
+        self.retry_failed()
+        due_files = get_due_files(self.pool)
+        if due_files is None:
+            return None
+        if not due_files:
+            self.pending = False
+            return 0
+
+        batch = sorted(due_files, key=lambda file_attr: file_attr.st_mtime)
+        self.pending = len(batch) > self.batch_size
+        batch = batch[: self.batch_size]
+        landed = {file_attr.filename: file_attr.st_mtime for file_attr in batch}
+
+        downloaded = download_files(self.pool, batch, self.pool_size, self.manifest)
+        file_paths = [
+            os.path.join(DOWNLOAD_PATH, stats["file_name"]) for stats in downloaded
+        ]
+        if file_paths:
+            self.process(file_paths)
+        published = time.time()
+        for stats in downloaded:
+            LANDING_SECONDS.observe(published - landed[stats["file_name"]])
+        return len(file_paths)
+
+    # Add new local files to the running state of their days and publish
+    # every day whose outputs do not include all of its files yet
+    def process(self, file_paths):
+        self.unprocessed.update(file_paths)
+        with time_stage("watch_batch"):
+            partitions = {}
+            for file_path in file_paths:
+                partition = partition_of(os.path.getmtime(file_path))
+                partitions.setdefault(partition, []).append(file_path)
+                if partition not in self.partitions:
+                    self.partitions[partition] = open_day_state(
+                        partition, self.state_dir
+                    )
+
+            new_files = self.add_files(sorted(partitions.items()))
+            self.unprocessed.difference_update(file_paths)
+            published = map_partitions(
+                self.publish,
+                [
+                    (partition, new_files[partition])
+                    for partition in sorted(partitions)
+                    if not self.partitions[partition].is_published()
+                ],
+            )
+        self.expire_partitions()
+        return published
+
+    # Add the files to the states of their days. When a file of the batch is
+    # not well-formed XML the files are added one at a time, and the broken
+    # ones are moved to the rejected folder. Returns the new files by partition.
+    def add_files(self, partitions):
+        try:
+            return add_new_files(self.partitions, partitions)
+        except ParseError:
+            pass
+
+        new_files = {}
+        for partition, paths in partitions:
+            new_files[partition] = []
+            for file_path in paths:
+                try:
+                    added = add_new_files(self.partitions, [(partition, [file_path])])
+                except ParseError as e:
+                    self.reject(file_path, e)
+                    continue
+                new_files[partition].extend(added[partition])
+        return new_files
+
+    # Move a file that cannot be parsed out of the download folder
+    def reject(self, file_path, error):
+        rejected_dir = os.path.join(DOWNLOAD_PATH, REJECTED_FOLDER)
+        os.makedirs(rejected_dir, exist_ok=True)
+        shutil.move(file_path, os.path.join(rejected_dir, os.path.basename(file_path)))
+        logging.error(
+            "Cannot parse %s, moved it to %s: %s", file_path, rejected_dir, error
+        )
+
+    # Add the downloaded files an earlier poll did not add again
+    def retry_unprocessed(self):
+        file_paths = sorted(
+            file_path for file_path in self.unprocessed if os.path.exists(file_path)
+        )
+        self.unprocessed = set()
+        if file_paths:
+            logging.info(f"Retrying {len(file_paths)} downloaded files.")
+            self.process(file_paths)
+
+    # Publish the days whose last publish failed again
+    def retry_failed(self):
+        retries = sorted(self.failed.items())
+        if not retries:
+            return
+        self.failed = {}
+        logging.info(f"Retrying the publish of {[day for day, _ in retries]}.")
+        map_partitions(self.publish, retries)
+
+    # Rewrite the outputs of a day with its running average and upload them,
+    # a day whose outputs do not all reach S3 is published again by the next
+    # poll
+    def publish(self, partition, file_paths):
+        self.failed.setdefault(partition, []).extend(file_paths)
+        avg_age = self.partitions[partition].publish(
+            lambda file_name: open_output(file_name, partition)
+        )
+        if avg_age is None:
+            del self.failed[partition]
+            return None
+
+        file_names = [os.path.basename(file_path) for file_path in file_paths]
+        if self.manifest is not None:
+            self.manifest.mark(file_names, "transformed")
+        if needs_upload() and not uploaded_all_outputs(
+            upload_json_files_to_s3(partition)
+        ):
+            logging.error(
+                "Upload of partition %s failed, the next poll publishes it again.",
+                partition,
+            )
+            return avg_age
+
+        del self.failed[partition]
+        if self.manifest is not None:
+            self.manifest.mark(file_names, "uploaded")
+        return avg_age
+
+    # Drop the days that are no longer due together with their state
+    def expire_partitions(self):
+        for partition in [p for p in self.partitions if not is_due(p)]:
+            del self.partitions[partition]
+            self.failed.pop(partition, None)
+        expire_day_states(self.state_dir)
+
+    def close(self):
+        self.pool.close()
+        if self.own_state_dir:
+            shutil.rmtree(self.state_dir, ignore_errors=True)
+
+
+# Poll SFTP_PATH until the stop event is set, max_polls bounds the number of
+# polls (used by the tests)
+def watch(stop_event=None, max_polls=None, backoff=None, pool_size=None):
+    stop_event = stop_event or threading.Event()
+    backoff = backoff or Backoff()
+    os.makedirs(DOWNLOAD_PATH, exist_ok=True)
+
+    manifest = open_manifest()  # None unless MANIFEST_PATH is set
+    watcher = Watcher(pool_size=pool_size, manifest=manifest)
+    get_s3_client()  # created once, before the first file lands
+    logging.info(f"Watching {SFTP_PATH} for new files.")
+    polls = 0
+    try:
+        try:
+            watcher.load_local_files()
+        except Exception as e:
+            # The files that were not added are retried by the first poll
+            logging.error(f"Loading the downloaded files failed: {e}")
+
+        while not stop_event.is_set():
+            try:
+                processed = watcher.poll()
+            except Exception as e:
+                # A daemon outlives a failed poll: the downloaded files that
+                # were not added and the failed publishes are retried by the
+                # next poll, files still on the server are listed again
+                logging.error(f"Watch poll failed: {e}")
+                processed = None
+
+            polls += 1
+            if max_polls is not None and polls >= max_polls:
+                break
+            if processed:
+                delay = 0 if watcher.pending else backoff.reset()
+            else:
+                delay = backoff.next()
+            stop_event.wait(delay)
+    finally:
+        watcher.close()
+        if manifest is not None:
+            manifest.close()
+    logging.info("Watch mode stopped.")
+    return watcher.partitions
+
+
+# Watch until SIGTERM or SIGINT
+def run_watch():
+    stop_event = threading.Event()
+    for signal_number in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signal_number, lambda *args: stop_event.set())
+    return watch(stop_event)
+
+
+if __name__ == "__main__":
+    setup_logging()
+    run_watch()
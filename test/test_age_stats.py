@@ -0,0 +1,78 @@
+import sys
+import os
+
+# Add the `src` directory to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+import random
+import unittest
+from array import array
+from unittest.mock import patch
+from age_stats import HAS_NUMPY, age_column_stats, partition_age_column, use_numpy
+
+
+def make_column(count, seed=0):
+    rng = random.Random(seed)
+    ages = array("q", (rng.randint(0, 100) for _ in range(count)))
+    valid = bytearray(rng.random() >= 0.1 for _ in range(count))
+    return ages, valid
+
+
+def reference_partition(ages, valid, avg_age):
+    above = [i for i, age in enumerate(ages) if valid[i] and age > avg_age]
+    below = [i for i, age in enumerate(ages) if valid[i] and age <= avg_age]
+    return above, below
+
+
+class TestAgeStats(unittest.TestCase):
+
+    def test_python_engine(self):
+        ages, valid = make_column(1000)
+        total, count = age_column_stats(ages, valid, "python")
+        self.assertEqual(
+            (total, count),
+            (sum(age for age, ok in zip(ages, valid) if ok), sum(valid)),
+        )
+        above, below = partition_age_column(ages, valid, total / count, "python")
+        self.assertEqual(
+            (list(above), list(below)), reference_partition(ages, valid, total / count)
+        )
+
+    def test_empty_column(self):
+        self.assertEqual(age_column_stats(array("q"), bytearray(), "python"), (0, 0))
+
+    def test_small_columns_stay_on_python(self):
+        with patch("age_stats.HAS_NUMPY", True):
+            self.assertFalse(use_numpy(10, "auto"))
+            self.assertTrue(use_numpy(10**6, "auto"))
+            self.assertFalse(use_numpy(10**6, "python"))
+
+    @patch("age_stats.HAS_NUMPY", False)
+    def test_numpy_engine_without_numpy(self):
+        self.assertFalse(use_numpy(10**6, "auto"))
+        with self.assertRaises(ValueError):
+            use_numpy(10, "numpy")
+
+    @unittest.skipUnless(HAS_NUMPY, "numpy is not installed")
+    def test_numpy_engine_matches_python_engine(self):
+        ages, valid = make_column(5000, seed=1)
+        stats = age_column_stats(ages, valid, "numpy")
+        self.assertEqual(stats, age_column_stats(ages, valid, "python"))
+
+        avg_age = stats[0] / stats[1]
+        above, below = partition_age_column(ages, valid, avg_age, "numpy")
+        self.assertEqual(
+            (list(above), list(below)), reference_partition(ages, valid, avg_age)
+        )
+
+    @unittest.skipUnless(HAS_NUMPY, "numpy is not installed")
+    def test_numpy_engine_falls_back_for_huge_ages(self):
+        ages = array("q", [2**62, 2**62, 1])
+        valid = bytearray([1, 1, 1])
+        self.assertEqual(age_column_stats(ages, valid, "numpy"), (2**63 + 1, 3))
+        above, below = partition_age_column(ages, valid, 2**62 - 1, "numpy")
+        self.assertEqual((list(above), list(below)), ([0, 1], [2]))
+
+
+if __name__ == "__main__":
+    unittest.main()
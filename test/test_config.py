@@ -0,0 +1,72 @@
+import sys
+import os
+
+# Add the `src` directory to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+import subprocess
+import unittest
+from unittest.mock import patch
+from config import Config, get_config
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../src"))
+
+
+# Heavy modules loaded by importing a module in a fresh interpreter
+def heavy_modules_loaded(module):
+    code = (
+        f"import {module}, sys; "
+        "print(','.join(m for m in ('paramiko', 'boto3', 'botocore', "
+        "'http.server') if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=SRC_DIR,
+        env=dict(os.environ, DOWNLOAD_PATH="./downloads"),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return result.stdout.strip()
+
+
+class TestConfig(unittest.TestCase):
+    def test_from_env(self):
+        env = {
+            "SFTP_PORT": "2222",
+            "SFTP_WINDOW_SIZE": "4194304",
+            "WRITE_LOCAL_JSON": "False",
+            "S3_UPLOAD_WORKERS": "8",
+        }
+        with patch.dict(os.environ, env):
+            config = Config.from_env()
+        self.assertEqual(config.sftp_port, 2222)
+        self.assertEqual(config.sftp_window_size, 4194304)
+        self.assertFalse(config.write_local_json)
+        self.assertEqual(config.s3_upload_workers, 8)
+
+    def test_defaults(self):
+        with patch.dict(os.environ, {}, clear=True):
+            config = Config.from_env()
+        self.assertEqual(config.sftp_port, 22)
+        self.assertIsNone(config.sftp_window_size)
+        self.assertTrue(config.write_local_json)
+        self.assertEqual(config.output_format, "jsonl")
+
+    def test_read_once(self):
+        self.assertIs(get_config(), get_config())
+        with self.assertRaises(AttributeError):
+            get_config().sftp_port = 1
+
+    def test_steps_do_not_load_sdks_on_import(self):
+        for module in (
+            "transform_xml_to_json",
+            "download_files_from_sftp",
+            "upload_files_to_s3",
+        ):
+            with self.subTest(module=module):
+                self.assertEqual(heavy_modules_loaded(module), "")
+
+
+if __name__ == "__main__":
+    unittest.main()
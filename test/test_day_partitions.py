@@ -0,0 +1,113 @@
+import sys
+import os
+
+# Add the `src` directory to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+import tempfile
+import unittest
+from unittest.mock import patch
+from day_partitions import (
+    due_partitions,
+    get_timezone,
+    is_due,
+    map_partitions,
+    partition_of,
+)
+from transform_xml_to_json import transform_partitions
+
+# 2024-09-10 23:30 UTC, already 2024-09-11 in Tokyo
+LATE_EVENING_UTC = 1726011000
+
+USER_XML = (
+    "<Users><User><UserID>{0}</UserID><UserName>User{0}</UserName>"
+    "<UserAge>{1}</UserAge><EventTime>2024-07-30T10:00:00</EventTime>"
+    "</User></Users>"
+)
+
+
+class TestDayPartitions(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp_dir.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp_dir.cleanup()
+
+    def write_file(self, name, mtime, age=30):
+        with open(name, "w") as file:
+            file.write(USER_XML.format(name, age))
+        os.utime(name, (mtime, mtime))
+        return name
+
+    def test_partition_of_uses_the_timezone(self):
+        self.assertEqual(
+            partition_of(LATE_EVENING_UTC, get_timezone("UTC")), "2024-09-10"
+        )
+        self.assertEqual(
+            partition_of(LATE_EVENING_UTC, get_timezone("Asia/Tokyo")), "2024-09-11"
+        )
+
+    def test_is_due(self):
+        self.assertTrue(is_due("2024-09-10", today="2024-09-10", catchup_days=0))
+        self.assertTrue(is_due("2024-09-03", today="2024-09-10", catchup_days=7))
+        self.assertFalse(is_due("2024-09-02", today="2024-09-10", catchup_days=7))
+        self.assertFalse(is_due("2024-09-11", today="2024-09-10", catchup_days=7))
+
+    @patch("day_partitions.PARTITION_TIMEZONE", "UTC")
+    def test_due_partitions_groups_by_day(self):
+        get_timezone.cache_clear()
+        self.addCleanup(get_timezone.cache_clear)
+        late = self.write_file("late.xml", LATE_EVENING_UTC)
+        early = self.write_file("early.xml", LATE_EVENING_UTC + 3600)
+        missed = self.write_file("missed.xml", LATE_EVENING_UTC - 2 * 86400)
+        stale = self.write_file("stale.xml", LATE_EVENING_UTC - 30 * 86400)
+
+        with self.assertLogs(level="WARNING"):
+            partitions = due_partitions([late, early, missed, stale], "2024-09-11")
+
+        # A run just after midnight keeps the late file in its own day
+        self.assertEqual(
+            partitions,
+            [
+                ("2024-09-08", [missed]),
+                ("2024-09-10", [late]),
+                ("2024-09-11", [early]),
+            ],
+        )
+
+    def test_map_partitions(self):
+        results = map_partitions(
+            lambda partition, paths: (partition, len(paths)),
+            [("2024-09-09", ["a"]), ("2024-09-10", ["b", "c"])],
+            max_workers=2,
+        )
+        self.assertEqual(
+            results, {"2024-09-09": ("2024-09-09", 1), "2024-09-10": ("2024-09-10", 2)}
+        )
+        self.assertEqual(map_partitions(lambda *args: None, []), {})
+
+    def test_transform_partitions_writes_each_day(self):
+        partitions = [
+            ("2024-09-09", [self.write_file("a.xml", 0, 20)]),
+            (
+                "2024-09-10",
+                [self.write_file("b.xml", 0, 30), self.write_file("c.xml", 0, 50)],
+            ),
+        ]
+
+        avg_ages = transform_partitions(partitions, max_workers=1)
+
+        # Each day has the average of its own files
+        self.assertEqual(avg_ages, {"2024-09-09": 20, "2024-09-10": 40})
+        with open("json/2024-09-10/above_average_output.json") as file:
+            self.assertIn('"UserID": "c.xml"', file.read())
+        with open("json/2024-09-09/below_average_output.json") as file:
+            self.assertIn('"UserID": "a.xml"', file.read())
+
+
+if __name__ == "__main__":
+    unittest.main()
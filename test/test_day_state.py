@@ -0,0 +1,146 @@
+import sys
+import os
+
+# Add the `src` directory to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+import tempfile
+import time
+import unittest
+from unittest.mock import ANY, patch
+from day_partitions import partition_of
+from day_state import DayState, update_partitions
+from metrics import RECORDS_RECLASSIFIED
+from transform_xml_to_json import spill_xml_files, transform_partitions
+
+USER_XML = (
+    "<Users><User><UserID>{0}</UserID><UserName>User{0}</UserName>"
+    "<UserAge>{1}</UserAge><EventTime>2024-07-30T10:00:00</EventTime>"
+    "</User></Users>"
+)
+
+
+class TestDayState(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp_dir.name)
+        self.addCleanup(os.chdir, self.cwd)
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.today = partition_of(time.time())
+
+    def write_file(self, name, age):
+        with open(name, "w") as file:
+            file.write(USER_XML.format(name, age))
+        return name
+
+    def read_output(self, file_name):
+        with open(os.path.join("json", self.today, file_name)) as file:
+            return file.read()
+
+    def update(self, file_paths):
+        return update_partitions(
+            [(self.today, file_paths)], state_dir="state", max_workers=1
+        )
+
+    def test_late_file_only_parses_its_own_records(self):
+        early = [self.write_file("a.xml", 20), self.write_file("b.xml", 40)]
+        self.assertEqual(self.update(early), {self.today: 30})
+
+        late = self.write_file("c.xml", 60)
+        moved_before = RECORDS_RECLASSIFIED.value()
+        with patch(
+            "day_state.spill_xml_files", wraps=spill_xml_files
+        ) as mock_spill, self.assertLogs(level="INFO") as log:
+            self.assertEqual(self.update(early + [late]), {self.today: 40})
+
+        # The earlier files come from the persisted state
+        mock_spill.assert_called_once_with(["c.xml"], ANY, 1)
+        self.assertIn(
+            "INFO:root:Added 1 new files, 2 files were added by earlier runs.",
+            log.output,
+        )
+        state = DayState(os.path.join("state", self.today))
+        self.assertEqual((state.total, state.count), (120, 3))
+        self.assertEqual(sorted(state.files), ["a.xml", "b.xml", "c.xml"])
+
+        # The average moved from 30 to 40, only the user aged 40 changed class
+        self.assertEqual(RECORDS_RECLASSIFIED.value() - moved_before, 1)
+        self.assertIn(
+            '"UserID": "c.xml"', self.read_output("above_average_output.json")
+        )
+        below = self.read_output("below_average_output.json")
+        self.assertIn('"UserID": "a.xml"', below)
+        self.assertIn('"UserID": "b.xml"', below)
+
+    def test_outputs_match_a_batch_transform(self):
+        file_paths = [
+            self.write_file(name, age)
+            for name, age in [("a.xml", 35), ("b.xml", 20), ("c.xml", 50)]
+        ]
+        transform_partitions([(self.today, file_paths)], max_workers=1)
+        expected = [
+            self.read_output(name)
+            for name in ("above_average_output.json", "below_average_output.json")
+        ]
+
+        # The files arrive in another order, over several runs
+        self.update(["c.xml"])
+        self.update(["b.xml", "c.xml"])
+        self.update(file_paths)
+
+        self.assertEqual(
+            [
+                self.read_output(name)
+                for name in ("above_average_output.json", "below_average_output.json")
+            ],
+            expected,
+        )
+
+    def test_resent_file_replaces_its_records(self):
+        self.update([self.write_file("a.xml", 20), self.write_file("b.xml", 40)])
+        later = time.time() + 10
+        self.write_file("b.xml", 60)
+        os.utime("b.xml", (later, later))
+
+        self.assertEqual(self.update(["a.xml", "b.xml"]), {self.today: 40})
+        state = DayState(os.path.join("state", self.today))
+        self.assertEqual((state.total, state.count), (80, 2))
+        self.assertIn(
+            '"UserID": "b.xml"', self.read_output("above_average_output.json")
+        )
+        self.assertNotIn(
+            '"UserID": "b.xml"', self.read_output("below_average_output.json")
+        )
+        # The shard of the first version is gone
+        shards = [
+            name
+            for name in os.listdir(os.path.join("state", self.today))
+            if name.startswith("b.xml-")
+        ]
+        self.assertEqual(shards, [state.files["b.xml"]["shard"]])
+
+    def test_unfinished_batch_is_dropped_on_load(self):
+        self.update([self.write_file("a.xml", 20)])
+        leftover = os.path.join("state", self.today, "b.xml-1-1.shard")
+        open(leftover, "wb").close()
+
+        state = DayState(os.path.join("state", self.today))
+
+        self.assertFalse(os.path.exists(leftover))
+        self.assertEqual(list(state.files), ["a.xml"])
+
+    def test_closed_days_are_removed(self):
+        self.update([self.write_file("a.xml", 20)])
+        os.rename(
+            os.path.join("state", self.today), os.path.join("state", "2000-01-01")
+        )
+
+        self.update([self.write_file("b.xml", 30)])
+
+        self.assertEqual(os.listdir("state"), [self.today])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -11,10 +11,22 @@ from unittest.mock import ANY, patch, MagicMock
 from download_files_from_sftp import (
     create_sftp_connection,
     get_files_from_sftp,
-    is_modified_today,
+    is_in_due_partition,
     download_and_delete_file,
-    download_today_files,
+    download_and_delete_file_in_ranges,
+    download_file_pipelined,
+    download_due_files,
+    download_with_pool,
+    get_transfer_stats,
+    is_due_file,
+    iter_files_from_sftp,
+    split_ranges,
 )
+from sftp_connection_pool import SFTPConnectionPool
+import hashlib
+import io
+import tempfile
+import threading
 from datetime import datetime
 import paramiko
 
@@ -69,26 +81,34 @@ class TestGetFilesFromSFTP(unittest.TestCase):
         self.assertEqual(files, [])
 
 
-# Test is_modified_today
-class TestIsModifiedToday(unittest.TestCase):
+# Test is_in_due_partition
+class TestIsInDuePartition(unittest.TestCase):
 
-    def test_is_modified_today_true(self):
+    def test_is_in_due_partition_today(self):
         mock_file_attr = MagicMock()
         mock_file_attr.st_mtime = datetime.now().timestamp()
-        result = is_modified_today(mock_file_attr)
+        result = is_in_due_partition(mock_file_attr)
         self.assertTrue(result)
 
-    def test_is_modified_today_false(self):
+    def test_is_in_due_partition_missed_day(self):
         mock_file_attr = MagicMock()
         mock_file_attr.st_mtime = datetime.now().timestamp() - 86400  # Yesterday
-        result = is_modified_today(mock_file_attr)
-        self.assertFalse(result)
+        result = is_in_due_partition(mock_file_attr)
+        self.assertTrue(result)  # caught up by this run
+
+    def test_is_in_due_partition_outside_window(self):
+        mock_file_attr = MagicMock()
+        mock_file_attr.st_mtime = 1725926400  # 2024-09-10 00:00 UTC
+        self.assertTrue(is_in_due_partition(mock_file_attr, today="2024-09-12"))
+        self.assertFalse(is_in_due_partition(mock_file_attr, today="2024-09-30"))
+        self.assertFalse(is_in_due_partition(mock_file_attr, today="2024-09-09"))
 
 
 # Test download_and_delete_file function with XML content
 class TestDownloadAndDeleteFile(unittest.TestCase):
+    @patch("download_files_from_sftp.keep_remote_mtime")
     @patch("builtins.open", new_callable=MagicMock)  # Patch open to mock file handling
-    def test_download_and_delete_file_success(self, mock_open):
+    def test_download_and_delete_file_success(self, mock_open, mock_keep_mtime):
         # Create a mock SFTP client
         mock_sftp = MagicMock()
 
@@ -112,15 +132,217 @@ class TestDownloadAndDeleteFile(unittest.TestCase):
         # Ensure remove is called once with the correct file path
         mock_sftp.remove.assert_called_once_with("/data/file1.xml")
 
+        # The local copy keeps the remote modification time
+        mock_keep_mtime.assert_called_once_with("./downloads/file1.xml", mock_file_attr)
+
+    @patch("download_files_from_sftp.keep_remote_mtime")
+    @patch("download_files_from_sftp.download_file_pipelined")
+    @patch("download_files_from_sftp.SFTP_DOWNLOAD_MODE", "pipelined")
+    @patch("builtins.open", new_callable=MagicMock)
+    def test_download_and_delete_file_pipelined(
+        self, mock_open, mock_pipelined, mock_keep_mtime
+    ):
+        mock_sftp = MagicMock()
+        mock_file_attr = MagicMock()
+        mock_file_attr.filename = "file1.xml"
+        mock_pipelined.return_value = 2048
+
+        stats = download_and_delete_file(mock_sftp, mock_file_attr)
+
+        mock_pipelined.assert_called_once_with(
+            mock_sftp, "/data/file1.xml", mock_open().__enter__()
+        )
+        mock_sftp.getfo.assert_not_called()
+        mock_sftp.remove.assert_called_once_with("/data/file1.xml")
+        self.assertEqual(stats["bytes"], 2048)
+        self.assertEqual(stats["mode"], "pipelined")
+
+
+# Test the pipelined download and its throughput metrics
+class TestPipelinedDownload(unittest.TestCase):
+    def test_download_file_pipelined(self):
+        mock_sftp = MagicMock()
+        mock_remote_file = mock_sftp.open.return_value.__enter__.return_value
+        mock_remote_file.stat.return_value.st_size = 5
+        mock_remote_file.read.side_effect = [b"abc", b"de", b""]
+        local_file = io.BytesIO()
+
+        size = download_file_pipelined(
+            mock_sftp, "/data/file1.xml", local_file, chunk_size=3, prefetch_depth=16
+        )
+
+        self.assertEqual(size, 5)
+        self.assertEqual(local_file.getvalue(), b"abcde")
+        mock_remote_file.prefetch.assert_called_once_with(5, max_concurrent_requests=16)
+        mock_remote_file.read.assert_called_with(3)
+
+    def test_get_transfer_stats(self):
+        stats = get_transfer_stats("file1.xml", 4_000_000, 2.0, "default")
+        self.assertEqual(stats["mb_per_second"], 2.0)
+
+        # Instant transfers do not divide by zero
+        stats = get_transfer_stats("file1.xml", 10, 0, "default")
+        self.assertEqual(stats["mb_per_second"], 0.0)
+
+
+# Test download_with_pool
+class TestDownloadWithPool(unittest.TestCase):
+    @patch("download_files_from_sftp.download_and_delete_file")
+    def test_download_with_pool_uses_pooled_session(self, mock_download):
+        mock_pool = MagicMock()
+        mock_pool.size = 4
+        mock_sftp = mock_pool.connection.return_value.__enter__.return_value
+        mock_file_attr = MagicMock()
+        mock_file_attr.st_size = 10
+
+        download_with_pool(mock_pool, mock_file_attr)
+
+        mock_download.assert_called_once_with(mock_sftp, mock_file_attr, None)
+
+    @patch("download_files_from_sftp.download_and_delete_file")
+    def test_download_with_pool_connection_error(self, mock_download):
+        mock_pool = MagicMock()
+        mock_pool.size = 4
+        mock_pool.connection.side_effect = ConnectionError("No session")
+        mock_file_attr = MagicMock()
+        mock_file_attr.filename = "file1.xml"
+        mock_file_attr.st_size = 10
+
+        with self.assertLogs(level="ERROR") as log:
+            download_with_pool(mock_pool, mock_file_attr)
+            self.assertIn("Error downloading file file1.xml", log.output[0])
+
+        mock_download.assert_not_called()
+
+    @patch("download_files_from_sftp.download_and_delete_file_in_ranges")
+    @patch("download_files_from_sftp.SFTP_RANGE_THRESHOLD", 100)
+    def test_download_with_pool_large_file_uses_ranges(self, mock_ranges):
+        mock_pool = MagicMock()
+        mock_pool.size = 4
+        mock_file_attr = MagicMock()
+        mock_file_attr.st_size = 100
+
+        download_with_pool(mock_pool, mock_file_attr)
+
+        mock_ranges.assert_called_once_with(mock_pool, mock_file_attr, manifest=None)
+        mock_pool.connection.assert_not_called()
+
+
+# Remote file stand-in supporting the readv and check-file calls
+class FakeRemoteFile:
+    def __init__(self, data, supports_check=True):
+        self.data = data
+        self.supports_check = supports_check
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def readv(self, chunks):
+        for offset, length in chunks:
+            yield self.data[offset : offset + length]
+
+    def check(self, hash_algorithm):
+        if not self.supports_check:
+            raise IOError("Operation unsupported")
+        return hashlib.new(hash_algorithm, self.data).digest()
+
+
+# Test the chunked parallel range download
+class TestRangedDownload(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.data = bytes(range(256)) * 5
+        self.file_attr = MagicMock()
+        self.file_attr.filename = "large.xml"
+        self.file_attr.st_size = len(self.data)
+        self.file_attr.st_mtime = 1725926400
+        self.local_path = os.path.join(self.tmp_dir.name, "large.xml")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def make_pool(self, remote_file):
+        self.sftp = MagicMock()
+        self.sftp.open.side_effect = lambda *args: remote_file
+        # Unchanged since the listing
+        self.sftp.stat.return_value.st_size = self.file_attr.st_size
+        self.sftp.stat.return_value.st_mtime = self.file_attr.st_mtime
+        return SFTPConnectionPool(lambda: self.sftp, size=3)
+
+    def download(self, pool):
+        with patch("download_files_from_sftp.DOWNLOAD_PATH", self.tmp_dir.name), patch(
+            "download_files_from_sftp.SFTP_CHUNK_SIZE", 100
+        ):
+            return download_and_delete_file_in_ranges(pool, self.file_attr, 300)
+
+    def test_split_ranges(self):
+        self.assertEqual(split_ranges(10, 4), [(0, 4), (4, 4), (8, 2)])
+        self.assertEqual(split_ranges(0, 4), [])
 
-# Test download_today_files
-class TestDownloadTodayFiles(unittest.TestCase):
+    def test_download_in_ranges(self):
+        pool = self.make_pool(FakeRemoteFile(self.data))
+
+        stats = self.download(pool)
+
+        with open(self.local_path, "rb") as local_file:
+            self.assertEqual(local_file.read(), self.data)
+        self.assertEqual(stats["bytes"], len(self.data))
+        self.assertEqual(stats["mode"], "ranged")
+        self.assertEqual(os.path.getmtime(self.local_path), 1725926400)
+        self.sftp.remove.assert_called_once_with("/data/large.xml")
+
+    def test_download_in_ranges_without_check_file(self):
+        pool = self.make_pool(FakeRemoteFile(self.data, supports_check=False))
+
+        self.assertIsNotNone(self.download(pool))
+        self.sftp.remove.assert_called_once_with("/data/large.xml")
+
+    def test_checksum_mismatch_keeps_remote_file(self):
+        remote_file = FakeRemoteFile(self.data)
+        remote_file.check = lambda hash_algorithm: b"\x00" * 20
+        pool = self.make_pool(remote_file)
+
+        with self.assertLogs(level="ERROR") as log:
+            self.assertIsNone(self.download(pool))
+            self.assertIn("Checksum mismatch", log.output[0])
+
+        self.sftp.remove.assert_not_called()
+        self.assertFalse(os.path.exists(self.local_path))
+
+    def test_short_range_keeps_remote_file(self):
+        remote_file = FakeRemoteFile(self.data[:1000], supports_check=False)
+        pool = self.make_pool(remote_file)
+
+        with self.assertLogs(level="ERROR") as log:
+            self.assertIsNone(self.download(pool))
+            self.assertIn("Short read", log.output[0])
+
+        self.sftp.remove.assert_not_called()
+
+    def test_growing_file_keeps_remote_file(self):
+        pool = self.make_pool(FakeRemoteFile(self.data, supports_check=False))
+        # More data was appended after the file was listed
+        self.sftp.stat.return_value.st_size = len(self.data) + 100
+
+        with self.assertLogs(level="ERROR") as log:
+            self.assertIsNone(self.download(pool))
+            self.assertIn("changed while it was downloaded", log.output[0])
+
+        self.sftp.remove.assert_not_called()
+        self.assertFalse(os.path.exists(self.local_path))
+
+
+# Test download_due_files
+class TestDownloadDueFiles(unittest.TestCase):
     @patch("download_files_from_sftp.ThreadPoolExecutor")
     @patch("download_files_from_sftp.create_sftp_connection")
     @patch("download_files_from_sftp.get_files_from_sftp")
-    @patch("download_files_from_sftp.is_modified_today")
-    def test_download_today_files(
-        self, mock_is_modified_today, mock_get_files, mock_create_sftp, mock_executor
+    @patch("download_files_from_sftp.is_in_due_partition")
+    def test_download_due_files(
+        self, mock_is_in_due_partition, mock_get_files, mock_create_sftp, mock_executor
     ):
         # Mock SFTP connection and files
         mock_sftp = MagicMock()
@@ -128,24 +350,118 @@ class TestDownloadTodayFiles(unittest.TestCase):
         mock_file_attr = MagicMock()
         mock_file_attr.st_mtime = datetime.now().timestamp()
         mock_get_files.return_value = [mock_file_attr]
-        mock_is_modified_today.return_value = True
+        mock_is_in_due_partition.return_value = True
 
         # Mock ThreadPoolExecutor
         mock_executor_instance = MagicMock()
         mock_executor.return_value.__enter__.return_value = mock_executor_instance
 
         # Call the function
-        download_today_files()
+        download_due_files()
 
-        # Ensure that files modified today are downloaded
+        # Ensure that files of the due partitions are downloaded
         mock_executor_instance.submit.assert_called_once()
 
+    @patch("download_files_from_sftp.ThreadPoolExecutor")
+    @patch("download_files_from_sftp.create_sftp_connection")
+    @patch("download_files_from_sftp.get_files_from_sftp")
+    @patch("download_files_from_sftp.is_in_due_partition")
+    def test_download_due_files_pool_size(
+        self, mock_is_in_due_partition, mock_get_files, mock_create_sftp, mock_executor
+    ):
+        mock_get_files.return_value = [MagicMock()]
+        mock_is_in_due_partition.return_value = True
+
+        download_due_files(pool_size=8)
+
+        # One download worker per pooled session
+        mock_executor.assert_called_once_with(max_workers=8)
+
     @patch("download_files_from_sftp.create_sftp_connection")
     def test_no_sftp_connection(self, mock_create_sftp):
         mock_create_sftp.return_value = None
-        download_today_files()
+        download_due_files()
         mock_create_sftp.assert_called_once()
 
 
+def make_remote_file(filename, mtime=None):
+    file_attr = paramiko.SFTPAttributes()
+    file_attr.filename = filename
+    file_attr.st_size = 10
+    file_attr.st_mtime = mtime or datetime.now().timestamp()
+    return file_attr
+
+
+# Test the streaming listing
+class TestStreamingListing(unittest.TestCase):
+    def test_iter_files_from_sftp_filters_while_streaming(self):
+        sftp = MagicMock()
+        sftp.listdir_iter.return_value = iter(
+            [make_remote_file("a.xml"), make_remote_file("b.txt")]
+        )
+
+        files = iter_files_from_sftp(
+            sftp, "/data", lambda f: f.filename.endswith("xml")
+        )
+
+        self.assertEqual([f.filename for f in files], ["a.xml"])
+        sftp.listdir_iter.assert_called_once_with("/data")
+
+    def test_is_due_file(self):
+        self.assertTrue(is_due_file(make_remote_file("a.xml"), "*.xml"))
+        self.assertFalse(is_due_file(make_remote_file("a.txt"), "*.xml"))
+        self.assertFalse(is_due_file(make_remote_file("a.xml", mtime=86400), "*"))
+
+    @patch("download_files_from_sftp.SFTP_LIST_MODE", "streaming")
+    @patch("download_files_from_sftp.create_sftp_connection")
+    @patch("download_files_from_sftp.download_with_pool")
+    def test_downloads_start_before_listing_ends(self, mock_download, mock_create_sftp):
+        first_downloaded = threading.Event()
+        listing_waited = []
+
+        def listdir_iter(pathname):
+            yield make_remote_file("a.xml")
+            # The second entry only arrives once the first file is downloading
+            listing_waited.append(first_downloaded.wait(timeout=5))
+            yield make_remote_file("b.xml")
+
+        def download(pool, file_attr, manifest=None):
+            first_downloaded.set()
+            return get_transfer_stats(file_attr.filename, 10, 0.1, "default")
+
+        mock_create_sftp.return_value.listdir_iter.side_effect = listdir_iter
+        mock_download.side_effect = download
+
+        stats = download_due_files(pool_size=2)
+
+        self.assertEqual(listing_waited, [True])
+        self.assertEqual([s["file_name"] for s in stats], ["a.xml", "b.xml"])
+
+    @patch("download_files_from_sftp.SFTP_LIST_MODE", "streaming")
+    @patch("download_files_from_sftp.create_sftp_connection")
+    @patch("download_files_from_sftp.download_with_pool")
+    def test_streaming_with_one_pooled_session(self, mock_download, mock_create_sftp):
+        mock_create_sftp.return_value.listdir_iter.return_value = iter(
+            [make_remote_file("a.xml"), make_remote_file("b.xml")]
+        )
+
+        # Every download needs the only pooled session
+        def download(pool, file_attr, manifest=None):
+            with pool.connection():
+                return get_transfer_stats(file_attr.filename, 10, 0.1, "default")
+
+        mock_download.side_effect = download
+        results = []
+        worker = threading.Thread(
+            target=lambda: results.append(download_due_files(pool_size=1)),
+            daemon=True,
+        )
+        worker.start()
+        worker.join(timeout=5)
+
+        self.assertFalse(worker.is_alive(), "the download waited for the listing")
+        self.assertEqual(sorted(s["file_name"] for s in results[0]), ["a.xml", "b.xml"])
+
+
 if __name__ == "__main__":
     unittest.main()
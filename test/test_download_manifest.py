@@ -0,0 +1,122 @@
+import sys
+import os
+
+# Add the `src` directory to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+from download_manifest import DownloadManifest, manifest_key, open_manifest
+from download_files_from_sftp import skip_downloaded_files
+
+
+def make_file_attr(filename, size=100, mtime=1725969600.5):
+    file_attr = MagicMock()
+    file_attr.filename = filename
+    file_attr.st_size = size
+    file_attr.st_mtime = mtime
+    return file_attr
+
+
+class TestDownloadManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "manifest.sqlite3")
+        self.manifest = DownloadManifest(self.path)
+
+    def tearDown(self):
+        self.manifest.close()
+        self.tmp_dir.cleanup()
+
+    def test_downloaded_keys_survive_reopen(self):
+        self.manifest.mark_downloaded(make_file_attr("a.xml"))
+        self.manifest.close()
+
+        self.manifest = DownloadManifest(self.path)
+        self.assertEqual(self.manifest.downloaded_keys(), {("a.xml", 100, 1725969600)})
+
+    def test_resent_file_is_a_new_entry(self):
+        self.manifest.mark_downloaded(make_file_attr("a.xml"))
+        self.assertNotIn(
+            manifest_key(make_file_attr("a.xml", size=200)),
+            self.manifest.downloaded_keys(),
+        )
+
+    def test_pending_stages(self):
+        self.manifest.mark_downloaded(make_file_attr("a.xml"))
+        self.manifest.mark_downloaded(make_file_attr("b.xml"))
+        self.manifest.mark(["a.xml"], "transformed")
+
+        names = ["a.xml", "b.xml", "local.xml"]
+        self.assertEqual(
+            self.manifest.pending(names, "transformed"), ["b.xml", "local.xml"]
+        )
+        self.assertEqual(self.manifest.pending(names, "uploaded"), names)
+
+        # A new version of a finished file is pending again
+        self.manifest.mark_downloaded(make_file_attr("a.xml", mtime=1726000000))
+        self.assertIn("a.xml", self.manifest.pending(names, "transformed"))
+
+    def test_local_file_is_finished_once_marked(self):
+        self.manifest.mark(["local.xml"], "transformed")
+        self.manifest.mark(["local.xml"], "uploaded")
+
+        self.assertEqual(self.manifest.pending(["local.xml"], "transformed"), [])
+        self.assertEqual(self.manifest.pending(["local.xml"], "uploaded"), [])
+        # The file was never downloaded from the server
+        self.assertEqual(self.manifest.downloaded_keys(), set())
+
+    def test_unknown_stage(self):
+        with self.assertRaises(ValueError):
+            self.manifest.mark(["a.xml"], "deleted")
+
+    def test_manifest_is_disabled_by_default(self):
+        with patch("download_manifest.MANIFEST_PATH", None):
+            self.assertIsNone(open_manifest())
+
+
+class TestSkipDownloadedFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.manifest = DownloadManifest(
+            os.path.join(self.tmp_dir.name, "manifest.sqlite3")
+        )
+
+    def tearDown(self):
+        self.manifest.close()
+        self.tmp_dir.cleanup()
+
+    @patch("download_files_from_sftp.remove_remote_file")
+    def test_downloaded_file_is_only_deleted(self, mock_remove):
+        done = make_file_attr("done.xml")
+        new = make_file_attr("new.xml")
+        self.manifest.mark_downloaded(done)
+        open(os.path.join(self.tmp_dir.name, "done.xml"), "w").close()
+
+        with patch("download_files_from_sftp.DOWNLOAD_PATH", self.tmp_dir.name):
+            files = skip_downloaded_files("pool", [done, new], self.manifest)
+
+        self.assertEqual(files, [new])
+        mock_remove.assert_called_once_with("pool", done)
+
+    @patch("download_files_from_sftp.remove_remote_file")
+    def test_missing_local_copy_is_downloaded_again(self, mock_remove):
+        done = make_file_attr("done.xml")
+        self.manifest.mark_downloaded(done)
+
+        with patch("download_files_from_sftp.DOWNLOAD_PATH", self.tmp_dir.name):
+            files = skip_downloaded_files("pool", [done], self.manifest)
+
+        self.assertEqual(files, [done])
+        mock_remove.assert_not_called()
+
+    def test_without_manifest_every_file_is_kept(self):
+        files = [make_file_attr("a.xml")]
+        self.assertIs(skip_downloaded_files("pool", files, None), files)
+
+
+if __name__ == "__main__":
+    unittest.main()
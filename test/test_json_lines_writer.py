@@ -0,0 +1,61 @@
+import sys
+import os
+
+# Add the `src` directory to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+import io
+import json
+import unittest
+from unittest.mock import MagicMock
+from json_lines_writer import encode_user_line, write_json_lines
+
+
+def make_user(user_id="1", user_name="Alice", user_age=30, event_time="2024"):
+    return {
+        "UserID": user_id,
+        "UserName": user_name,
+        "UserAge": user_age,
+        "EventTime": event_time,
+    }
+
+
+class TestJsonLinesWriter(unittest.TestCase):
+
+    def assertSameAsJsonDumps(self, user):
+        self.assertEqual(encode_user_line(user), json.dumps(user) + "\n")
+
+    def test_encode_user_line_matches_json_dumps(self):
+        self.assertSameAsJsonDumps(make_user())
+        self.assertSameAsJsonDumps(make_user(user_age=None))
+        self.assertSameAsJsonDumps(make_user(user_age=10**30))
+        self.assertSameAsJsonDumps(make_user(user_name='Zoë "Z" \\ \n\t\x7f ☃'))
+        self.assertSameAsJsonDumps(make_user(user_name="\U0001f600"))
+
+    def test_encode_user_line_outside_the_schema(self):
+        self.assertSameAsJsonDumps({"UserID": "1", "UserName": "Test"})
+        self.assertSameAsJsonDumps(make_user(user_age=True))
+        self.assertSameAsJsonDumps(make_user(user_age=30.5))
+        self.assertSameAsJsonDumps(make_user(user_id=1))
+        # Same fields in another order keep their order
+        self.assertSameAsJsonDumps({"UserName": "Alice", **make_user()})
+
+    def test_write_json_lines_in_batches(self):
+        users = [make_user(user_id=str(index)) for index in range(5)]
+        file = MagicMock()
+
+        count = write_json_lines(file, users, batch_size=2)
+
+        self.assertEqual(count, 5)
+        self.assertEqual(file.write.call_count, 3)
+        written = "".join(call.args[0] for call in file.write.call_args_list)
+        self.assertEqual(written, "".join(json.dumps(user) + "\n" for user in users))
+
+    def test_write_json_lines_without_users(self):
+        file = io.StringIO()
+        self.assertEqual(write_json_lines(file, iter([])), 0)
+        self.assertEqual(file.getvalue(), "")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -6,27 +6,44 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../src"
 
 import unittest
 from unittest.mock import patch, MagicMock
-from main import main_workflow
+from main import main_workflow, open_output
+
+PARTITIONS = [
+    ("2024-09-09", ["./downloads/file0.xml"]),
+    ("2024-09-10", ["./downloads/file1.xml"]),
+]
 
 
 class TestMainWorkflow(unittest.TestCase):
 
+    def setUp(self):
+        # The downloaded files fall into two day partitions
+        patcher = patch("main.due_partitions", return_value=PARTITIONS)
+        self.mock_due_partitions = patcher.start()
+        self.addCleanup(patcher.stop)
+
     @patch("main.upload_json_files_to_s3")
-    @patch("main.transform_xml_to_json")
-    @patch("main.download_today_files")
+    @patch("main.transform_partitions")
+    @patch("main.download_due_files")
     @patch("main.logging")
     def test_main_workflow_success(
         self, mock_logging, mock_download_files, mock_transform, mock_upload
     ):
+        mock_transform.return_value = {"2024-09-09": 30.0, "2024-09-10": 40.0}
+
         # Run the main workflow
         main_workflow()
 
         # Ensure each step is called once
         mock_download_files.assert_called_once()
+        self.mock_due_partitions.assert_called_once_with(["./downloads/file1.xml"])
         mock_transform.assert_called_once_with(
-            "./downloads/file1.xml"
-        )  # This can be replaced with the actual file path logic
-        mock_upload.assert_called_once()
+            PARTITIONS, open_output=open_output
+        )  # Every partition is transformed in one batch
+        self.assertEqual(
+            sorted(call.args for call in mock_upload.call_args_list),
+            [("2024-09-09",), ("2024-09-10",)],
+        )  # Each partition is uploaded to its own prefix
 
         # Check that logging was called
         mock_logging.info.assert_any_call(
@@ -41,8 +58,8 @@ class TestMainWorkflow(unittest.TestCase):
         mock_logging.info.assert_any_call("Process completed successfully!")
 
     @patch("main.upload_json_files_to_s3")
-    @patch("main.transform_xml_to_json")
-    @patch("main.download_today_files")
+    @patch("main.transform_partitions")
+    @patch("main.download_due_files")
     @patch("main.logging")
     def test_main_workflow_failure(
         self, mock_logging, mock_download_files, mock_transform, mock_upload
@@ -57,6 +74,169 @@ class TestMainWorkflow(unittest.TestCase):
         # Ensure the error is logged
         mock_logging.error.assert_called_with("An error occurred: Transformation error")
 
+    @patch("main.needs_upload", return_value=False)
+    @patch("main.upload_json_files_to_s3")
+    @patch("main.transform_partitions")
+    @patch("main.download_due_files")
+    @patch("main.logging")
+    def test_main_workflow_streamed_to_s3(
+        self,
+        mock_logging,
+        mock_download_files,
+        mock_transform,
+        mock_upload,
+        mock_needs_upload,
+    ):
+        main_workflow()
+
+        # The outputs are already on S3, nothing is uploaded again
+        mock_transform.assert_called_once()
+        mock_upload.assert_not_called()
+
+    @patch("main.open_manifest")
+    @patch("main.upload_json_files_to_s3")
+    @patch("main.transform_partitions")
+    @patch("main.download_due_files")
+    @patch("main.logging")
+    def test_main_workflow_skips_finished_files(
+        self,
+        mock_logging,
+        mock_download_files,
+        mock_transform,
+        mock_upload,
+        mock_open_manifest,
+    ):
+        manifest = mock_open_manifest.return_value
+        manifest.pending.return_value = []
+
+        main_workflow()
+
+        # Every downloaded file was already uploaded by a previous run
+        mock_download_files.assert_called_once_with(manifest=manifest)
+        self.assertEqual(
+            [call.args for call in manifest.pending.call_args_list],
+            [(["file0.xml"], "uploaded"), (["file1.xml"], "uploaded")],
+        )
+        mock_transform.assert_not_called()
+        mock_upload.assert_not_called()
+        manifest.close.assert_called_once()
+
+    @patch("main.open_manifest")
+    @patch("main.upload_json_files_to_s3")
+    @patch("main.transform_partitions")
+    @patch("main.download_due_files")
+    @patch("main.logging")
+    def test_main_workflow_catches_up_unfinished_partition(
+        self,
+        mock_logging,
+        mock_download_files,
+        mock_transform,
+        mock_upload,
+        mock_open_manifest,
+    ):
+        manifest = mock_open_manifest.return_value
+        # The run of 2024-09-09 was missed, the next day was already done
+        manifest.pending.side_effect = lambda names, stage: (
+            names if names == ["file0.xml"] else []
+        )
+        mock_transform.return_value = {"2024-09-09": 30.0}
+        mock_upload.return_value = [
+            {"file_name": "above_average_output.json"},
+            {"file_name": "below_average_output.json"},
+        ]
+
+        main_workflow()
+
+        mock_transform.assert_called_once_with(PARTITIONS[:1], open_output=open_output)
+        mock_upload.assert_called_once_with("2024-09-09")
+        manifest.mark.assert_any_call(["file0.xml"], "transformed")
+        manifest.mark.assert_any_call(["file0.xml"], "uploaded")
+
+    @patch("main.open_manifest")
+    @patch("main.upload_json_files_to_s3")
+    @patch("main.transform_partitions")
+    @patch("main.download_due_files")
+    @patch("main.logging")
+    def test_main_workflow_retries_partial_upload(
+        self,
+        mock_logging,
+        mock_download_files,
+        mock_transform,
+        mock_upload,
+        mock_open_manifest,
+    ):
+        manifest = mock_open_manifest.return_value
+        manifest.pending.side_effect = lambda names, stage: names
+        mock_transform.return_value = {"2024-09-09": 30.0, "2024-09-10": 40.0}
+        # Only one of the two outputs of 2024-09-10 reached S3
+        mock_upload.side_effect = lambda partition: [
+            {"file_name": "above_average_output.json"},
+            {"file_name": "below_average_output.json"},
+        ][: 2 if partition == "2024-09-09" else 1]
+
+        main_workflow()
+
+        manifest.mark.assert_any_call(["file0.xml"], "uploaded")
+        self.assertNotIn(
+            (["file1.xml"], "uploaded"),
+            [call.args for call in manifest.mark.call_args_list],
+        )
+        mock_logging.error.assert_called_once_with(
+            "Upload of partition %s failed, the next run uploads it again.",
+            "2024-09-10",
+        )
+
+    @patch("main.DAY_STATE_DIR", "./state")
+    @patch("main.update_partitions")
+    @patch("main.upload_json_files_to_s3")
+    @patch("main.transform_partitions")
+    @patch("main.download_due_files")
+    @patch("main.logging")
+    def test_main_workflow_with_day_state(
+        self,
+        mock_logging,
+        mock_download_files,
+        mock_transform,
+        mock_upload,
+        mock_update_partitions,
+    ):
+        mock_update_partitions.return_value = {"2024-09-09": 30.0, "2024-09-10": 40.0}
+
+        main_workflow()
+
+        # The partitions are updated through their persisted state
+        mock_update_partitions.assert_called_once_with(
+            PARTITIONS, open_output=open_output
+        )
+        mock_transform.assert_not_called()
+        self.assertEqual(mock_upload.call_count, 2)
+
+    @patch("main.PIPELINE_MODE", "async")
+    @patch("main.run_pipeline", new_callable=MagicMock)
+    @patch("main.asyncio")
+    @patch("main.download_due_files")
+    @patch("main.logging")
+    def test_main_workflow_async(
+        self, mock_logging, mock_download_files, mock_asyncio, mock_run_pipeline
+    ):
+        main_workflow()
+
+        mock_asyncio.run.assert_called_once_with(mock_run_pipeline.return_value)
+        mock_download_files.assert_not_called()
+        mock_logging.info.assert_any_call("Process completed successfully!")
+
+    @patch("main.PIPELINE_MODE", "watch")
+    @patch("main.run_watch")
+    @patch("main.download_due_files")
+    @patch("main.logging")
+    def test_main_workflow_watch(
+        self, mock_logging, mock_download_files, mock_run_watch
+    ):
+        main_workflow()
+
+        mock_run_watch.assert_called_once_with()
+        mock_download_files.assert_not_called()
+
 
 if __name__ == "__main__":
     unittest.main()
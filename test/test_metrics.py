@@ -0,0 +1,137 @@
+import sys
+import os
+
+# Add the `src` directory to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+import tempfile
+import unittest
+import urllib.request
+from xml.etree.ElementTree import Element, SubElement
+from metrics import (
+    FIELD_WARNINGS,
+    RECORDS_PARSED,
+    REGISTRY,
+    Counter,
+    Histogram,
+    MetricsRegistry,
+    merge_worker_metrics,
+    run_with_metrics,
+    serve_metrics,
+    time_stage,
+    write_metrics_file,
+)
+from transform_xml_to_json import flush_field_warnings, get_field, transform_xml_files
+
+SAMPLE_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<Users>
+    <User>
+        <UserID>1</UserID>
+        <UserName>Alice</UserName>
+        <UserAge>30</UserAge>
+        <EventTime>2024-07-30T10:00:00</EventTime>
+    </User>
+    <User>
+        <UserID>2</UserID>
+        <UserAge>40</UserAge>
+    </User>
+</Users>
+"""
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_counter_samples(self):
+        counter = Counter("warnings", "Warnings")
+        counter.inc(field="UserAge")
+        counter.inc(2, field="UserAge")
+        counter.inc(field='Na"me')
+        self.assertEqual(
+            list(counter.samples()),
+            ['warnings_total{field="Na\\"me"} 1', 'warnings_total{field="UserAge"} 3'],
+        )
+
+    def test_histogram_samples_are_cumulative(self):
+        histogram = Histogram("latency", "Latency", buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 2):
+            histogram.observe(value)
+        self.assertEqual(
+            list(histogram.samples()),
+            [
+                'latency_bucket{le="0.1"} 2',
+                'latency_bucket{le="1"} 3',
+                'latency_bucket{le="+Inf"} 4',
+                "latency_sum 2.65",
+                "latency_count 4",
+            ],
+        )
+
+    def test_render_openmetrics(self):
+        registry = MetricsRegistry()
+        registry.counter("files", "Files").inc()
+        text = registry.render()
+        self.assertEqual(
+            text, "# TYPE files counter\n# HELP files Files\nfiles_total 1\n# EOF\n"
+        )
+
+    def test_worker_metrics_are_merged(self):
+        before = RECORDS_PARSED.value()
+        result_with_metrics = run_with_metrics(RECORDS_PARSED.inc, 5)
+        # The worker registry only holds the call, the parent gets it back
+        RECORDS_PARSED.values.clear()
+        RECORDS_PARSED.inc(before)
+
+        self.assertIsNone(merge_worker_metrics(result_with_metrics))
+        self.assertEqual(RECORDS_PARSED.value(), before + 5)
+
+    def test_get_field_counts_missing_fields(self):
+        user = Element("User")
+        SubElement(user, "UserID").text = "1"
+        before = FIELD_WARNINGS.value(field="UserAge")
+        get_field(user, "UserAge")
+        get_field(user, "UserAge")
+        flush_field_warnings("users.xml")
+        self.assertEqual(FIELD_WARNINGS.value(field="UserAge"), before + 2)
+
+    def test_time_stage(self):
+        with time_stage("test"):
+            pass
+        self.assertEqual(REGISTRY.metrics["stage_seconds"].count(stage="test"), 1)
+
+    def test_parallel_transform_reports_worker_records(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cwd = os.getcwd()
+            os.chdir(tmp_dir)
+            try:
+                paths = []
+                for name in ("a.xml", "b.xml"):
+                    with open(name, "w") as file:
+                        file.write(SAMPLE_XML)
+                    paths.append(os.path.join(tmp_dir, name))
+                before = RECORDS_PARSED.value()
+                transform_xml_files(paths, max_workers=2)
+            finally:
+                os.chdir(cwd)
+        self.assertEqual(RECORDS_PARSED.value(), before + 4)
+
+    def test_metrics_file_and_endpoint(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "metrics.txt")
+            write_metrics_file(path)
+            with open(path) as file:
+                self.assertIn("# TYPE xml_records_parsed counter", file.read())
+
+        server = serve_metrics(port=0)
+        try:
+            url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+            with urllib.request.urlopen(url) as response:
+                body = response.read().decode()
+                content_type = response.headers["Content-Type"]
+        finally:
+            server.shutdown()
+        self.assertTrue(content_type.startswith("application/openmetrics-text"))
+        self.assertTrue(body.endswith("# EOF\n"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+import sys
+import os
+
+# Add the `src` directory to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+import gzip
+import importlib.util
+import io
+import unittest
+from unittest.mock import MagicMock
+from output_formats import (
+    FormattedOutput,
+    get_content_headers,
+    output_file_name,
+)
+
+HAS_ZSTANDARD = importlib.util.find_spec("zstandard") is not None
+HAS_PYARROW = importlib.util.find_spec("pyarrow") is not None
+
+LINES = (
+    '{"UserID": "1", "UserName": "Alice", "UserAge": 30, '
+    '"EventTime": "2024-07-30T10:00:00.000Z"}\n'
+    '{"UserID": "2", "UserName": "Bob", "UserAge": 25, '
+    '"EventTime": "0000-00-00T00:00:00.000Z"}\n'
+)
+
+
+# In-memory binary sink that keeps its content after being closed
+class MemorySink(io.BytesIO):
+    def close(self):
+        self.content = self.getvalue()
+        super().close()
+
+
+def write_format(output_format):
+    sink = MemorySink()
+    with FormattedOutput(sink, output_format) as writer:
+        # Lines are split across writes like the batched writers do
+        writer.write(LINES[:50])
+        writer.write(LINES[50:])
+    return sink.content
+
+
+class TestOutputFormats(unittest.TestCase):
+
+    def test_output_file_name(self):
+        name = "above_average_output.json"
+        self.assertEqual(output_file_name(name, "jsonl"), name)
+        self.assertEqual(output_file_name(name, "jsonl.gz"), name + ".gz")
+        self.assertEqual(output_file_name(name, "jsonl.zst"), name + ".zst")
+        self.assertEqual(
+            output_file_name(name, "parquet"), "above_average_output.parquet"
+        )
+
+    def test_get_content_headers(self):
+        self.assertEqual(
+            get_content_headers("out.json"), {"ContentType": "application/x-ndjson"}
+        )
+        self.assertEqual(
+            get_content_headers("out.json.gz"),
+            {"ContentType": "application/x-ndjson", "ContentEncoding": "gzip"},
+        )
+        self.assertEqual(
+            get_content_headers("out.parquet"),
+            {"ContentType": "application/vnd.apache.parquet"},
+        )
+
+    def test_jsonl(self):
+        self.assertEqual(write_format("jsonl"), LINES.encode())
+
+    def test_gzip(self):
+        self.assertEqual(gzip.decompress(write_format("jsonl.gz")), LINES.encode())
+
+    @unittest.skipUnless(HAS_ZSTANDARD, "zstandard is not installed")
+    def test_zstd(self):
+        import zstandard
+
+        data = write_format("jsonl.zst")
+        reader = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data))
+        self.assertEqual(reader.read(), LINES.encode())
+
+    @unittest.skipUnless(HAS_PYARROW, "pyarrow is not installed")
+    def test_parquet_typed_columns(self):
+        import pyarrow
+        import pyarrow.parquet
+
+        table = pyarrow.parquet.read_table(io.BytesIO(write_format("parquet")))
+
+        self.assertEqual(table.schema.field("UserAge").type, pyarrow.int64())
+        self.assertEqual(
+            table.schema.field("EventTime").type, pyarrow.timestamp("ms", tz="UTC")
+        )
+        self.assertEqual(table.column("UserAge").to_pylist(), [30, 25])
+        event_times = table.column("EventTime").to_pylist()
+        self.assertEqual(event_times[0].isoformat(), "2024-07-30T10:00:00+00:00")
+        # The invalid default date is stored as a null
+        self.assertIsNone(event_times[1])
+
+    @unittest.skipUnless(HAS_PYARROW, "pyarrow is not installed")
+    def test_parquet_leaves_closing_to_the_sink(self):
+        sink = MagicMock()
+        with FormattedOutput(sink, "parquet") as writer:
+            writer.write(LINES)
+
+        sink.close.assert_not_called()
+        sink.__exit__.assert_called_once_with(None, None, None)
+
+    def test_sink_is_aborted_on_error(self):
+        sink = MagicMock()
+
+        with self.assertRaises(ValueError):
+            with FormattedOutput(sink, "jsonl.gz") as writer:
+                writer.write(LINES)
+                raise ValueError("Serialization failed")
+
+        self.assertIs(sink.__exit__.call_args.args[0], ValueError)
+
+
+if __name__ == "__main__":
+    unittest.main()
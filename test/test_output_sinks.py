@@ -0,0 +1,92 @@
+import sys
+import os
+
+# Add the `src` directory to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+from output_sinks import TeeWriter, needs_upload, open_output
+
+
+class TestOutputSinks(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        patcher = patch(
+            "output_sinks.get_json_file_path",
+            side_effect=lambda file_name, partition=None: os.path.join(
+                self.tmp_dir.name, file_name
+            ),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    @patch("output_sinks.open_s3_stream")
+    def test_open_output_local_only(self, mock_open_s3):
+        with open_output("above_average_output.json") as writer:
+            writer.write('{"UserID": "1"}\n')
+
+        with open(os.path.join(self.tmp_dir.name, "above_average_output.json")) as f:
+            self.assertEqual(f.read(), '{"UserID": "1"}\n')
+        mock_open_s3.assert_not_called()
+        self.assertTrue(needs_upload())
+
+    @patch("output_sinks.WRITE_LOCAL_JSON", False)
+    @patch("output_sinks.STREAM_TO_S3", True)
+    @patch("output_sinks.open_s3_stream")
+    def test_open_output_s3_only(self, mock_open_s3):
+        with open_output("above_average_output.json") as writer:
+            writer.write('{"UserID": "1"}\n')
+
+        mock_open_s3.assert_called_once_with(
+            "above_average_output.json", partition=None
+        )
+        mock_open_s3.return_value.write.assert_called_once_with(b'{"UserID": "1"}\n')
+        mock_open_s3.return_value.__exit__.assert_called_once_with(None, None, None)
+        self.assertEqual(os.listdir(self.tmp_dir.name), [])
+        self.assertFalse(needs_upload())
+
+    @patch("output_sinks.STREAM_TO_S3", True)
+    @patch("output_formats.OUTPUT_FORMAT", "jsonl.gz")
+    @patch("output_sinks.open_s3_stream")
+    def test_open_output_local_and_s3(self, mock_open_s3):
+        writer = open_output("above_average_output.json")
+
+        self.assertIsInstance(writer.sink, TeeWriter)
+        self.assertEqual(writer.sink.writers[1], mock_open_s3.return_value)
+        mock_open_s3.assert_called_once_with(
+            "above_average_output.json.gz", partition=None
+        )
+        with writer:
+            writer.write("line\n")
+        self.assertEqual(
+            os.listdir(self.tmp_dir.name), ["above_average_output.json.gz"]
+        )
+        self.assertFalse(needs_upload())
+
+    @patch("output_sinks.WRITE_LOCAL_JSON", False)
+    def test_open_output_without_sink(self):
+        with self.assertRaises(ValueError):
+            open_output("above_average_output.json")
+
+    def test_tee_writer(self):
+        first, second = MagicMock(), MagicMock()
+        second.__exit__.side_effect = IOError("Upload failed")
+
+        with self.assertRaises(IOError):
+            with TeeWriter([first, second]) as writer:
+                writer.write("line\n")
+
+        first.write.assert_called_once_with("line\n")
+        second.write.assert_called_once_with("line\n")
+        # The first writer is closed even though the second one failed
+        first.__exit__.assert_called_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,147 @@
+import sys
+import os
+
+# Add the `src` directory to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+import asyncio
+import shutil
+import tempfile
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+from day_partitions import partition_of, today_partition
+from pipeline import run_pipeline
+from transform_xml_to_json import transform_xml_files
+
+USER_XML = (
+    "<Users><User><UserID>{0}</UserID><UserName>User{0}</UserName>"
+    "<UserAge>{1}</UserAge><EventTime>2024-07-30T10:00:00</EventTime>"
+    "</User></Users>"
+)
+
+
+class TestRunPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp_dir.name)
+        self.remote_dir = os.path.join(self.tmp_dir.name, "remote")
+        self.download_dir = os.path.join(self.tmp_dir.name, "downloads")
+        os.makedirs(self.remote_dir)
+        os.makedirs(self.download_dir)
+
+        self.file_attrs = []
+        for index, age in enumerate([20, 40, 60]):
+            file_name = f"file{index}.xml"
+            with open(os.path.join(self.remote_dir, file_name), "w") as file:
+                file.write(USER_XML.format(index, age))
+            file_attr = MagicMock()
+            file_attr.filename = file_name
+            file_attr.st_mtime = time.time()
+            self.file_attrs.append(file_attr)
+        self.today = today_partition()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp_dir.cleanup()
+
+    # Stand-in for the pooled SFTP download, copies the "remote" file
+    def fake_download(self, pool, file_attr, manifest=None):
+        shutil.copy(
+            os.path.join(self.remote_dir, file_attr.filename), self.download_dir
+        )
+        return {"file_name": file_attr.filename}
+
+    def read_outputs(self):
+        outputs = {}
+        for root, _, files in os.walk("json"):
+            for name in files:
+                with open(os.path.join(root, name)) as file:
+                    outputs[name] = file.read()
+        return outputs
+
+    def run_pipeline(self, **kwargs):
+        with patch("pipeline.DOWNLOAD_PATH", self.download_dir), patch(
+            "pipeline.get_due_files", return_value=self.file_attrs
+        ), patch("pipeline.download_with_pool", side_effect=self.fake_download), patch(
+            "pipeline.upload_to_s3"
+        ) as mock_upload:
+            avg_age = asyncio.run(run_pipeline(**kwargs))
+        return avg_age, mock_upload
+
+    def test_pipeline_matches_batch_transform(self):
+        avg_ages, mock_upload = self.run_pipeline(
+            pool_size=2, transform_workers=2, queue_size=1
+        )
+        outputs = self.read_outputs()
+
+        transform_xml_files(
+            [os.path.join(self.remote_dir, f"file{index}.xml") for index in range(3)],
+            max_workers=1,
+        )
+
+        self.assertEqual(avg_ages, {self.today: 40})
+        self.assertEqual(outputs, self.read_outputs())
+        self.assertEqual(mock_upload.call_count, 2)
+        self.assertTrue(
+            mock_upload.call_args.args[2].endswith(os.path.join("json", self.today))
+        )
+
+    def test_pipeline_partitions_by_day(self):
+        # file0.xml was modified two days ago, its run was missed
+        self.file_attrs[0].st_mtime = time.time() - 2 * 86400
+        missed_day = partition_of(self.file_attrs[0].st_mtime)
+
+        avg_ages, mock_upload = self.run_pipeline(pool_size=2, transform_workers=1)
+
+        self.assertEqual(avg_ages, {missed_day: 20, self.today: 50})
+        self.assertEqual(sorted(os.listdir("json")), sorted([missed_day, self.today]))
+        self.assertEqual(mock_upload.call_count, 4)
+
+    @patch("pipeline.open_manifest")
+    def test_pipeline_does_not_mark_failed_uploads(self, mock_open_manifest):
+        manifest = mock_open_manifest.return_value
+        manifest.pending.side_effect = lambda names, stage: names
+
+        with patch("pipeline.DOWNLOAD_PATH", self.download_dir), patch(
+            "pipeline.get_due_files", return_value=self.file_attrs
+        ), patch(
+            "pipeline.skip_downloaded_files", side_effect=lambda p, f, m: f
+        ), patch(
+            "pipeline.download_with_pool", side_effect=self.fake_download
+        ), patch(
+            "pipeline.upload_to_s3", side_effect=[{"bytes": 1}, None]
+        ), self.assertLogs(
+            level="ERROR"
+        ):
+            avg_ages = asyncio.run(run_pipeline(pool_size=2, transform_workers=1))
+
+        # One of the two outputs failed, the next run uploads the day again
+        self.assertEqual(avg_ages, {self.today: 40})
+        stages = [call.args[1] for call in manifest.mark.call_args_list]
+        self.assertIn("transformed", stages)
+        self.assertNotIn("uploaded", stages)
+
+    def test_pipeline_skips_failed_downloads(self):
+        with patch("pipeline.DOWNLOAD_PATH", self.download_dir), patch(
+            "pipeline.get_due_files", return_value=self.file_attrs
+        ), patch("pipeline.download_with_pool", return_value=None), patch(
+            "pipeline.upload_to_s3"
+        ) as mock_upload:
+            avg_ages = asyncio.run(run_pipeline(pool_size=2, transform_workers=1))
+
+        self.assertEqual(avg_ages, {})
+        mock_upload.assert_not_called()
+
+    def test_pipeline_without_sftp_connection(self):
+        with patch("pipeline.get_due_files", return_value=None), patch(
+            "pipeline.upload_to_s3"
+        ) as mock_upload:
+            self.assertIsNone(asyncio.run(run_pipeline(pool_size=1)))
+        mock_upload.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import sys
+import os
+
+# Add the `src` directory to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+import threading
+import unittest
+from unittest.mock import MagicMock
+from sftp_connection_pool import SFTPConnectionPool, is_sftp_healthy
+
+
+def make_sftp(active=True):
+    sftp = MagicMock()
+    sftp.get_channel.return_value.get_transport.return_value.is_active.return_value = (
+        active
+    )
+    return sftp
+
+
+class TestSFTPConnectionPool(unittest.TestCase):
+
+    def test_idle_session_is_reused(self):
+        connect = MagicMock(side_effect=lambda: make_sftp())
+        pool = SFTPConnectionPool(connect, size=2)
+
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            pass
+
+        self.assertIs(first, second)
+        connect.assert_called_once()
+
+    def test_each_checkout_gets_its_own_session(self):
+        connect = MagicMock(side_effect=lambda: make_sftp())
+        pool = SFTPConnectionPool(connect, size=2)
+
+        first = pool.checkout()
+        second = pool.checkout()
+
+        self.assertIsNot(first, second)
+        self.assertEqual(connect.call_count, 2)
+
+    def test_checkout_waits_when_pool_is_exhausted(self):
+        pool = SFTPConnectionPool(lambda: make_sftp(), size=1)
+        sftp = pool.checkout()
+        result = []
+
+        waiter = threading.Thread(target=lambda: result.append(pool.checkout()))
+        waiter.start()
+        waiter.join(timeout=0.1)
+        self.assertTrue(waiter.is_alive())
+
+        pool.checkin(sftp)
+        waiter.join(timeout=1)
+        self.assertEqual(result, [sftp])
+
+    def test_unhealthy_session_is_reconnected(self):
+        dead = make_sftp(active=False)
+        fresh = make_sftp()
+        pool = SFTPConnectionPool(MagicMock(side_effect=[dead, fresh]), size=1)
+
+        pool.checkin(pool.checkout())
+        self.assertIs(pool.checkout(), fresh)
+        dead.close.assert_called_once()
+
+    def test_failed_session_is_discarded(self):
+        broken = make_sftp()
+        fresh = make_sftp()
+        pool = SFTPConnectionPool(MagicMock(side_effect=[broken, fresh]), size=1)
+
+        with self.assertRaises(IOError):
+            with pool.connection():
+                raise IOError("Channel closed")
+
+        broken.close.assert_called_once()
+        self.assertIs(pool.checkout(), fresh)
+
+    def test_connection_failure_releases_the_slot(self):
+        sftp = make_sftp()
+        pool = SFTPConnectionPool(MagicMock(side_effect=[None, sftp]), size=1)
+
+        with self.assertRaises(ConnectionError):
+            pool.checkout()
+        self.assertIs(pool.checkout(), sftp)
+
+    def test_close_closes_idle_sessions(self):
+        sftp = make_sftp()
+        pool = SFTPConnectionPool(lambda: sftp, size=1)
+        pool.checkin(pool.checkout())
+
+        pool.close()
+
+        sftp.close.assert_called_once()
+        sftp.get_channel().get_transport().close.assert_called_once()
+
+    def test_is_sftp_healthy(self):
+        self.assertTrue(is_sftp_healthy(make_sftp()))
+        self.assertFalse(is_sftp_healthy(make_sftp(active=False)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+import sys
+import os
+
+# Add the `src` directory to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+import tempfile
+import unittest
+from unittest.mock import patch
+from transform_cache import TransformCache, hash_file, open_transform_cache
+from transform_xml_to_json import spill_xml_file
+
+SAMPLE_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<Users>
+    <User>
+        <UserID>1</UserID>
+        <UserName>Alice</UserName>
+        <UserAge>30</UserAge>
+        <EventTime>2024-07-30T10:00:00</EventTime>
+    </User>
+    <User>
+        <UserID>2</UserID>
+        <UserName>Bob</UserName>
+        <UserAge>40</UserAge>
+        <EventTime>2024-07-30T12:00:00</EventTime>
+    </User>
+</Users>
+"""
+
+
+class TestTransformCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.tmp_dir.name, "cache")
+        self.cache = TransformCache(self.cache_dir, max_bytes=1024)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_file(self, name, data):
+        path = os.path.join(self.tmp_dir.name, name)
+        with open(path, "wb") as file:
+            file.write(data)
+        return path
+
+    def test_hash_depends_on_content_only(self):
+        first = self.write_file("a.xml", b"<Users/>")
+        second = self.write_file("b.xml", b"<Users/>")
+        other = self.write_file("c.xml", b"<Users></Users>")
+        self.assertEqual(hash_file(first), hash_file(second))
+        self.assertNotEqual(hash_file(first), hash_file(other))
+
+    def test_put_and_get(self):
+        shard = self.write_file("1.shard", b"records")
+        self.cache.put("key", shard, 90, 3)
+
+        target = os.path.join(self.tmp_dir.name, "2.shard")
+        self.assertEqual(self.cache.get("key", target), (90, 3))
+        with open(target, "rb") as file:
+            self.assertEqual(file.read(), b"records")
+        self.assertIsNone(self.cache.get("missing", target + ".x"))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        for index, key in enumerate(["old", "used", "new"]):
+            shard = self.write_file(f"{key}.shard", b"x" * 400)
+            self.cache.put(key, shard, index, 1)
+            os.utime(os.path.join(self.cache_dir, f"{key}.json"), (index, index))
+            if key == "used":
+                # Reading "used" makes "old" the least recently used entry
+                self.cache.get("used", os.path.join(self.tmp_dir.name, "hit"))
+
+        target = os.path.join(self.tmp_dir.name, "check")
+        self.assertIsNone(self.cache.get("old", target))
+        self.assertIsNotNone(self.cache.get("used", target + "1"))
+        self.assertIsNotNone(self.cache.get("new", target + "2"))
+
+    def test_cache_is_disabled_by_default(self):
+        with patch("transform_cache.TRANSFORM_CACHE_DIR", None):
+            self.assertIsNone(open_transform_cache())
+
+    def test_identical_file_skips_parsing(self):
+        first = self.write_file("a.xml", SAMPLE_XML.encode())
+        second = self.write_file("b.xml", SAMPLE_XML.encode())
+        cache = TransformCache(self.cache_dir)
+
+        with patch("transform_xml_to_json.open_transform_cache", return_value=cache):
+            first_result = spill_xml_file(first, first + ".shard")
+            with patch("transform_xml_to_json.iter_users") as mock_iter_users:
+                second_result = spill_xml_file(second, second + ".shard")
+            mock_iter_users.assert_not_called()
+
+        self.assertEqual(first_result[:2], second_result[:2])
+        with open(first + ".shard", "rb") as file, open(
+            second + ".shard", "rb"
+        ) as cached_file:
+            self.assertEqual(file.read(), cached_file.read())
+
+
+if __name__ == "__main__":
+    unittest.main()
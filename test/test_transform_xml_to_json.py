@@ -8,16 +8,64 @@ import unittest
 from unittest.mock import MagicMock, patch, mock_open
 import os
 import json
+import tempfile
 from transform_xml_to_json import (
     calculate_average_age,
     get_field,
+    iter_users,
+    iter_spilled_users,
     parse_xml_file,
+    spill_users,
     convert_to_iso8601,
+    INVALID_FIELDS,
+    flush_field_warnings,
+    get_xml_files,
     safe_int_conversion,
+    transform_xml_files,
     write_to_json_file,
     transform_xml_to_json,
 )
+from user_record_store import UserRecordStore
 from xml.etree.ElementTree import Element, SubElement, tostring
+from datetime import datetime
+import random
+
+
+# The original strptime/strftime conversion, the fast path must match it
+def reference_iso8601(event_time):
+    try:
+        event_time_obj = datetime.strptime(event_time, "%Y-%m-%dT%H:%M:%S")
+        return event_time_obj.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+    except ValueError:
+        return "0000-00-00T00:00:00.000Z"
+
+
+SAMPLE_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<Users>
+    <User>
+        <UserID>1</UserID>
+        <UserName>Alice</UserName>
+        <UserAge>30</UserAge>
+        <EventTime>2024-07-30T10:00:00</EventTime>
+    </User>
+    <User>
+        <UserID>2</UserID>
+        <UserAge>invalid</UserAge>
+    </User>
+    <User>
+        <UserID>3</UserID>
+        <UserName>Charlie</UserName>
+        <UserAge>40</UserAge>
+        <EventTime>2024-07-30T12:00:00</EventTime>
+    </User>
+    <User>
+        <UserID>4</UserID>
+        <UserName>David</UserName>
+        <UserAge>20</UserAge>
+        <EventTime>bad</EventTime>
+    </User>
+</Users>
+"""
 
 
 class TestTransformXmlToJson(unittest.TestCase):
@@ -63,6 +111,57 @@ class TestTransformXmlToJson(unittest.TestCase):
         result = convert_to_iso8601(invalid_event_time)
         self.assertEqual(result, "0000-00-00T00:00:00.000Z")
 
+    def test_convert_to_iso8601_matches_strptime(self):
+        values = [
+            "2024-02-29T23:59:59",
+            "2023-02-29T00:00:00",
+            "1900-02-29T00:00:00",
+            "2000-02-29T00:00:00",
+            "2024-04-31T00:00:00",
+            "2024-00-10T00:00:00",
+            "2024-13-10T00:00:00",
+            "2024-01-01T24:00:00",
+            "2024-01-01T00:60:00",
+            "2024-01-01T00:00:60",
+            "0000-01-01T00:00:00",
+            "0999-01-01T00:00:00",
+            "2024-9-1T1:2:3",
+            " 2024-01-01T00:00:00",
+            "2024-01-01T00:00:00 ",
+            "2024-01-01 00:00:00",
+            "\uff12\uff10\uff12\uff14-01-01T00:00:00",
+            "",
+        ]
+        rng = random.Random(0)
+        for _ in range(2000):
+            values.append(
+                f"{rng.randint(0, 9999):04d}-{rng.randint(0, 13):02d}-"
+                f"{rng.randint(0, 32):02d}T{rng.randint(0, 24):02d}:"
+                f"{rng.randint(0, 60):02d}:{rng.randint(0, 61):02d}"
+            )
+
+        for value in values:
+            self.assertEqual(convert_to_iso8601(value), reference_iso8601(value), value)
+
+    def test_invalid_values_are_logged_once_per_field_and_file(self):
+        INVALID_FIELDS.clear()  # left by the conversion tests without a file
+        # The conversion is cached, the count is not
+        with self.assertLogs(level="ERROR") as log:
+            convert_to_iso8601("2024-02-30T00:00:00")
+            convert_to_iso8601("2024-02-30T00:00:00")
+            for value in ("abc", "x", None):
+                safe_int_conversion(value)
+            flush_field_warnings("users.xml")
+
+        self.assertEqual(
+            log.output,
+            [
+                "ERROR:root:2 invalid EventTime values in users.xml, "
+                "first: '2024-02-30T00:00:00'",
+                "ERROR:root:2 invalid UserAge values in users.xml, first: 'abc'",
+            ],
+        )
+
     def test_safe_int_conversion(self):
         result = safe_int_conversion("30")
         self.assertEqual(result, 30)
@@ -96,26 +195,150 @@ class TestTransformXmlToJson(unittest.TestCase):
         )
         mock_open_file().write.assert_called()
 
-    @patch("transform_xml_to_json.parse_xml_file")
+    @patch("transform_xml_to_json.load_user_store")
     @patch("transform_xml_to_json.calculate_average_age")
-    @patch("transform_xml_to_json.write_to_json_file")
+    @patch("transform_xml_to_json.write_lines_to_json_file")
     def test_transform_xml_to_json(
-        self, mock_write_to_json, mock_calculate_average, mock_parse_xml
+        self, mock_write_to_json, mock_calculate_average, mock_load_store
     ):
         # Mock users and average age calculation
-        mock_parse_xml.return_value = [{"UserAge": 30}, {"UserAge": 25}]
+        above = {"UserID": "1", "UserName": "A", "UserAge": 30, "EventTime": "x"}
+        below = {"UserID": "2", "UserName": "B", "UserAge": 25, "EventTime": "y"}
+        mock_load_store.return_value = UserRecordStore.from_users([above, below])
         mock_calculate_average.return_value = 27
 
         transform_xml_to_json("./downloads/file1.xml")
 
         # Ensure users were written to the correct files
-        mock_write_to_json.assert_any_call(
-            "above_average_output.json", [{"UserAge": 30}]
+        written = {
+            call.args[0]: list(call.args[1])
+            for call in mock_write_to_json.call_args_list
+        }
+        self.assertEqual(
+            written,
+            {
+                "above_average_output.json": [json.dumps(above) + "\n"],
+                "below_average_output.json": [json.dumps(below) + "\n"],
+            },
         )
-        mock_write_to_json.assert_any_call(
-            "below_average_output.json", [{"UserAge": 25}]
+
+
+class TestStreamingTransform(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp_dir.name)
+        self.xml_path = os.path.join(self.tmp_dir.name, "users.xml")
+        with open(self.xml_path, "w") as file:
+            file.write(SAMPLE_XML)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp_dir.cleanup()
+
+    def read_outputs(self):
+        outputs = {}
+        for root, _, files in os.walk("json"):
+            for name in files:
+                with open(os.path.join(root, name)) as file:
+                    outputs[name] = file.read()
+        return outputs
+
+    def test_iter_users_matches_parse_xml_file(self):
+        self.assertEqual(list(iter_users(self.xml_path)), parse_xml_file(self.xml_path))
+
+    def test_spill_users_round_trip(self):
+        users = parse_xml_file(self.xml_path)
+        with tempfile.TemporaryFile() as spill_file:
+            total, count = spill_users(iter(users), spill_file)
+            spilled = list(iter_spilled_users(spill_file))
+
+        self.assertEqual((total, count), (90, 3))
+        self.assertEqual(
+            spilled,
+            [
+                (user["UserAge"], json.dumps(user) + "\n")
+                for user in users
+                if user["UserAge"] is not None
+            ],
         )
 
+    def test_calculate_average_age_accepts_generator(self):
+        self.assertEqual(calculate_average_age(iter_users(self.xml_path)), 30)
+
+    def test_calculate_average_age_accepts_record_store(self):
+        store = UserRecordStore.from_users(iter_users(self.xml_path))
+        self.assertEqual(calculate_average_age(store), 30)
+
+    def test_streaming_output_matches_in_memory_output(self):
+        transform_xml_to_json(self.xml_path)
+        expected = self.read_outputs()
+
+        transform_xml_to_json(self.xml_path, streaming=True)
+        self.assertEqual(self.read_outputs(), expected)
+        self.assertIn('"UserID": "3"', expected["above_average_output.json"])
+
+    def test_get_xml_files(self):
+        open(os.path.join(self.tmp_dir.name, "notes.txt"), "w").close()
+        open(os.path.join(self.tmp_dir.name, "a.xml"), "w").close()
+
+        self.assertEqual(
+            get_xml_files(self.tmp_dir.name),
+            [
+                os.path.join(self.tmp_dir.name, "a.xml"),
+                os.path.join(self.tmp_dir.name, "users.xml"),
+            ],
+        )
+
+    def test_transform_xml_files_uses_global_average(self):
+        second_path = os.path.join(self.tmp_dir.name, "more_users.xml")
+        with open(second_path, "w") as file:
+            file.write(
+                "<Users><User><UserID>5</UserID><UserName>Eve</UserName>"
+                "<UserAge>70</UserAge><EventTime>2024-07-30T14:00:00</EventTime>"
+                "</User></Users>"
+            )
+
+        avg_age = transform_xml_files([self.xml_path, second_path])
+        outputs = self.read_outputs()
+
+        # (30 + 40 + 20 + 70) / 4, so Charlie (40) now falls below the average
+        self.assertEqual(avg_age, 40)
+        self.assertEqual(
+            [
+                json.loads(line)["UserID"]
+                for line in outputs["above_average_output.json"].splitlines()
+            ],
+            ["5"],
+        )
+        self.assertEqual(
+            [
+                json.loads(line)["UserID"]
+                for line in outputs["below_average_output.json"].splitlines()
+            ],
+            ["1", "3", "4"],
+        )
+
+    def test_parallel_transform_matches_serial_transform(self):
+        file_paths = []
+        for index in range(3):
+            file_path = os.path.join(self.tmp_dir.name, f"users_{index}.xml")
+            with open(file_path, "w") as file:
+                file.write(SAMPLE_XML.replace("<UserAge>30", f"<UserAge>{index}"))
+            file_paths.append(file_path)
+
+        serial_avg = transform_xml_files(file_paths, max_workers=1)
+        expected = self.read_outputs()
+
+        parallel_avg = transform_xml_files(file_paths, max_workers=3)
+        self.assertEqual(parallel_avg, serial_avg)
+        self.assertEqual(self.read_outputs(), expected)
+
+    def test_transform_xml_files_without_valid_ages(self):
+        self.assertIsNone(transform_xml_files([]))
+        self.assertEqual(self.read_outputs(), {})
+
 
 if __name__ == "__main__":
     unittest.main()
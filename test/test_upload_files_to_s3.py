@@ -4,22 +4,40 @@ import os
 # Add the `src` directory to the Python path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
 
+import importlib.util
+import tempfile
+import time
 import unittest
-from unittest.mock import patch, MagicMock
-from upload_files_to_s3 import upload_to_s3, upload_json_files_to_s3
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import ANY, patch, MagicMock
+from upload_files_to_s3 import (
+    create_s3_client,
+    S3MultipartWriter,
+    get_s3_client,
+    get_s3_path,
+    upload_files_concurrently,
+    upload_to_s3,
+    upload_json_files_to_s3,
+)
+
+HAS_MOTO = importlib.util.find_spec("moto") is not None
 
 
 class TestUploadFilesToS3(unittest.TestCase):
 
-    @patch("boto3.client")
+    def setUp(self):
+        # Every test gets a fresh shared client
+        create_s3_client.cache_clear()
+
+    @patch("boto3.session.Session")
     @patch("os.path.basename")
     @patch("os.path.join")
     def test_upload_to_s3_success(
-        self, mock_os_join, mock_os_basename, mock_boto_client
+        self, mock_os_join, mock_os_basename, mock_boto_session
     ):
         # Mock the S3 client and method
         mock_s3 = MagicMock()
-        mock_boto_client.return_value = mock_s3
+        mock_boto_session.return_value.client.return_value = mock_s3
 
         # Mock the os.path functions
         mock_os_basename.return_value = "test_file.json"
@@ -30,19 +48,63 @@ class TestUploadFilesToS3(unittest.TestCase):
 
         # Verify that the file was uploaded to S3
         mock_s3.upload_file.assert_called_once_with(
-            "test_file.json", "test_bucket", "s3/path/test_file.json"
+            "test_file.json",
+            "test_bucket",
+            "s3/path/test_file.json",
+            Config=ANY,
+            Callback=ANY,
+            ExtraArgs={"ContentType": "application/x-ndjson"},
+        )
+
+    @patch("boto3.session.Session")
+    def test_s3_client_is_reused(self, mock_boto_session):
+        upload_to_s3("first.json", "test_bucket", "s3/path")
+        upload_to_s3("second.json", "test_bucket", "s3/path")
+
+        # The client is created once and shared by both uploads
+        mock_boto_session.assert_called_once()
+        self.assertEqual(
+            mock_boto_session.return_value.client.return_value.upload_file.call_count, 2
+        )
+
+    @patch("boto3.session.Session")
+    def test_s3_client_is_created_once_by_concurrent_uploads(self, mock_boto_session):
+        def slow_client(*args, **kwargs):
+            time.sleep(0.05)
+            return MagicMock()
+
+        mock_boto_session.return_value.client.side_effect = slow_client
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            clients = list(executor.map(lambda _: get_s3_client(), range(4)))
+
+        # The first uploads all wait for the one client being created
+        mock_boto_session.assert_called_once()
+        self.assertEqual(len({id(client) for client in clients}), 1)
+
+    @patch("upload_files_to_s3.upload_to_s3")
+    def test_upload_files_concurrently(self, mock_upload_to_s3):
+        mock_upload_to_s3.side_effect = lambda file_name, *args: (
+            None if file_name == "broken.json" else {"file_name": file_name}
+        )
+
+        stats = upload_files_concurrently(
+            ["a.json", "broken.json", "b.json"], "test_bucket", "s3/path", max_workers=2
         )
 
-    @patch("boto3.client")
+        # Failed uploads are left out of the stats
+        self.assertEqual(stats, [{"file_name": "a.json"}, {"file_name": "b.json"}])
+        mock_upload_to_s3.assert_any_call("broken.json", "test_bucket", "s3/path")
+
+    @patch("boto3.session.Session")
     @patch("os.path.basename")
     @patch("os.path.join")
     def test_upload_to_s3_failure(
-        self, mock_os_join, mock_os_basename, mock_boto_client
+        self, mock_os_join, mock_os_basename, mock_boto_session
     ):
         # Mock the S3 client and method to raise an exception
         mock_s3 = MagicMock()
         mock_s3.upload_file.side_effect = Exception("S3 upload failed")
-        mock_boto_client.return_value = mock_s3
+        mock_boto_session.return_value.client.return_value = mock_s3
 
         # Mock the os.path functions
         mock_os_basename.return_value = "test_file.json"
@@ -102,6 +164,124 @@ class TestUploadFilesToS3(unittest.TestCase):
         # Ensure upload was never called since files don't exist
         mock_upload_to_s3.assert_not_called()
 
+    @patch("upload_files_to_s3.S3_PATH", "exports")
+    @patch("upload_files_to_s3.upload_files_concurrently")
+    def test_upload_json_files_of_partition(self, mock_upload_concurrently):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cwd = os.getcwd()
+            os.chdir(tmp_dir)
+            try:
+                os.makedirs("json/2024-09-08")
+                open("json/2024-09-08/above_average_output.json", "w").close()
+                with self.assertLogs(level="WARNING"):
+                    upload_json_files_to_s3("2024-09-08")
+            finally:
+                os.chdir(cwd)
+
+        # The files of a missed day go under its own json/<date>/ prefix
+        mock_upload_concurrently.assert_called_once_with(
+            ["json/2024-09-08/above_average_output.json"],
+            ANY,
+            "exports/json/2024-09-08",
+        )
+        self.assertEqual(get_s3_path(), "exports")
+
+
+class TestS3MultipartWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.mock_s3 = MagicMock()
+        self.mock_s3.create_multipart_upload.return_value = {"UploadId": "upload-1"}
+        self.mock_s3.upload_part.side_effect = lambda **kwargs: {
+            "ETag": f"etag-{kwargs['PartNumber']}"
+        }
+
+    def test_small_object_uses_put_object(self):
+        with S3MultipartWriter(self.mock_s3, "bucket", "key", part_size=10) as writer:
+            writer.write("abc")
+
+        self.mock_s3.put_object.assert_called_once_with(
+            Bucket="bucket", Key="key", Body=b"abc"
+        )
+        self.mock_s3.create_multipart_upload.assert_not_called()
+
+    def test_parts_are_pushed_as_the_buffer_fills(self):
+        with S3MultipartWriter(self.mock_s3, "bucket", "key", part_size=4) as writer:
+            writer.write("abc")
+            self.mock_s3.upload_part.assert_not_called()
+            writer.write("de")
+            self.assertEqual(self.mock_s3.upload_part.call_count, 1)
+            writer.write("f")
+
+        bodies = [
+            call.kwargs["Body"] for call in self.mock_s3.upload_part.call_args_list
+        ]
+        self.assertEqual(bodies, [b"abcde", b"f"])
+        self.mock_s3.complete_multipart_upload.assert_called_once_with(
+            Bucket="bucket",
+            Key="key",
+            UploadId="upload-1",
+            MultipartUpload={
+                "Parts": [
+                    {"ETag": "etag-1", "PartNumber": 1},
+                    {"ETag": "etag-2", "PartNumber": 2},
+                ]
+            },
+        )
+
+    def test_failed_stream_is_aborted(self):
+        with self.assertRaises(ValueError):
+            with S3MultipartWriter(self.mock_s3, "bucket", "key", part_size=2) as w:
+                w.write("abc")
+                raise ValueError("Serialization failed")
+
+        self.mock_s3.abort_multipart_upload.assert_called_once_with(
+            Bucket="bucket", Key="key", UploadId="upload-1"
+        )
+        self.mock_s3.complete_multipart_upload.assert_not_called()
+
+
+@unittest.skipUnless(HAS_MOTO, "moto is not installed")
+class TestUploadFilesToLocalS3(unittest.TestCase):
+
+    def setUp(self):
+        from moto import mock_aws
+
+        self.mock_aws = mock_aws()
+        self.mock_aws.start()
+        create_s3_client.cache_clear()
+        get_s3_client().create_bucket(Bucket="test-bucket")
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+        create_s3_client.cache_clear()
+        self.mock_aws.stop()
+
+    def test_multipart_upload_to_local_s3(self):
+        file_name = os.path.join(self.tmp_dir.name, "output.json")
+        with open(file_name, "wb") as file:
+            file.write(b"x" * (12 * 1024 * 1024))
+
+        with patch("upload_files_to_s3.S3_MULTIPART_CHUNK_SIZE", 5 * 1024 * 1024):
+            stats = upload_files_concurrently([file_name], "test-bucket", "out")
+
+        self.assertEqual(stats[0]["bytes"], 12 * 1024 * 1024)
+        head = get_s3_client().head_object(Bucket="test-bucket", Key="out/output.json")
+        self.assertEqual(head["ContentLength"], 12 * 1024 * 1024)
+        # Uploaded in 5 MiB parts
+        self.assertTrue(head["ETag"].endswith('-3"'))
+
+    def test_stream_to_local_s3(self):
+        part = "x" * (5 * 1024 * 1024)
+        with S3MultipartWriter(get_s3_client(), "test-bucket", "out/stream.json") as w:
+            w.write(part)
+            w.write(part)
+            w.write("tail\n")
+
+        body = get_s3_client().get_object(Bucket="test-bucket", Key="out/stream.json")
+        self.assertEqual(body["Body"].read(), (part * 2 + "tail\n").encode())
+
 
 if __name__ == "__main__":
     unittest.main()
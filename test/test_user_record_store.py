@@ -0,0 +1,91 @@
+import sys
+import os
+
+# Add the `src` directory to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+import json
+import tracemalloc
+import unittest
+from user_record_store import UserRecordStore, UserRow
+
+USERS = [
+    {
+        "UserID": "1",
+        "UserName": "Jörg",
+        "UserAge": 40,
+        "EventTime": "2024-09-10T12:00:00.000Z",
+    },
+    {"UserID": "2", "UserName": "Ann", "UserAge": None, "EventTime": "x"},
+    {
+        "UserID": "3",
+        "UserName": "Jörg",
+        "UserAge": 2**70,
+        "EventTime": "0000-00-00T00:00:00.000Z",
+    },
+    {"UserID": "4", "UserName": 'A "quoted" name', "UserAge": -5, "EventTime": ""},
+]
+
+
+def make_users(count):
+    return (
+        {
+            "UserID": str(index),
+            "UserName": f"User {index % 100}",
+            "UserAge": 18 + index % 60,
+            "EventTime": f"2024-09-10T12:{index % 60:02}:00.000Z",
+        }
+        for index in range(count)
+    )
+
+
+class TestUserRecordStore(unittest.TestCase):
+
+    def setUp(self):
+        self.store = UserRecordStore.from_users(USERS)
+
+    def test_rows_round_trip(self):
+        self.assertEqual(len(self.store), 4)
+        self.assertEqual([row.to_dict() for row in self.store], USERS)
+        self.assertEqual(self.store[0]["UserName"], "Jörg")
+        self.assertEqual(self.store[2].UserAge, 2**70)
+
+    def test_names_are_interned(self):
+        self.assertEqual(len(self.store.user_names.values), 3)
+
+    def test_rows_have_no_instance_dict(self):
+        self.assertFalse(hasattr(UserRow(self.store, 0), "__dict__"))
+
+    def test_age_stats_skips_missing_ages(self):
+        self.assertEqual(self.store.age_stats(), (40 + 2**70 - 5, 3))
+
+    def test_partition_by_age(self):
+        above, below = self.store.partition_by_age(30)
+        self.assertEqual(list(above), [0, 2])
+        self.assertEqual(list(below), [3])
+
+    def test_json_lines_match_json_dumps(self):
+        self.assertEqual(
+            list(self.store.iter_json_lines(range(len(self.store)))),
+            [json.dumps(user) + "\n" for user in USERS],
+        )
+
+    def test_store_uses_far_less_memory_than_dicts(self):
+        count = 20000
+
+        tracemalloc.start()
+        users = list(make_users(count))
+        dict_size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        tracemalloc.start()
+        store = UserRecordStore.from_users(make_users(count))
+        store_size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        self.assertEqual(len(store), len(users))
+        self.assertGreaterEqual(dict_size / store_size, 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
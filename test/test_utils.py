@@ -0,0 +1,81 @@
+import sys
+import os
+
+# Add the `src` directory to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+import json
+import logging
+import queue
+import unittest
+from unittest.mock import MagicMock
+from xml.etree.ElementTree import Element, SubElement
+from transform_xml_to_json import flush_field_warnings, get_field
+from utils import JsonFormatter, LazyQueueHandler
+
+
+class TestLogging(unittest.TestCase):
+
+    def test_json_formatter_includes_extra_fields(self):
+        record = logging.makeLogRecord(
+            {
+                "msg": "Missing or empty field: %s",
+                "args": ("UserAge",),
+                "levelname": "WARNING",
+                "field": "UserAge",
+            }
+        )
+        entry = json.loads(JsonFormatter().format(record))
+        self.assertEqual(entry["message"], "Missing or empty field: UserAge")
+        self.assertEqual(entry["level"], "WARNING")
+        self.assertEqual(entry["field"], "UserAge")
+
+    def test_queue_handler_formats_the_message(self):
+        log_queue = queue.SimpleQueue()
+        users = ["a"]
+        record = logging.makeLogRecord({"msg": "users %s", "args": (users,)})
+
+        LazyQueueHandler(log_queue).handle(record)
+        users.append("b")
+
+        # The listener gets the message as it was at the log call
+        queued = log_queue.get_nowait()
+        self.assertEqual(queued.getMessage(), "users ['a']")
+        self.assertIsNone(queued.args)
+
+    def test_queue_handler_skips_disabled_levels(self):
+        log_queue = queue.SimpleQueue()
+        logger = logging.getLogger("test_lazy_queue_handler")
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        handler = LazyQueueHandler(log_queue)
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        argument = MagicMock()
+
+        logger.debug("value %s", argument)
+
+        self.assertTrue(log_queue.empty())
+        argument.__str__.assert_not_called()
+
+    def test_missing_fields_are_logged_once_per_field_and_file(self):
+        user = Element("User")
+        SubElement(user, "UserID").text = "1"
+
+        with self.assertLogs(level="WARNING") as log:
+            for _ in range(1000):
+                get_field(user, "UserAge")
+                get_field(user, "UserName")
+            flush_field_warnings("users.xml")
+
+        self.assertEqual(
+            log.output,
+            [
+                "WARNING:root:Missing or empty field: UserAge (1000 times in users.xml)",
+                "WARNING:root:Missing or empty field: UserName (1000 times in users.xml)",
+            ],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
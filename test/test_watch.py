@@ -0,0 +1,237 @@
+import sys
+import os
+
+# Add the `src` directory to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+import tempfile
+import time
+import unittest
+from unittest.mock import patch, MagicMock
+from day_partitions import partition_of
+from transform_xml_to_json import spill_xml_files
+from watch import Backoff, Watcher, watch
+
+USER_XML = (
+    "<Users><User><UserID>{0}</UserID><UserName>User{0}</UserName>"
+    "<UserAge>{1}</UserAge><EventTime>2024-07-30T10:00:00</EventTime>"
+    "</User></Users>"
+)
+
+
+class TestBackoff(unittest.TestCase):
+
+    def test_backoff_doubles_up_to_the_maximum(self):
+        backoff = Backoff(interval=2, max_interval=10)
+        self.assertEqual([backoff.next() for _ in range(5)], [2, 4, 8, 10, 10])
+        self.assertEqual(backoff.reset(), 2)
+        self.assertEqual(backoff.next(), 2)
+
+
+class TestWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp_dir.name)
+        self.addCleanup(os.chdir, self.cwd)
+        self.addCleanup(self.tmp_dir.cleanup)
+        os.makedirs("downloads")
+        for target, value in [
+            ("watch.DOWNLOAD_PATH", "downloads"),
+            ("watch.SPILL_DIR", None),
+            ("watch.DAY_STATE_DIR", None),
+            ("watch.needs_upload", MagicMock(return_value=True)),
+        ]:
+            patcher = patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = patch("watch.upload_json_files_to_s3")
+        self.mock_upload = patcher.start()
+        self.mock_upload.return_value = [{"bytes": 1}, {"bytes": 1}]
+        self.addCleanup(patcher.stop)
+
+    # A file landing on the server: the listing entry and the download that
+    # writes it to the download folder
+    def land(self, name, age):
+        file_attr = MagicMock(filename=name, st_mtime=time.time())
+
+        def download(pool, file_attrs, pool_size, manifest=None):
+            with open(os.path.join("downloads", name), "w") as file:
+                file.write(USER_XML.format(name, age))
+            return [{"file_name": name}]
+
+        return file_attr, download
+
+    def test_micro_batches_update_the_running_average(self):
+        watcher = Watcher(pool_size=1)
+        self.addCleanup(watcher.close)
+        today = partition_of(time.time())
+
+        with patch("day_state.spill_xml_files", wraps=spill_xml_files) as mock_spill:
+            for name, age in [("a.xml", 20), ("b.xml", 40)]:
+                file_attr, download = self.land(name, age)
+                with patch("watch.get_due_files", return_value=[file_attr]), patch(
+                    "watch.download_files", side_effect=download
+                ):
+                    self.assertEqual(watcher.poll(), 1)
+
+        # Only the new file of each batch is parsed
+        self.assertEqual(
+            [call.args[0] for call in mock_spill.call_args_list],
+            [["downloads/a.xml"], ["downloads/b.xml"]],
+        )
+        state = watcher.partitions[today]
+        self.assertEqual((state.total, state.count, state.average), (60, 2, 30))
+
+        # The day is rewritten with the running average and uploaded each time
+        with open(f"json/{today}/above_average_output.json") as file:
+            self.assertIn('"UserID": "b.xml"', file.read())
+        with open(f"json/{today}/below_average_output.json") as file:
+            self.assertIn('"UserID": "a.xml"', file.read())
+        self.assertEqual(
+            [call.args for call in self.mock_upload.call_args_list],
+            [(today,), (today,)],
+        )
+
+    def test_failed_upload_is_retried_by_the_next_poll(self):
+        manifest = MagicMock()
+        watcher = Watcher(pool_size=1, manifest=manifest)
+        self.addCleanup(watcher.close)
+        today = partition_of(time.time())
+        file_attr, download = self.land("a.xml", 20)
+
+        # One of the two outputs does not reach S3
+        self.mock_upload.return_value = [{"bytes": 1}]
+        with patch("watch.get_due_files", return_value=[file_attr]), patch(
+            "watch.download_files", side_effect=download
+        ), self.assertLogs(level="ERROR"):
+            watcher.poll()
+        self.assertEqual(watcher.failed, {today: ["downloads/a.xml"]})
+        manifest.mark.assert_called_once_with(["a.xml"], "transformed")
+
+        # The file is gone from the server, the next poll publishes the day again
+        self.mock_upload.return_value = [{"bytes": 1}, {"bytes": 1}]
+        with patch("watch.get_due_files", return_value=[]):
+            self.assertEqual(watcher.poll(), 0)
+        self.assertEqual(watcher.failed, {})
+        self.assertEqual(self.mock_upload.call_count, 2)
+        manifest.mark.assert_called_with(["a.xml"], "uploaded")
+
+    def test_broken_file_is_rejected_and_the_batch_published(self):
+        watcher = Watcher(pool_size=1)
+        self.addCleanup(watcher.close)
+        today = partition_of(time.time())
+        good_attr, download_good = self.land("good.xml", 30)
+        bad_attr = MagicMock(filename="bad.xml", st_mtime=time.time())
+
+        def download(pool, file_attrs, pool_size, manifest=None):
+            with open(os.path.join("downloads", "bad.xml"), "w") as file:
+                file.write("<Users><User>")
+            return download_good(pool, file_attrs, pool_size) + [
+                {"file_name": "bad.xml"}
+            ]
+
+        with patch("watch.get_due_files", return_value=[good_attr, bad_attr]), patch(
+            "watch.download_files", side_effect=download
+        ), self.assertLogs(level="ERROR") as log:
+            self.assertEqual(watcher.poll(), 2)
+
+        self.assertIn("Cannot parse downloads/bad.xml", log.output[0])
+        self.assertEqual(os.listdir("downloads/rejected"), ["bad.xml"])
+        self.assertEqual(watcher.partitions[today].count, 1)
+        with open(f"json/{today}/below_average_output.json") as file:
+            self.assertIn('"UserID": "good.xml"', file.read())
+        self.assertEqual(watcher.unprocessed, set())
+
+    def test_files_not_added_are_retried_by_the_next_poll(self):
+        watcher = Watcher(pool_size=1)
+        self.addCleanup(watcher.close)
+        today = partition_of(time.time())
+        file_attr, download = self.land("a.xml", 20)
+
+        with patch("watch.get_due_files", return_value=[file_attr]), patch(
+            "watch.download_files", side_effect=download
+        ), patch("watch.add_new_files", side_effect=OSError("No space left")):
+            with self.assertRaises(OSError):
+                watcher.poll()
+        self.assertEqual(watcher.unprocessed, {"downloads/a.xml"})
+
+        # The file is gone from the server, the next poll adds it
+        with patch("watch.get_due_files", return_value=[]):
+            self.assertEqual(watcher.poll(), 0)
+        self.assertEqual(watcher.unprocessed, set())
+        self.assertEqual(watcher.partitions[today].count, 1)
+        self.mock_upload.assert_called_once_with(today)
+
+    def test_poll_without_connection(self):
+        watcher = Watcher(pool_size=1)
+        self.addCleanup(watcher.close)
+        with patch("watch.get_due_files", return_value=None), patch(
+            "watch.download_files"
+        ) as mock_download:
+            self.assertIsNone(watcher.poll())
+        mock_download.assert_not_called()
+
+    def test_poll_takes_the_oldest_files_first(self):
+        watcher = Watcher(pool_size=1, batch_size=1)
+        self.addCleanup(watcher.close)
+        new_attr, _ = self.land("new.xml", 30)
+        old_attr, download = self.land("old.xml", 30)
+        old_attr.st_mtime = new_attr.st_mtime - 60
+
+        with patch("watch.get_due_files", return_value=[new_attr, old_attr]), patch(
+            "watch.download_files", side_effect=download
+        ) as mock_download:
+            watcher.poll()
+
+        self.assertEqual(mock_download.call_args.args[1], [old_attr])
+        self.assertTrue(watcher.pending)
+
+
+class TestWatchLoop(unittest.TestCase):
+
+    @patch("watch.open_manifest", return_value=None)
+    @patch("watch.get_s3_client")
+    @patch("watch.Watcher")
+    def test_watch_backs_off_while_idle(
+        self, mock_watcher, mock_get_s3_client, mock_open_manifest
+    ):
+        watcher = mock_watcher.return_value
+        watcher.pending = False
+        watcher.poll.side_effect = [0, None, Exception("listing failed"), 3, 0]
+        stop_event = MagicMock()
+        stop_event.is_set.return_value = False
+
+        with self.assertLogs(level="ERROR"):
+            watch(stop_event, max_polls=5, backoff=Backoff(2, 60))
+
+        # Empty or failed polls back off, a poll with files resets the wait
+        self.assertEqual(
+            [call.args[0] for call in stop_event.wait.call_args_list], [2, 4, 8, 2]
+        )
+        mock_get_s3_client.assert_called_once()  # warmed before the first file
+        watcher.load_local_files.assert_called_once()
+        watcher.close.assert_called_once()
+
+    @patch("watch.open_manifest", return_value=None)
+    @patch("watch.get_s3_client")
+    @patch("watch.Watcher")
+    def test_watch_outlives_a_failed_start(
+        self, mock_watcher, mock_get_s3_client, mock_open_manifest
+    ):
+        watcher = mock_watcher.return_value
+        watcher.load_local_files.side_effect = OSError("No space left")
+        watcher.poll.return_value = 0
+        stop_event = MagicMock()
+        stop_event.is_set.return_value = False
+
+        with self.assertLogs(level="ERROR"):
+            watch(stop_event, max_polls=2, backoff=Backoff(2, 60))
+
+        self.assertEqual(watcher.poll.call_count, 2)
+        watcher.close.assert_called_once()
+
+
+if __name__ == "__main__":
+    unittest.main()